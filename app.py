@@ -1,7 +1,23 @@
-from flask import Flask
-from models import db, Employee, Admin, Room, Booking, SupportTicket
+import click
+from flask import Flask, current_app
+from flask.cli import with_appcontext
+from models import db, Employee, Admin
+from migrations import migrate, BATCH_SIZE
+from services.booking_import import import_bookings, read_rows, CHUNK_SIZE
+from services import (
+    archive,
+    database,
+    events,
+    fragment_cache,
+    metrics,
+    query_budget,
+    utilisation,
+)
+from services.auth import login_manager
+from services.passwords import hash_password
 import os
 from datetime import datetime
+from functools import lru_cache
 
 # Import blueprints
 from routes.auth import auth_bp
@@ -10,16 +26,34 @@ from routes.rooms import rooms_bp
 from routes.bookings import bookings_bp
 from routes.support import support_bp
 from routes.admin import admin_bp
+from routes.events import events_bp
 
-app = Flask(__name__)
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///meeting_rooms.db"
-app.config["SECRET_KEY"] = os.urandom(32)
+# (environment variable, config key, conversion, default)
+SETTINGS = [
+    ("DATABASE_URL", "SQLALCHEMY_DATABASE_URI", str, "sqlite:///meeting_rooms.db"),
+    ("DATABASE_PROFILE", "DATABASE_PROFILE", str, "production"),
+    ("EVENT_BROKER", "EVENT_BROKER", str, "local"),
+    ("ARCHIVE_AFTER_DAYS", "ARCHIVE_AFTER_DAYS", int, archive.ARCHIVE_AFTER_DAYS),
+    ("METRICS_TOKEN", "METRICS_TOKEN", str, None),
+    ("PROFILER_INTERVAL", "PROFILER_INTERVAL", float, 0),
+    ("SECRET_KEY", "SECRET_KEY", str, None),
+]
 
 
-db.init_app(app)
+def config_from_env(environ=os.environ):
+    """The settings given in the environment, see SETTINGS."""
+    config = {}
+    for variable, key, convert, default in SETTINGS:
+        value = environ.get(variable)
+        config[key] = default if value is None else convert(value)
+    # a secret mounted as a file keeps it out of the process environment
+    if not config["SECRET_KEY"] and environ.get("SECRET_KEY_FILE"):
+        with open(environ["SECRET_KEY_FILE"]) as stream:
+            config["SECRET_KEY"] = stream.read().strip()
+    return config
 
 
-@app.template_filter("iso_to_dmy_hm")
+@lru_cache(maxsize=4096)
 def iso_to_dmy_hm(value):
     if not value:
         return ""
@@ -30,42 +64,148 @@ def iso_to_dmy_hm(value):
         return value
 
 
-# Register blueprints
-app.register_blueprint(auth_bp)
-app.register_blueprint(dashboard_bp)
-app.register_blueprint(rooms_bp)
-app.register_blueprint(bookings_bp)
-app.register_blueprint(support_bp)
-app.register_blueprint(admin_bp)
+def create_app(config=None):
+    """Build the application from the environment, with `config` on top.
 
+    Nothing here touches the database, so a pre-forking server can build
+    the app once and every worker opens its own connections.
+    """
+    app = Flask(__name__)
+    app.config.update(config_from_env())
+    app.config.update(config or {})
+    if not app.config["SECRET_KEY"]:
+        # sessions then end with the process and are not shared between
+        # workers, which only does for development (wsgi.py refuses it)
+        app.config["SECRET_KEY"] = os.urandom(32)
+    database.use_profile(app, app.config["DATABASE_PROFILE"])
+
+    db.init_app(app)
+    database.init_app(app)
+    query_budget.init_app(app)
+    login_manager.init_app(app)
+    fragment_cache.init_app(app)
+    events.init_app(app)
+    metrics.init_app(app)
+
+    app.add_template_filter(iso_to_dmy_hm)
+    for blueprint in BLUEPRINTS:
+        app.register_blueprint(blueprint)
+    for command in COMMANDS:
+        app.cli.add_command(command)
+    return app
+
+
+def init_db(admin_password="admin123", echo=print):
+    """Create or upgrade the database and add an admin if there is nobody."""
+    migrate(echo=echo)
+    if Employee.query.count() == 0:
+        admin_employee = Employee(
+            fname="Admin",
+            lname="User",
+            email="admin@caa.co.uk",
+            password=hash_password(admin_password),
+            role="admin",
+        )
+        db.session.add(admin_employee)
+        db.session.flush()  # Flush to get the employeeid
+
+        admin = Admin(
+            employeeid=admin_employee.employeeid,
+            fname="Admin",
+            lname="User",
+            email="admin@caa.co.uk",
+        )
+        db.session.add(admin)
+
+        db.session.commit()
+        echo("Database initialized with admin account")
+
+
+@click.command("init-db")
+@click.option(
+    "--admin-password",
+    envvar="ADMIN_PASSWORD",
+    default="admin123",
+    help="For the first admin account, if there are no employees yet.",
+)
+@with_appcontext
+def init_db_command(admin_password):
+    """Create or upgrade the database, run once before starting the app."""
+    init_db(admin_password, echo=click.echo)
+
+
+@click.command("migrate-db")
+@click.option("--batch-size", default=BATCH_SIZE, show_default=True)
+@with_appcontext
+def migrate_db_command(batch_size):
+    """Upgrade an existing database to the current schema."""
+    migrate(batch_size, echo=click.echo)
 
-def init_db():
-    with app.app_context():
-        db.create_all()
-        # Create admin account if no employees exist
-        if Employee.query.count() == 0:
-            admin_employee = Employee(
-                fname="Admin",
-                lname="User",
-                email="admin@caa.co.uk",
-                password="admin123",
-                role="admin",
-            )
-            db.session.add(admin_employee)
-            db.session.flush()  # Flush to get the employeeid
-
-            admin = Admin(
-                employeeid=admin_employee.employeeid,
-                fname="Admin",
-                lname="User",
-                email="admin@caa.co.uk",
-            )
-            db.session.add(admin)
-
-            db.session.commit()
-            print("Database initialized with admin account")
+
+@click.command("rebuild-utilisation")
+@with_appcontext
+def rebuild_utilisation_command():
+    """Recompute the room utilisation summary from the bookings."""
+    utilisation.rebuild(echo=click.echo)
+
+
+@click.command("archive-bookings")
+@click.option(
+    "--older-than-days",
+    type=int,
+    default=None,
+    help="Defaults to ARCHIVE_AFTER_DAYS.",
+)
+@click.option("--chunk-size", default=archive.CHUNK_SIZE, show_default=True)
+@with_appcontext
+def archive_bookings_command(older_than_days, chunk_size):
+    """Move bookings that finished long ago into bookings_archive."""
+    if older_than_days is None:
+        older_than_days = current_app.config["ARCHIVE_AFTER_DAYS"]
+    moved = archive.archive_bookings(older_than_days, chunk_size)
+    click.echo(f"Archived {moved} bookings")
+
+
+@click.command("import-bookings")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--chunk-size", default=CHUNK_SIZE, show_default=True)
+@with_appcontext
+def import_bookings_command(path, chunk_size):
+    """Import bookings from a CSV, JSON or JSON Lines file."""
+    with open(path, "rb") as stream:
+        results = import_bookings(read_rows(stream, path), chunk_size)
+
+    for result in results:
+        if result.status == "accepted":
+            click.echo(f"line {result.line}: accepted as booking {result.bookingid}")
+        else:
+            click.echo(f"line {result.line}: rejected, {result.reason}")
+    accepted = sum(1 for result in results if result.status == "accepted")
+    click.echo(f"Imported {accepted} of {len(results)} bookings")
+
+
+BLUEPRINTS = [
+    auth_bp,
+    dashboard_bp,
+    rooms_bp,
+    bookings_bp,
+    support_bp,
+    admin_bp,
+    events_bp,
+]
+
+COMMANDS = [
+    init_db_command,
+    migrate_db_command,
+    rebuild_utilisation_command,
+    archive_bookings_command,
+    import_bookings_command,
+]
 
 
 if __name__ == "__main__":
-    init_db()
+    # the development server, see the README for running in production
+    app = create_app()
+    with app.app_context():
+        init_db()
     app.run(debug=True, host="0.0.0.0", port=8000)
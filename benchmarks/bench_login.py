@@ -0,0 +1,122 @@
+"""Measure login throughput at a given password hash cost.
+
+Run from the project root:
+
+    python -m benchmarks.bench_login --method scrypt:32768:8:1 --threads 8
+
+Employees are seeded into a temporary SQLite file and the login view is
+hit from several client threads at once for a fixed time. Requests turned
+away because the hash pool was full are counted separately.
+"""
+
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+
+from flask import Flask
+from sqlalchemy import insert
+
+from models import db, Employee
+from routes.auth import auth_bp
+from routes.dashboard import dashboard_bp
+from services.auth import login_manager
+from services.passwords import hash_password
+
+PASSWORD = "correct horse battery"
+
+
+def make_app(path, args):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    app = Flask("app", root_path=root)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{path}"
+    app.config["SECRET_KEY"] = "bench"
+    app.config["PASSWORD_HASH_METHOD"] = args.method
+    if args.workers:
+        app.config["PASSWORD_HASH_WORKERS"] = args.workers
+    db.init_app(app)
+    login_manager.init_app(app)
+    app.register_blueprint(auth_bp)
+    app.register_blueprint(dashboard_bp)
+    return app
+
+
+def seed(employees):
+    stored = hash_password(PASSWORD)
+    db.session.execute(
+        insert(Employee),
+        [
+            {
+                "fname": "Bench",
+                "lname": f"User{i}",
+                "email": f"user{i}@caa.co.uk",
+                "password": stored,
+                "role": "staff",
+            }
+            for i in range(employees)
+        ],
+    )
+    db.session.commit()
+
+
+def client_loop(app, args, deadline, latencies, statuses, seed_value):
+    rng = random.Random(seed_value)
+    client = app.test_client()
+    while time.perf_counter() < deadline:
+        email = f"User{rng.randrange(args.employees)}@CAA.co.uk"
+        password = PASSWORD if rng.random() >= args.bad_ratio else "wrong"
+        start = time.perf_counter()
+        response = client.post("/login", data={"email": email, "password": password})
+        latencies.append(time.perf_counter() - start)
+        statuses.append(response.status_code)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--method", default="scrypt:32768:8:1")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--employees", type=int, default=1000)
+    parser.add_argument("--bad-ratio", type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = make_app(os.path.join(tmp, "bench.db"), args)
+        with app.app_context():
+            db.create_all()
+            seed(args.employees)
+
+        latencies = []
+        statuses = []
+        deadline = time.perf_counter() + args.seconds
+        threads = [
+            threading.Thread(
+                target=client_loop,
+                args=(app, args, deadline, latencies, statuses, i),
+            )
+            for i in range(args.threads)
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+    ok = sum(1 for status in statuses if status in (200, 302))
+    busy = statuses.count(503)
+    quantiles = statistics.quantiles(latencies or [0, 0], n=100)
+    print(f"method {args.method}, {args.threads} client threads")
+    print(f"  requests            {len(statuses):>10}")
+    print(f"  requests/second     {ok / elapsed:>10.1f}")
+    print(f"  turned away (503)   {busy:>10}")
+    print(f"  p50 latency         {quantiles[len(quantiles) // 2] * 1000:>10.1f} ms")
+    print(f"  p95 latency         {quantiles[-5] * 1000:>10.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,681 @@
+"""Time every route of the app at several data scales.
+
+Run from the project root:
+
+    python -m benchmarks.bench_routes --scales small medium --save-baseline
+    python -m benchmarks.bench_routes --scales small medium
+
+Each scale is generated once by benchmarks.datagen and kept in --data-dir,
+then copied to a scratch database for the run. Every route is driven
+through the Flask test client as a signed-in user, recording latency
+percentiles, SQL statements per request and the peak memory allocated
+while handling one request. With --save-baseline the results are stored;
+otherwise they are compared against the stored baseline and the run
+fails if any route got slower, ran more queries or used more memory.
+Views declaring a @query_budget fail the run whenever they exceed it.
+"""
+
+import argparse
+import io
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from itertools import count
+
+from flask import g
+
+from app import create_app, iso_to_dmy_hm
+from benchmarks.datagen import (
+    PASSWORD,
+    SCALES,
+    employee_email,
+    generate,
+)
+from models import db, Booking, BookingSeries, SupportTicket, to_epoch
+from services.auth import user_cache
+from services.booking_index import booking_index
+from services.passwords import hash_password
+from services.room_catalog import room_catalog
+
+SCRATCH = tempfile.mkdtemp(prefix="bench-routes-")
+SCRATCH_DB = os.path.join(SCRATCH, "bench.db")
+
+app = create_app(
+    {
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{SCRATCH_DB}",
+        "SECRET_KEY": "bench",
+        # hashing cost is measured by bench_login, keep it out of the way here
+        "PASSWORD_HASH_METHOD": "pbkdf2:sha256:1000",
+        # a view running more statements than its @query_budget fails
+        "QUERY_BUDGET_ENFORCE": True,
+    }
+)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE = os.path.join(HERE, "baseline.json")
+DATA_DIR = os.path.join(HERE, ".data")
+# streams never finish, so there is nothing to time, and the profiler
+# dump only exists when profiling is on
+SKIPPED = {"static", "events.room_events", "admin.admin_slowest_requests"}
+
+# new bookings go in the evening, clear of the generated ones
+FIRST_FREE_DAY = 90
+
+Scenario = namedtuple("Scenario", ["name", "endpoint", "run", "prepare", "mutates"])
+
+statements = []
+
+
+class Skipped(Exception):
+    pass
+
+
+@app.after_request
+def _record_statements(response):
+    statements.append(g.get("sql_statements", 0))
+    return response
+
+
+def _sign_in(email):
+    client = app.test_client()
+    response = client.post("/login", data={"email": email, "password": PASSWORD})
+    assert response.status_code == 302, f"could not sign in as {email}"
+    return client
+
+
+def _slot(n, rooms, hour, minutes=60):
+    day = datetime.combine(date.today(), datetime.min.time()) + timedelta(
+        days=FIRST_FREE_DAY + n // rooms
+    )
+    begin = day + timedelta(hours=hour)
+    return (
+        n % rooms + 1,
+        begin.isoformat(timespec="minutes"),
+        (begin + timedelta(minutes=minutes)).isoformat(timespec="minutes"),
+    )
+
+
+class Context:
+    """Signed-in clients and the ids that later scenarios act on."""
+
+    def __init__(self, sizes):
+        self.sizes = sizes
+        self.rooms = sizes["rooms"]
+        self.anonymous = app.test_client()
+        self.staff = _sign_in(employee_email(1))
+        self.admin = _sign_in(employee_email(0))
+        self.counter = count()
+        self.queue = []
+        with app.app_context():
+            upcoming = (
+                Booking.query.filter(
+                    Booking.timebegin_epoch > to_epoch(datetime.now() + timedelta(1))
+                )
+                .order_by(Booking.timebegin_epoch)
+                .first()
+            )
+            self.taken = (upcoming.roomid, upcoming.timebegin, upcoming.timefinish)
+
+    def next(self):
+        return next(self.counter)
+
+    def new_booking(self, hour):
+        roomid, begin, finish = _slot(self.next(), self.rooms, hour)
+        return self.staff.post(
+            "/bookings/new",
+            data={"roomid": roomid, "timebegin": begin, "timefinish": finish},
+        )
+
+
+def _tomorrow(hour):
+    day = date.today() + timedelta(days=1)
+    return f"{day.isoformat()}T{hour:02d}:00"
+
+
+def _import_file(ctx):
+    lines = ["employeeid,roomid,timebegin,timefinish"]
+    for _ in range(20):
+        roomid, begin, finish = _slot(ctx.next(), ctx.rooms, 23, minutes=30)
+        lines.append(f"2,{roomid},{begin},{finish}")
+    return (io.BytesIO("\n".join(lines).encode()), "bookings.csv")
+
+
+def _scenarios():
+    marks = {}
+
+    def mark(model, column):
+        # everything above the current highest id was made by the run
+        def prepare(ctx):
+            with app.app_context():
+                marks[model] = db.session.query(db.func.max(column)).scalar() or 0
+
+        return prepare
+
+    def since(model, column):
+        def prepare(ctx):
+            if model not in marks:
+                raise Skipped(f"run with the scenario creating {model.__name__}")
+            with app.app_context():
+                query = db.session.query(column).filter(column > marks[model])
+                ctx.queue = [row_id for (row_id,) in query]
+
+        return prepare
+
+    def remember_etag(path):
+        def prepare(ctx):
+            ctx.etag = ctx.staff.get(path).headers["ETag"]
+
+        return prepare
+
+    def take(ctx):
+        return ctx.queue.pop(0)
+
+    return [
+        Scenario("GET /", "dashboard.index", lambda c: c.staff.get("/"), None, False),
+        Scenario(
+            "GET /login", "auth.login", lambda c: c.anonymous.get("/login"), None, False
+        ),
+        Scenario(
+            "POST /login",
+            "auth.login",
+            lambda c: app.test_client().post(
+                "/login", data={"email": employee_email(1), "password": PASSWORD}
+            ),
+            None,
+            False,
+        ),
+        Scenario(
+            "GET /logout",
+            "auth.logout",
+            lambda c: c.queue.pop().get("/logout"),
+            lambda c: setattr(
+                c, "queue", [_sign_in(employee_email(1)) for _ in range(c.iterations)]
+            ),
+            True,
+        ),
+        Scenario(
+            "GET /dashboard",
+            "dashboard.dashboard",
+            lambda c: c.staff.get("/dashboard"),
+            None,
+            False,
+        ),
+        Scenario(
+            "GET /admin/dashboard",
+            "dashboard.admin_dashboard",
+            lambda c: c.admin.get("/admin/dashboard"),
+            None,
+            False,
+        ),
+        Scenario("GET /rooms", "rooms.rooms", lambda c: c.staff.get("/rooms"), None, False),
+        Scenario(
+            "GET /rooms/available",
+            "rooms.available_rooms",
+            lambda c: c.staff.get(
+                "/rooms/available",
+                query_string={
+                    "timebegin": _tomorrow(10),
+                    "timefinish": _tomorrow(11),
+                    "capacity": "6",
+                },
+            ),
+            None,
+            False,
+        ),
+        Scenario(
+            "GET /rooms/<id>",
+            "rooms.room_detail",
+            lambda c: c.staff.get(f"/rooms/{c.next() % c.rooms + 1}"),
+            None,
+            False,
+        ),
+        Scenario(
+            "GET /rooms/<id> (not modified)",
+            "rooms.room_detail",
+            lambda c: c.staff.get("/rooms/1", headers={"If-None-Match": c.etag}),
+            remember_etag("/rooms/1"),
+            False,
+        ),
+        Scenario(
+            "GET /bookings",
+            "bookings.bookings",
+            lambda c: c.staff.get("/bookings"),
+            None,
+            False,
+        ),
+        Scenario(
+            "GET /bookings/history",
+            "bookings.booking_history",
+            lambda c: c.staff.get("/bookings/history"),
+            None,
+            False,
+        ),
+        Scenario(
+            "GET /bookings/export.csv (floor)",
+            "bookings.export_bookings",
+            lambda c: c.admin.get("/bookings/export.csv?floor=1"),
+            None,
+            False,
+        ),
+        Scenario(
+            "GET /bookings/export.ics (own)",
+            "bookings.export_bookings",
+            lambda c: c.staff.get("/bookings/export.ics"),
+            None,
+            False,
+        ),
+        Scenario(
+            "GET /bookings/new",
+            "bookings.new_booking",
+            lambda c: c.staff.get("/bookings/new"),
+            None,
+            False,
+        ),
+        Scenario(
+            "POST /bookings/new (clash)",
+            "bookings.new_booking",
+            lambda c: c.staff.post(
+                "/bookings/new",
+                data=dict(zip(("roomid", "timebegin", "timefinish"), c.taken)),
+            ),
+            None,
+            False,
+        ),
+        Scenario(
+            "POST /bookings/new",
+            "bookings.new_booking",
+            lambda c: c.new_booking(21),
+            mark(Booking, Booking.bookingid),
+            True,
+        ),
+        Scenario(
+            "POST /bookings/<id>/cancel",
+            "bookings.cancel_booking",
+            lambda c: c.staff.post(f"/bookings/{take(c)}/cancel"),
+            since(Booking, Booking.bookingid),
+            True,
+        ),
+        Scenario(
+            "POST /bookings/new (weekly)",
+            "bookings.new_booking",
+            lambda c: c.staff.post(
+                "/bookings/new",
+                data=dict(
+                    zip(
+                        ("roomid", "timebegin", "timefinish"),
+                        _slot(c.next(), c.rooms, 22, minutes=30),
+                    ),
+                    repeat="weekly",
+                    count="4",
+                ),
+            ),
+            mark(BookingSeries, BookingSeries.seriesid),
+            True,
+        ),
+        Scenario(
+            "POST /bookings/series/<id>/skip",
+            "bookings.skip_occurrence",
+            lambda c: c.staff.post(
+                f"/bookings/series/{c.queue[0]}/skip",
+                data={"date": _series_first_date(c.queue.pop(0))},
+            ),
+            since(BookingSeries, BookingSeries.seriesid),
+            True,
+        ),
+        Scenario(
+            "POST /bookings/series/<id>/cancel",
+            "bookings.cancel_series",
+            lambda c: c.staff.post(f"/bookings/series/{take(c)}/cancel"),
+            since(BookingSeries, BookingSeries.seriesid),
+            True,
+        ),
+        Scenario(
+            "GET /support",
+            "support.support",
+            lambda c: c.staff.get("/support"),
+            None,
+            False,
+        ),
+        Scenario(
+            "POST /support",
+            "support.support",
+            lambda c: c.staff.post(
+                "/support", data={"subject": "Bench", "message": "Benchmark ticket"}
+            ),
+            mark(SupportTicket, SupportTicket.ticketid),
+            True,
+        ),
+        Scenario(
+            "POST /support/<id>/delete",
+            "support.delete_ticket",
+            lambda c: c.admin.post(f"/support/{take(c)}/delete"),
+            since(SupportTicket, SupportTicket.ticketid),
+            True,
+        ),
+        Scenario(
+            "POST /admin/rooms/new",
+            "rooms.admin_create_room",
+            lambda c: c.admin.post(
+                "/admin/rooms/new",
+                data={
+                    "roomname": f"Bench Room {c.next()}",
+                    "floor": "1",
+                    "capacity": "8",
+                },
+            ),
+            None,
+            True,
+        ),
+        Scenario(
+            "POST /admin/users/new",
+            "admin.admin_create_user",
+            lambda c: c.admin.post(
+                "/admin/users/new",
+                data={
+                    "fname": "Bench",
+                    "lname": "User",
+                    "email": f"bench{c.next()}@caa.co.uk",
+                    "password": PASSWORD,
+                    "role": "staff",
+                },
+            ),
+            None,
+            True,
+        ),
+        Scenario(
+            "POST /admin/employees/<id>/offboard",
+            "admin.admin_offboard_employee",
+            lambda c: c.admin.post(
+                f"/admin/employees/{c.sizes['employees'] - c.next()}/offboard"
+            ),
+            None,
+            True,
+        ),
+        Scenario(
+            "POST /admin/bookings/cancel (room, week)",
+            "admin.admin_cancel_bookings",
+            lambda c: c.admin.post(
+                "/admin/bookings/cancel",
+                data={
+                    "room": c.next() % c.rooms + 1,
+                    "from": (date.today() + timedelta(days=1)).isoformat(),
+                    "to": (date.today() + timedelta(days=7)).isoformat(),
+                },
+            ),
+            None,
+            True,
+        ),
+        Scenario(
+            "GET /admin/search",
+            "admin.admin_search",
+            lambda c: c.admin.get("/admin/search", query_string={"q": "projector"}),
+            None,
+            False,
+        ),
+        Scenario(
+            "GET /admin/utilisation",
+            "rooms.admin_utilisation",
+            lambda c: c.admin.get("/admin/utilisation", query_string={"view": "week"}),
+            None,
+            False,
+        ),
+        Scenario(
+            "GET /admin/utilisation.csv",
+            "rooms.admin_utilisation_csv",
+            lambda c: c.admin.get("/admin/utilisation.csv"),
+            None,
+            False,
+        ),
+        Scenario(
+            "GET /admin/metrics",
+            "admin.admin_metrics",
+            lambda c: c.admin.get("/admin/metrics"),
+            None,
+            False,
+        ),
+        Scenario(
+            "GET /admin/bookings/import",
+            "admin.admin_import_bookings",
+            lambda c: c.admin.get("/admin/bookings/import"),
+            None,
+            False,
+        ),
+        Scenario(
+            "POST /admin/bookings/import",
+            "admin.admin_import_bookings",
+            lambda c: c.admin.post(
+                "/admin/bookings/import",
+                data={"file": _import_file(c)},
+                content_type="multipart/form-data",
+            ),
+            None,
+            True,
+        ),
+    ]
+
+
+def _series_first_date(seriesid):
+    with app.app_context():
+        return db.session.get(BookingSeries, seriesid).timebegin[:10]
+
+
+def use_database(scale, seed, data_dir):
+    """Point the app at a fresh copy of the generated data for `scale`."""
+    os.makedirs(data_dir, exist_ok=True)
+    # the data is laid out around today, so it is made again each day
+    cached = os.path.join(data_dir, f"{scale}-{seed}-{date.today()}.db")
+
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(SCRATCH_DB + suffix):
+            os.remove(SCRATCH_DB + suffix)
+
+    if os.path.exists(cached):
+        shutil.copyfile(cached, SCRATCH_DB)
+    else:
+        print(f"generating {scale} data set")
+        with app.app_context():
+            db.create_all()
+            generate(
+                scale,
+                seed,
+                password_hash=hash_password(PASSWORD),
+                echo=lambda line: print(f"  {line}"),
+            )
+            db.session.remove()
+            db.engine.dispose()
+        shutil.copyfile(SCRATCH_DB, cached)
+
+    # caches from the previous scale would describe the wrong data
+    user_cache.clear()
+    room_catalog.clear()
+    app.jinja_env.fragment_cache.clear()
+    iso_to_dmy_hm.cache_clear()
+    with app.app_context():
+        booking_index.load()
+
+
+def measure(scenario, ctx, iterations, warmup):
+    ctx.iterations = iterations + 1
+    if scenario.prepare:
+        scenario.prepare(ctx)
+    if not scenario.mutates:
+        for _ in range(warmup):
+            scenario.run(ctx).close()
+
+    latencies = []
+    queries = []
+    status = set()
+    for _ in range(iterations):
+        statements.clear()
+        start = time.perf_counter()
+        response = scenario.run(ctx)
+        response.get_data()
+        latencies.append(time.perf_counter() - start)
+        response.close()
+        queries.append(statements[-1] if statements else 0)
+        status.add(response.status_code)
+
+    # one more request under tracemalloc, kept out of the timings
+    tracemalloc.start()
+    try:
+        scenario.run(ctx).close()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p95_ms": round(cuts[94] * 1000, 2),
+        "p99_ms": round(cuts[98] * 1000, 2),
+        "queries": max(queries),
+        "peak_kib": round(peak / 1024, 1),
+        "status": sorted(status),
+        "budget": getattr(
+            app.view_functions[scenario.endpoint], "query_budget", None
+        ),
+    }
+
+
+def run_scale(scale, seed, data_dir, iterations, warmup, only=None):
+    use_database(scale, seed, data_dir)
+    ctx = Context(SCALES[scale])
+    results = {}
+    print(f"\n{scale}: {SCALES[scale]}")
+    print(
+        f"  {'route':<36}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+        f"{'queries':>9}{'peak KiB':>10}"
+    )
+    for scenario in _scenarios():
+        if only and not any(part in scenario.name for part in only):
+            continue
+        try:
+            result = measure(scenario, ctx, iterations, warmup)
+        except Skipped as exc:
+            print(f"  {scenario.name:<36}skipped, {exc}")
+            continue
+        results[scenario.name] = result
+        failed = " FAILED" if any(code >= 500 for code in result["status"]) else ""
+        print(
+            f"  {scenario.name:<36}{result['p50_ms']:>9.2f}{result['p95_ms']:>9.2f}"
+            f"{result['p99_ms']:>9.2f}{result['queries']:>9}"
+            f"{result['peak_kib']:>10.1f}{failed}"
+        )
+    return results
+
+
+def uncovered():
+    covered = {scenario.endpoint for scenario in _scenarios()}
+    return sorted(
+        rule.endpoint
+        for rule in app.url_map.iter_rules()
+        if rule.endpoint not in covered and rule.endpoint not in SKIPPED
+    )
+
+
+def over_budget(results):
+    """Yield a line for each route that ran more statements than its budget."""
+    for scale, routes in results.items():
+        for name, now in routes.items():
+            if now["budget"] is not None and now["queries"] > now["budget"]:
+                yield (
+                    f"{scale} {name}: {now['queries']} queries, "
+                    f"budget {now['budget']}"
+                )
+
+
+def compare(results, baseline, tolerance):
+    """Yield a line for each measurement that is worse than the baseline."""
+    for scale, routes in results.items():
+        for name, now in routes.items():
+            before = baseline.get(scale, {}).get(name)
+            if before is None:
+                continue
+            # small absolute differences are noise, whatever the ratio
+            if now["p95_ms"] > before["p95_ms"] * (1 + tolerance) + 2:
+                yield (
+                    f"{scale} {name}: p95 {before['p95_ms']} -> {now['p95_ms']} ms"
+                )
+            if now["queries"] > before["queries"]:
+                yield (
+                    f"{scale} {name}: queries {before['queries']} -> {now['queries']}"
+                )
+            if now["peak_kib"] > before["peak_kib"] * (1 + tolerance) + 64:
+                yield (
+                    f"{scale} {name}: peak {before['peak_kib']} -> "
+                    f"{now['peak_kib']} KiB"
+                )
+            if any(code >= 500 for code in now["status"]):
+                yield f"{scale} {name}: server error {now['status']}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scales", nargs="+", choices=sorted(SCALES), default=["small"])
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--only", nargs="*", help="routes whose name contains any")
+    args = parser.parse_args(argv)
+
+    for endpoint in uncovered():
+        print(f"warning: no scenario for {endpoint}")
+
+    try:
+        results = {
+            scale: run_scale(
+                scale, args.seed, args.data_dir, args.iterations, args.warmup, args.only
+            )
+            for scale in args.scales
+        }
+    finally:
+        shutil.rmtree(SCRATCH, ignore_errors=True)
+
+    # budgets hold whatever the baseline says, and a baseline never breaks one
+    overruns = list(over_budget(results))
+    if overruns:
+        print()
+        for line in overruns:
+            print(f"OVER BUDGET {line}")
+        return 1
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as stream:
+                baseline = json.load(stream)
+        baseline.update(results)
+        with open(args.baseline, "w") as stream:
+            json.dump(baseline, stream, indent=2, sort_keys=True)
+        print(f"\nbaseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("\nno baseline to compare with, run with --save-baseline first")
+        return 0
+    with open(args.baseline) as stream:
+        regressions = list(compare(results, json.load(stream), args.tolerance))
+    print()
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    if not regressions:
+        print("no regressions against the baseline")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
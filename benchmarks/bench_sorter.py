@@ -0,0 +1,139 @@
+"""Compare ways of ordering the booking list views.
+
+Run from the project root:
+
+    python -m benchmarks.bench_sorter --sizes 10000 100000
+
+Each size is loaded into an in-memory SQLite database and ordered by
+(room name, start time) three ways: the old recursive quicksort,
+``sorted`` with a key and ORDER BY in the query.
+"""
+
+import argparse
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from flask import Flask
+from sqlalchemy import insert
+
+from models import db, Employee, Room, Booking, to_epoch
+
+
+def legacy_sorter(items, key_func):
+    # the recursive quicksort the list views used before
+    if len(items) <= 1:
+        return items
+
+    pivot = items[len(items) // 2]
+    left = [item for item in items if key_func(item) < key_func(pivot)]
+    middle = [item for item in items if key_func(item) == key_func(pivot)]
+    right = [item for item in items if key_func(item) > key_func(pivot)]
+
+    return legacy_sorter(left, key_func) + middle + legacy_sorter(right, key_func)
+
+
+def sorter(items, key_func):
+    # key_func is called once per item and equal keys keep their order
+    return sorted(items, key=key_func)
+
+
+def booking_key(booking):
+    return (
+        booking.room.roomname if booking.room is not None else "",
+        booking.timebegin,
+    )
+
+
+def make_app():
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///:memory:"
+    db.init_app(app)
+    return app
+
+
+def seed(size, rooms=300, seed_value=1):
+    rng = random.Random(seed_value)
+    db.session.add(
+        Employee(fname="Bench", lname="User", email="bench@caa.co.uk", password="x")
+    )
+    db.session.execute(
+        insert(Room),
+        [
+            {"floor": i % 10, "roomname": f"Room {i:03d}", "capacity": 8}
+            for i in range(rooms)
+        ],
+    )
+    rows = []
+    # bookings in a room may not overlap, so each takes a distinct hour
+    # (8:00 to 18:00 through 2026), drawn in random order for the sorts
+    hours = 10
+    slots = rng.sample(range(rooms * 365 * hours), size)
+    for slot in slots:
+        room, slot = divmod(slot, 365 * hours)
+        day, hour = divmod(slot, hours)
+        begin = datetime(2026, 1, 1, 8 + hour) + timedelta(days=day)
+        finish = begin + timedelta(hours=1)
+        rows.append(
+            {
+                "employeeid": 1,
+                "roomid": room + 1,
+                "timebegin": begin.isoformat(),
+                "timefinish": finish.isoformat(),
+                "timebegin_epoch": to_epoch(begin),
+                "timefinish_epoch": to_epoch(finish),
+            }
+        )
+    db.session.execute(insert(Booking), rows)
+    db.session.commit()
+
+
+def timed(label, func):
+    db.session.expunge_all()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<28}{elapsed * 1000:>10.1f} ms")
+    return [booking.bookingid for booking in result]
+
+
+def run(size):
+    app = make_app()
+    with app.app_context():
+        db.create_all()
+        seed(size)
+        print(f"{size} bookings")
+
+        legacy = timed(
+            "recursive quicksort",
+            lambda: legacy_sorter(Booking.query.all(), key_func=booking_key),
+        )
+        helper = timed(
+            "sorter (decorate once)",
+            lambda: sorter(Booking.query.all(), key_func=booking_key),
+        )
+        pushed = timed(
+            "ORDER BY with join",
+            lambda: Booking.query.join(Booking.room)
+            .order_by(Room.roomname, Booking.timebegin_epoch, Booking.bookingid)
+            .all(),
+        )
+
+        # legacy and helper only differ in how ties are ordered
+        assert len(legacy) == len(helper) == len(pushed) == size
+        db.drop_all()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    args = parser.parse_args(argv)
+    # the old quicksort recurses once per level of uneven splits
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 10_000))
+    for size in args.sizes:
+        run(size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""Seeded synthetic data for benchmarks.
+
+    python -m benchmarks.datagen --scale medium --database /tmp/medium.db
+
+Fills an empty database with rooms, employees, historical and upcoming
+bookings, recurring series and support tickets. The same scale and seed
+always produce the same rows. Bookings never overlap within a room, so
+the data passes the same checks as bookings made through the app.
+"""
+
+import argparse
+import random
+from datetime import datetime, timedelta
+
+from flask import Flask
+from sqlalchemy import insert
+from werkzeug.security import generate_password_hash
+
+from models import (
+    db,
+    Admin,
+    Booking,
+    BookingSeries,
+    Employee,
+    Room,
+    SupportTicket,
+    to_epoch,
+)
+from services import utilisation
+from services.recurrence import Recurrence
+
+SCALES = {
+    "small": {
+        "rooms": 30,
+        "employees": 200,
+        "bookings": 10_000,
+        "series": 20,
+        "tickets": 100,
+    },
+    "medium": {
+        "rooms": 300,
+        "employees": 2_000,
+        "bookings": 100_000,
+        "series": 200,
+        "tickets": 1_000,
+    },
+    "large": {
+        "rooms": 300,
+        "employees": 2_000,
+        "bookings": 1_000_000,
+        "series": 500,
+        "tickets": 5_000,
+    },
+}
+
+PASSWORD = "benchmark-password"
+ADMIN_EMAIL = "admin@caa.co.uk"
+# bookings run this far past today, the rest is history
+UPCOMING_DAYS = 30
+BATCH_SIZE = 50_000
+
+
+def employee_email(i):
+    return ADMIN_EMAIL if i == 0 else f"user{i}@caa.co.uk"
+
+
+def _rooms(rng, count):
+    return [
+        {
+            "floor": i % 10,
+            "roomname": f"Room {i // 10}{chr(65 + i % 10)}",
+            "capacity": rng.choice([4, 6, 8, 10, 12, 20, 40]),
+        }
+        for i in range(count)
+    ]
+
+
+def _employees(count, password):
+    return [
+        {
+            "fname": "Admin" if i == 0 else f"First{i}",
+            "lname": "User" if i == 0 else f"Last{i}",
+            "email": employee_email(i),
+            "password": password,
+            "role": "admin" if i == 0 else ("senior" if i % 10 == 0 else "staff"),
+        }
+        for i in range(count)
+    ]
+
+
+def _bookings(rng, rooms, employees, count, today):
+    """Yield booking rows, a few a day in each room and never overlapping."""
+    # about three bookings a room a day, ending UPCOMING_DAYS from today
+    days = max(1, count // (rooms * 3))
+    date = today - timedelta(days=max(0, days - UPCOMING_DAYS))
+    made = 0
+    while True:
+        for roomid in range(1, rooms + 1):
+            # whole or half hours between 08:00 and 18:00
+            slots = sorted(rng.sample(range(16, 36), rng.randint(2, 6)))
+            free_from = 0
+            for slot in slots:
+                if slot < free_from:
+                    continue
+                length = rng.choice([1, 2, 2, 3, 4])
+                begin = date + timedelta(minutes=30 * slot)
+                finish = begin + timedelta(minutes=30 * length)
+                free_from = slot + length
+                yield {
+                    "employeeid": rng.randint(1, employees),
+                    "roomid": roomid,
+                    "timebegin": begin.isoformat(timespec="minutes"),
+                    "timefinish": finish.isoformat(timespec="minutes"),
+                    "timebegin_epoch": to_epoch(begin),
+                    "timefinish_epoch": to_epoch(finish),
+                }
+                made += 1
+                if made == count:
+                    return
+        date += timedelta(days=1)
+
+
+def _series(rng, rooms, employees, count, today):
+    # evening slots, clear of the generated day-time bookings
+    for i in range(count):
+        begin = today + timedelta(days=rng.randint(1, 14), hours=18 + i % 3)
+        finish = begin + timedelta(minutes=rng.choice([30, 60]))
+        frequency = rng.choice(["daily", "weekly", "weekly", "monthly"])
+        interval = rng.choice([1, 1, 2])
+        occurrences = rng.randint(4, 40)
+        last = Recurrence(
+            begin, finish, frequency, interval, None, occurrences, frozenset()
+        ).last()
+        yield {
+            "employeeid": rng.randint(1, employees),
+            # one series per room and slot, so series never clash
+            "roomid": i // 3 % rooms + 1,
+            "timebegin": begin.isoformat(timespec="minutes"),
+            "timefinish": finish.isoformat(timespec="minutes"),
+            "frequency": frequency,
+            "interval": interval,
+            "count": occurrences,
+            "timebegin_epoch": to_epoch(begin),
+            "lastfinish_epoch": to_epoch(last[1]),
+        }
+
+
+def _tickets(rng, employees, count, today):
+    for i in range(count):
+        created = today - timedelta(minutes=rng.randint(0, 60 * 24 * 365))
+        yield {
+            "employeeid": rng.randint(1, employees),
+            "adminid": 1,
+            "subject": f"Ticket {i}",
+            "message": "Projector in the room is not working.",
+            "created_at": created.isoformat(timespec="seconds"),
+            "created_at_epoch": to_epoch(created),
+        }
+
+
+def _insert(model, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            db.session.execute(insert(model), batch)
+            batch = []
+    if batch:
+        db.session.execute(insert(model), batch)
+
+
+def generate(scale="small", seed=1, password_hash=None, echo=print):
+    """Fill the app's (empty) database, returning the counts used.
+
+    Employee 1 is an admin signed in as ADMIN_EMAIL, every employee's
+    password is PASSWORD.
+    """
+    sizes = SCALES[scale] if isinstance(scale, str) else scale
+    rng = random.Random(seed)
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    password = password_hash or generate_password_hash(PASSWORD)
+
+    _insert(Room, _rooms(rng, sizes["rooms"]))
+    _insert(Employee, _employees(sizes["employees"], password))
+    db.session.execute(
+        insert(Admin),
+        [{"employeeid": 1, "fname": "Admin", "lname": "User", "email": ADMIN_EMAIL}],
+    )
+    echo(f"{sizes['rooms']} rooms, {sizes['employees']} employees")
+
+    _insert(
+        Booking,
+        _bookings(rng, sizes["rooms"], sizes["employees"], sizes["bookings"], today),
+    )
+    echo(f"{sizes['bookings']} bookings")
+    _insert(
+        BookingSeries,
+        _series(rng, sizes["rooms"], sizes["employees"], sizes["series"], today),
+    )
+    _insert(SupportTicket, _tickets(rng, sizes["employees"], sizes["tickets"], today))
+    echo(f"{sizes['series']} series, {sizes['tickets']} tickets")
+    db.session.commit()
+    # bulk inserts skip the session hooks that keep the summary up to date
+    utilisation.rebuild(echo)
+    return sizes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--database", required=True)
+    args = parser.parse_args(argv)
+
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{args.database}"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        generate(args.scale, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+# Settings for `gunicorn -c gunicorn.conf.py wsgi:app`. Each can be overridden
+# on the command line, or with the environment variables read below.
+
+import multiprocessing
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+# SQLite allows one writer at a time, so past a couple of workers per core
+# more processes only queue on the write lock
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2))
+# open /events streams hold a thread each, and a worker takes at most
+# WEB_THREADS - 2 of them (routes/events.py). With more than a handful of
+# listeners, run a second pool of this config for /events alone, with few
+# workers and many threads, and send /events to it from the proxy:
+#
+#     WEB_CONCURRENCY=2 WEB_THREADS=64 BIND=127.0.0.1:8002 \
+#         gunicorn -c gunicorn.conf.py wsgi:app
+#
+# EVENT_BROKER must then be a file broker so both pools see every event.
+threads = int(os.environ.get("WEB_THREADS", 8))
+# build the app once in the master and fork it, rather than in every worker
+preload_app = True
+timeout = 60
+
+
+def post_fork(server, worker):
+    # connections must not be shared with the master, so each worker starts
+    # with an empty pool
+    from models import db
+
+    with server.app.wsgi().app_context():
+        db.engine.dispose(close=False)
@@ -0,0 +1,291 @@
+"""Read-only room status API for the tablets outside meeting rooms.
+
+A plain ASGI application, run next to the Flask app with:
+
+    uvicorn kiosk:app --port 8001
+
+    GET /api/rooms/status            every room
+    GET /api/rooms/<roomid>/status   one room
+
+However many kiosks poll, the database is read once per tick: the first
+request after a tick runs the queries and everyone else waiting at that
+moment shares the result.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+from datetime import date, datetime, timedelta
+
+import aiosqlite
+
+from models import to_epoch
+from services.booking_rules import MAX_BOOKING_HOURS
+from services.recurrence import Recurrence
+
+DATABASE = os.environ.get(
+    "KIOSK_DATABASE",
+    os.path.join(os.path.dirname(__file__) or ".", "instance", "meeting_rooms.db"),
+)
+TICK_SECONDS = float(os.environ.get("KIOSK_TICK_SECONDS", 5))
+# how far ahead a kiosk looks for the next booking
+LOOKAHEAD = timedelta(days=7)
+
+# the first two bookings per room that have not finished yet, so the
+# current one (if any) and the one after it
+BOOKINGS_SQL = """
+SELECT r.roomid, r.roomname, r.floor, r.capacity,
+       b.timebegin, b.timefinish, b.timebegin_epoch, b.timefinish_epoch,
+       e.fname, e.lname
+FROM rooms r
+LEFT JOIN (
+    SELECT *, ROW_NUMBER() OVER (
+        PARTITION BY roomid ORDER BY timebegin_epoch
+    ) AS position
+    FROM bookings
+    WHERE timefinish_epoch > :now
+      AND timebegin_epoch > :earliest
+      AND timebegin_epoch < :horizon
+) b ON b.roomid = r.roomid AND b.position <= 2
+LEFT JOIN employees e ON e.employeeid = b.employeeid
+ORDER BY r.floor, r.roomname, r.roomid, b.timebegin_epoch
+"""
+
+SERIES_SQL = """
+SELECT s.roomid, s.timebegin, s.timefinish, s.frequency, s.interval, s.until,
+       s.count, e.fname, e.lname,
+       (SELECT group_concat(x.date) FROM seriesexceptions x
+        WHERE x.seriesid = s.seriesid) AS skipped
+FROM bookingseries s
+JOIN employees e ON e.employeeid = s.employeeid
+WHERE s.timebegin_epoch < :horizon AND s.lastfinish_epoch > :now
+"""
+
+
+class StatusBoard:
+    """The status of every room, refreshed at most once per tick."""
+
+    def __init__(self, path=DATABASE, tick=TICK_SECONDS):
+        self.path = path
+        self.tick = tick
+        self._db = None
+        self._snapshot = None
+        self._taken = 0.0
+        self._pending = None
+
+    async def open(self):
+        self._db = await aiosqlite.connect(f"file:{self.path}?mode=ro", uri=True)
+        await self._db.execute("PRAGMA busy_timeout = 5000")
+
+    async def close(self):
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+
+    async def snapshot(self):
+        if self._snapshot is not None and time.monotonic() - self._taken < self.tick:
+            return self._snapshot
+        if self._pending is None:
+            self._pending = asyncio.ensure_future(self._refresh())
+        # a client hanging up must not cancel the refresh for the others
+        return await asyncio.shield(self._pending)
+
+    async def _refresh(self):
+        try:
+            if self._db is None:
+                await self.open()
+            snapshot = await self._load(datetime.now().replace(microsecond=0))
+            self._snapshot, self._taken = snapshot, time.monotonic()
+            return snapshot
+        finally:
+            self._pending = None
+
+    async def _load(self, now):
+        params = {
+            "now": to_epoch(now),
+            "earliest": to_epoch(now - timedelta(hours=MAX_BOOKING_HOURS)),
+            "horizon": to_epoch(now + LOOKAHEAD),
+        }
+        rooms = {}
+        upcoming = {}
+        async with self._db.execute(BOOKINGS_SQL, params) as cursor:
+            async for row in cursor:
+                roomid, roomname, floor, capacity, begin, finish = row[:6]
+                rooms.setdefault(
+                    roomid,
+                    {
+                        "roomid": roomid,
+                        "roomname": roomname,
+                        "floor": floor,
+                        "capacity": capacity,
+                    },
+                )
+                spans = upcoming.setdefault(roomid, [])
+                if begin is not None:
+                    spans.append((row[6], row[7], begin, finish, _name(row[8:10])))
+
+        async with self._db.execute(SERIES_SQL, params) as cursor:
+            async for row in cursor:
+                if row[0] in upcoming:
+                    upcoming[row[0]].extend(_series_spans(row, now))
+
+        current_epoch = params["now"]
+        for roomid, room in rooms.items():
+            spans = sorted(upcoming[roomid])
+            current = next((s for s in spans if s[0] <= current_epoch < s[1]), None)
+            following = next((s for s in spans if s[0] > current_epoch), None)
+            room["free"] = current is None
+            room["current"] = _describe(current)
+            room["next"] = _describe(following)
+        # worked out once a tick, a kiosk whose copy is current gets a 304
+        etags = {roomid: _etag(room) for roomid, room in rooms.items()}
+        return {
+            "generated_at": now.isoformat(),
+            "rooms": rooms,
+            "etags": etags,
+            "etag": _etag(sorted(etags.items())),
+        }
+
+
+def _etag(value):
+    data = json.dumps(value, sort_keys=True).encode()
+    return '"' + hashlib.blake2b(data, digest_size=12).hexdigest() + '"'
+
+
+def _name(parts):
+    return " ".join(part for part in parts if part)
+
+
+def _series_spans(row, now):
+    # the first two occurrences that have not finished yet
+    timebegin, timefinish, frequency, interval, until, count = row[1:7]
+    skipped = row[9].split(",") if row[9] else ()
+    recurrence = Recurrence(
+        datetime.fromisoformat(timebegin),
+        datetime.fromisoformat(timefinish),
+        frequency,
+        interval or 1,
+        date.fromisoformat(until) if until else None,
+        count,
+        frozenset(date.fromisoformat(day) for day in skipped),
+    )
+    spans = []
+    for start, end in recurrence.occurrences(now, now + LOOKAHEAD):
+        spans.append(
+            (
+                to_epoch(start),
+                to_epoch(end),
+                start.isoformat(),
+                end.isoformat(),
+                _name(row[7:9]),
+            )
+        )
+        if len(spans) == 2:
+            break
+    return spans
+
+
+def _describe(span):
+    if span is None:
+        return None
+    return {"timebegin": span[2], "timefinish": span[3], "booked_by": span[4]}
+
+
+board = StatusBoard()
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    parts = scope["path"].strip("/").split("/")
+    if scope["method"] != "GET":
+        await _respond(send, 405, {"error": "method not allowed"})
+    elif parts == ["api", "rooms", "status"]:
+        snapshot = await board.snapshot()
+        if _matches(scope, snapshot["etag"]):
+            await _not_modified(send, snapshot["etag"])
+            return
+        await _respond(
+            send,
+            200,
+            {
+                "generated_at": snapshot["generated_at"],
+                "rooms": list(snapshot["rooms"].values()),
+            },
+            snapshot["etag"],
+        )
+    elif len(parts) == 4 and parts[:2] == ["api", "rooms"] and parts[3] == "status":
+        snapshot = await board.snapshot()
+        room = snapshot["rooms"].get(int(parts[2])) if parts[2].isdigit() else None
+        if room is None:
+            await _respond(send, 404, {"error": "no such room"})
+            return
+        etag = snapshot["etags"][room["roomid"]]
+        if _matches(scope, etag):
+            await _not_modified(send, etag)
+        else:
+            await _respond(
+                send, 200, {"generated_at": snapshot["generated_at"], **room}, etag
+            )
+    else:
+        await _respond(send, 404, {"error": "not found"})
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            # the database is opened by the first request
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await board.close()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+def _matches(scope, etag):
+    # the ETag leaves out generated_at, so it only changes with the status
+    for name, value in scope["headers"]:
+        if name == b"if-none-match":
+            tags = [tag.strip() for tag in value.decode("latin-1").split(",")]
+            return "*" in tags or etag in tags or f"W/{etag}" in tags
+    return False
+
+
+def _headers(etag):
+    headers = [
+        # kiosks gain nothing from asking more often than a tick
+        (b"cache-control", f"max-age={int(board.tick)}".encode()),
+    ]
+    if etag is not None:
+        headers.append((b"etag", etag.encode()))
+    return headers
+
+
+async def _not_modified(send, etag):
+    await send(
+        {"type": "http.response.start", "status": 304, "headers": _headers(etag)}
+    )
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def _respond(send, status, payload, etag=None):
+    body = json.dumps(payload).encode()
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                *_headers(etag),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,255 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.schema import CreateTable
+
+from models import (
+    db,
+    to_epoch,
+    Booking,
+    RoomUtilisation,
+    BOOKING_OVERLAP_TRIGGERS,
+    SEARCH_INDEXES,
+    search_index_ddl,
+)
+from services import utilisation
+from services.passwords import hash_password
+
+# Upgrades for databases created before a column or index existed. Every step
+# is safe to run again, and backfills commit in small batches so the app can
+# keep serving while they run.
+
+BATCH_SIZE = 1000
+
+NEW_COLUMNS = {
+    "bookings": [("timebegin_epoch", "INTEGER"), ("timefinish_epoch", "INTEGER")],
+    "supporttickets": [("created_at_epoch", "INTEGER")],
+}
+
+
+def add_missing_columns():
+    inspector = inspect(db.engine)
+    added = []
+    for table, columns in NEW_COLUMNS.items():
+        existing = {column["name"] for column in inspector.get_columns(table)}
+        for name, sql_type in columns:
+            if name not in existing:
+                db.session.execute(
+                    text(f"ALTER TABLE {table} ADD COLUMN {name} {sql_type}")
+                )
+                added.append(f"{table}.{name}")
+    db.session.commit()
+    return added
+
+
+def autoincrement_bookings():
+    """Rebuild `bookings` with AUTOINCREMENT if it was made without it.
+
+    Without it SQLite numbers a new booking one past the highest id in the
+    table, so ids of archived or deleted bookings come round again. Live
+    bookings that already share an id with an archived one get a new id.
+    Returns None if the table needed no rebuild, else how many were renumbered.
+    """
+    if db.engine.dialect.name != "sqlite":
+        return None
+    table_sql = db.session.scalar(
+        text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'bookings'")
+    )
+    db.session.commit()
+    if "AUTOINCREMENT" in table_sql.upper():
+        return None
+
+    create = str(CreateTable(Booking.__table__).compile(db.engine)).replace(
+        "CREATE TABLE bookings ", "CREATE TABLE bookings_rebuilt ", 1
+    )
+    names = [column.name for column in Booking.__table__.columns]
+    columns = ", ".join(names)
+    without_id = ", ".join(name for name in names if name != "bookingid")
+    archived = "SELECT bookingid FROM bookings_archive"
+    connection = db.engine.raw_connection()
+    cursor = connection.cursor()
+    try:
+        # foreign keys have to be off to swap a table, and that can only be
+        # changed outside a transaction
+        cursor.execute("PRAGMA foreign_keys = OFF")
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute(create)
+        cursor.execute(
+            f"INSERT INTO bookings_rebuilt ({columns}) SELECT {columns} "
+            f"FROM bookings WHERE bookingid NOT IN ({archived})"
+        )
+        cursor.execute("DELETE FROM sqlite_sequence WHERE name = 'bookings_rebuilt'")
+        cursor.execute(
+            "INSERT INTO sqlite_sequence (name, seq) SELECT 'bookings_rebuilt', "
+            "max(coalesce((SELECT max(bookingid) FROM bookings), 0), "
+            "coalesce((SELECT max(bookingid) FROM bookings_archive), 0))"
+        )
+        renumbered = cursor.execute(
+            f"INSERT INTO bookings_rebuilt ({without_id}) SELECT {without_id} "
+            f"FROM bookings WHERE bookingid IN ({archived}) ORDER BY bookingid"
+        ).rowcount
+        # its indexes and triggers go with it, migrate() puts them back
+        cursor.execute("DROP TABLE bookings")
+        cursor.execute("ALTER TABLE bookings_rebuilt RENAME TO bookings")
+        cursor.execute("COMMIT")
+    except Exception:
+        if connection.driver_connection.in_transaction:
+            cursor.execute("ROLLBACK")
+        raise
+    finally:
+        cursor.execute("PRAGMA foreign_keys = ON")
+        cursor.close()
+        connection.close()
+    return renumbered
+
+
+def create_missing_indexes():
+    """Create indexes added since the tables were made.
+
+    Returns the names of unique indexes that existing rows violate, which
+    are left out until the duplicates are fixed.
+    """
+    # create_all only creates indexes together with a new table. The
+    # inspector leaves out expression indexes, so look names up directly
+    existing = {
+        name
+        for (name,) in db.session.execute(
+            text("SELECT name FROM sqlite_master WHERE type = 'index'")
+        )
+    }
+    db.session.commit()
+    skipped = []
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            try:
+                index.create(db.engine)
+            except IntegrityError:
+                skipped.append(index.name)
+    return skipped
+
+
+def create_triggers():
+    # like indexes, create_all only adds triggers together with a new table
+    if db.engine.dialect.name != "sqlite":
+        return
+    for trigger in BOOKING_OVERLAP_TRIGGERS:
+        db.session.execute(text(trigger))
+    db.session.commit()
+
+
+def create_search_indexes():
+    """Create missing full-text indexes and fill them from their tables."""
+    if db.engine.dialect.name != "sqlite":
+        return []
+    created = []
+    for name in SEARCH_INDEXES:
+        exists = db.session.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            {"name": name},
+        ).first()
+        for statement in search_index_ddl(name):
+            db.session.execute(text(statement))
+        if not exists:
+            db.session.execute(text(f"INSERT INTO {name}({name}) VALUES ('rebuild')"))
+            created.append(name)
+    db.session.commit()
+    return created
+
+
+def _backfill(select_sql, update_sql, convert, batch_size):
+    updated = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            text(select_sql), {"last_id": last_id, "limit": batch_size}
+        ).all()
+        if not rows:
+            break
+        params = []
+        for row in rows:
+            try:
+                params.append(convert(row))
+            except ValueError:
+                # unparseable legacy value, leave it for someone to fix by hand
+                pass
+        if params:
+            db.session.execute(text(update_sql), params)
+        db.session.commit()
+        updated += len(params)
+        last_id = rows[-1][0]
+    return updated
+
+
+def backfill_booking_epochs(batch_size=BATCH_SIZE):
+    return _backfill(
+        "SELECT bookingid, timebegin, timefinish FROM bookings "
+        "WHERE timebegin_epoch IS NULL AND bookingid > :last_id "
+        "ORDER BY bookingid LIMIT :limit",
+        "UPDATE bookings SET timebegin_epoch = :begin, timefinish_epoch = :finish "
+        "WHERE bookingid = :id",
+        lambda row: {
+            "id": row[0],
+            "begin": to_epoch(row[1]),
+            "finish": to_epoch(row[2]),
+        },
+        batch_size,
+    )
+
+
+def backfill_ticket_epochs(batch_size=BATCH_SIZE):
+    return _backfill(
+        "SELECT ticketid, created_at FROM supporttickets "
+        "WHERE created_at_epoch IS NULL AND ticketid > :last_id "
+        "ORDER BY ticketid LIMIT :limit",
+        "UPDATE supporttickets SET created_at_epoch = :created WHERE ticketid = :id",
+        lambda row: {"id": row[0], "created": to_epoch(row[1])},
+        batch_size,
+    )
+
+
+def hash_plaintext_passwords(batch_size=BATCH_SIZE):
+    return _backfill(
+        "SELECT employeeid, password FROM employees "
+        "WHERE password NOT LIKE 'scrypt:%$%' AND password NOT LIKE 'pbkdf2:%$%' "
+        "AND employeeid > :last_id ORDER BY employeeid LIMIT :limit",
+        "UPDATE employees SET password = :password WHERE employeeid = :id",
+        lambda row: {"id": row[0], "password": hash_password(row[1])},
+        batch_size,
+    )
+
+
+def dangling_references():
+    """{table: rows} of rows referring to a row that no longer exists.
+
+    Left by deletes made while SQLite was not enforcing foreign keys. They
+    are reported rather than removed, as a change to such a row now fails.
+    """
+    found = {}
+    for row in db.session.execute(text("PRAGMA foreign_key_check")):
+        found[row[0]] = found.get(row[0], 0) + 1
+    return found
+
+
+def migrate(batch_size=BATCH_SIZE, echo=print):
+    db.create_all()
+    for column in add_missing_columns():
+        echo(f"Added column {column}")
+    renumbered = autoincrement_bookings()
+    if renumbered is not None:
+        echo(f"Rebuilt bookings, {renumbered} reusing archived ids renumbered")
+    for name in create_missing_indexes():
+        echo(f"Skipped index {name}: existing rows have duplicate values")
+    echo(f"Backfilled {backfill_booking_epochs(batch_size)} bookings")
+    # after the backfill, as the triggers compare the epoch columns
+    create_triggers()
+    echo(f"Backfilled {backfill_ticket_epochs(batch_size)} support tickets")
+    for name in create_search_indexes():
+        echo(f"Built search index {name}")
+    echo(f"Hashed {hash_plaintext_passwords(batch_size)} plaintext passwords")
+    # a new summary table starts empty, fill it from the existing bookings
+    summarised = db.session.query(RoomUtilisation.roomid).first()
+    if summarised is None and db.session.query(Booking.bookingid).first():
+        utilisation.rebuild(echo)
+    for table, count in sorted(dangling_references().items()):
+        echo(f"Warning: {count} rows in {table} refer to rows that no longer exist")
@@ -1,8 +1,22 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, event
 from datetime import datetime
 
 db = SQLAlchemy()
 
+EPOCH = datetime(1970, 1, 1)
+
+
+def to_epoch(value):
+    # seconds since 1970 for a wall-clock timestamp, no timezone conversion
+    if value is None or value == "":
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return int((value - EPOCH).total_seconds())
+
 
 class Employee(db.Model):
     __tablename__ = "employees"
@@ -16,18 +30,39 @@ class Employee(db.Model):
     password = db.Column(db.Text, nullable=False)
     role = db.Column(db.Text, nullable=False, default="staff")
 
+    # children are removed by the database's ON DELETE CASCADE rather than
+    # loaded and deleted one by one. Nothing the session hooks keep (the
+    # booking index, utilisation, versions) hears of them, see services.bulk
     bookings = db.relationship(
-        "Booking", back_populates="employee", cascade="all, delete-orphan"
+        "Booking",
+        back_populates="employee",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
     )
     support_tickets = db.relationship(
-        "SupportTicket", back_populates="employee", cascade="all, delete-orphan"
+        "SupportTicket",
+        back_populates="employee",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
     )
     admin_profile = db.relationship(
-        "Admin", back_populates="employee", uselist=False, cascade="all, delete-orphan"
+        "Admin",
+        back_populates="employee",
+        uselist=False,
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+    )
+    booking_series = db.relationship(
+        "BookingSeries",
+        back_populates="employee",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
     )
 
     __table_args__ = (
         db.CheckConstraint("role IN ('staff', 'senior', 'admin')", name="check_role"),
+        # logins and duplicate checks look emails up case-insensitively
+        db.Index("ix_employees_email_lower", db.func.lower(email), unique=True),
     )
 
     def __repr__(self):
@@ -43,8 +78,18 @@ class Room(db.Model):
     floor = db.Column(db.Integer, nullable=False)
     roomname = db.Column(db.Text, nullable=False)
     capacity = db.Column(db.Integer, nullable=False)
+    # removed by the database, as for Employee
     bookings = db.relationship(
-        "Booking", back_populates="room", cascade="all, delete-orphan"
+        "Booking",
+        back_populates="room",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+    )
+    booking_series = db.relationship(
+        "BookingSeries",
+        back_populates="room",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
     )
 
     def __repr__(self):
@@ -71,15 +116,128 @@ class Booking(db.Model):
         db.Text, nullable=False, default=lambda: datetime.now().isoformat()
     )
     timefinish = db.Column(db.Text)
+    # integer copies of the times above, used for range queries and sorting
+    timebegin_epoch = db.Column(db.Integer)
+    timefinish_epoch = db.Column(db.Integer)
 
     # Relationships
     employee = db.relationship("Employee", back_populates="bookings")
     room = db.relationship("Room", back_populates="bookings")
 
+    __table_args__ = (
+        db.Index(
+            "ix_bookings_room_time", "roomid", "timebegin_epoch", "timefinish_epoch"
+        ),
+        db.Index("ix_bookings_employee_time", "employeeid", "timebegin_epoch"),
+        # ids keep going up even after the newest bookings are archived or
+        # deleted, so an id is never shared with an archived booking
+        {"sqlite_autoincrement": True},
+    )
+
     def __repr__(self):
         return f"<Booking {self.bookingid} - Room {self.roomid}>"
 
 
+class BookingArchive(db.Model):
+    """A booking that finished long ago, moved out of `bookings`.
+
+    Same columns and ids as Booking, so the two tables can be read as one.
+    """
+
+    __tablename__ = "bookings_archive"
+
+    bookingid = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    employeeid = db.Column(
+        db.Integer,
+        db.ForeignKey("employees.employeeid", ondelete="CASCADE", onupdate="CASCADE"),
+        nullable=False,
+    )
+    roomid = db.Column(
+        db.Integer,
+        db.ForeignKey("rooms.roomid", ondelete="CASCADE", onupdate="CASCADE"),
+        nullable=False,
+    )
+    timebegin = db.Column(db.Text, nullable=False)
+    timefinish = db.Column(db.Text)
+    timebegin_epoch = db.Column(db.Integer)
+    timefinish_epoch = db.Column(db.Integer, index=True)
+    archived_at = db.Column(db.Text)
+
+    __table_args__ = (
+        db.Index("ix_bookings_archive_room_time", "roomid", "timebegin_epoch"),
+        db.Index("ix_bookings_archive_employee_time", "employeeid", "timebegin_epoch"),
+    )
+
+    def __repr__(self):
+        return f"<BookingArchive {self.bookingid} - Room {self.roomid}>"
+
+
+class BookingSeries(db.Model):
+    __tablename__ = "bookingseries"
+
+    seriesid = db.Column(
+        db.Integer, primary_key=True, autoincrement=True, nullable=False, unique=True
+    )
+    employeeid = db.Column(
+        db.Integer,
+        db.ForeignKey("employees.employeeid", ondelete="CASCADE", onupdate="CASCADE"),
+        nullable=False,
+    )
+    roomid = db.Column(
+        db.Integer,
+        db.ForeignKey("rooms.roomid", ondelete="CASCADE", onupdate="CASCADE"),
+        nullable=False,
+    )
+    # the first occurrence, later ones repeat it every `interval` frequency units
+    timebegin = db.Column(db.Text, nullable=False)
+    timefinish = db.Column(db.Text, nullable=False)
+    frequency = db.Column(db.Text, nullable=False)
+    interval = db.Column(db.Integer, nullable=False, default=1)
+    until = db.Column(db.Text)  # last date an occurrence may start on
+    count = db.Column(db.Integer)
+    # start of the first and end of the last occurrence, for range queries
+    timebegin_epoch = db.Column(db.Integer)
+    lastfinish_epoch = db.Column(db.Integer)
+
+    employee = db.relationship("Employee", back_populates="booking_series")
+    room = db.relationship("Room", back_populates="booking_series")
+    # loaded when the series is deleted, the utilisation hook subtracts the
+    # occurrences that were not skipped
+    exceptions = db.relationship(
+        "SeriesException", back_populates="series", cascade="all, delete-orphan"
+    )
+
+    __table_args__ = (
+        db.CheckConstraint(
+            "frequency IN ('daily', 'weekly', 'monthly')", name="check_frequency"
+        ),
+        db.CheckConstraint("until IS NOT NULL OR count IS NOT NULL", name="check_end"),
+        db.Index(
+            "ix_bookingseries_room_time", "roomid", "timebegin_epoch", "lastfinish_epoch"
+        ),
+    )
+
+    def __repr__(self):
+        return f"<BookingSeries {self.seriesid} - Room {self.roomid}>"
+
+
+class SeriesException(db.Model):
+    __tablename__ = "seriesexceptions"
+
+    seriesid = db.Column(
+        db.Integer,
+        db.ForeignKey("bookingseries.seriesid", ondelete="CASCADE", onupdate="CASCADE"),
+        primary_key=True,
+    )
+    # date (YYYY-MM-DD) of an occurrence that has been skipped
+    date = db.Column(db.Text, primary_key=True)
+
+    series = db.relationship("BookingSeries", back_populates="exceptions")
+
+    def __repr__(self):
+        return f"<SeriesException {self.seriesid} {self.date}>"
+
+
 class Admin(db.Model):
     __tablename__ = "admins"
 
@@ -98,7 +256,10 @@ class Admin(db.Model):
     # Relationships
     employee = db.relationship("Employee", back_populates="admin_profile")
     support_tickets = db.relationship(
-        "SupportTicket", back_populates="admin", cascade="all, delete-orphan"
+        "SupportTicket",
+        back_populates="admin",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
     )
 
     def __repr__(self):
@@ -126,6 +287,7 @@ class SupportTicket(db.Model):
     created_at = db.Column(
         db.Text, nullable=False, default=lambda: datetime.now().isoformat()
     )
+    created_at_epoch = db.Column(db.Integer, index=True)
 
     # Relationships
     employee = db.relationship("Employee", back_populates="support_tickets")
@@ -133,3 +295,130 @@ class SupportTicket(db.Model):
 
     def __repr__(self):
         return f"<SupportTicket {self.ticketid} - {self.subject}>"
+
+
+class DataVersion(db.Model):
+    __tablename__ = "dataversions"
+
+    # a kind of data that caches depend on, such as "rooms"
+    name = db.Column(db.Text, primary_key=True)
+    # bumped in the same transaction as every change to that data
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.Text)
+
+    def __repr__(self):
+        return f"<DataVersion {self.name} {self.version}>"
+
+
+class RoomUtilisation(db.Model):
+    __tablename__ = "roomutilisation"
+
+    roomid = db.Column(
+        db.Integer,
+        db.ForeignKey("rooms.roomid", ondelete="CASCADE", onupdate="CASCADE"),
+        primary_key=True,
+    )
+    # days since 1970-01-01 and the hour of that day, in local wall-clock time
+    day = db.Column(db.Integer, primary_key=True)
+    hour = db.Column(db.Integer, primary_key=True)
+    # seconds of the hour covered by bookings and series occurrences
+    seconds = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (db.Index("ix_roomutilisation_day", "day", "hour"),)
+
+    def __repr__(self):
+        return f"<RoomUtilisation {self.roomid} {self.day} {self.hour}>"
+
+
+@event.listens_for(Booking, "before_insert")
+@event.listens_for(Booking, "before_update")
+def _set_booking_epochs(mapper, connection, target):
+    if target.timebegin is None:
+        target.timebegin = datetime.now().isoformat()
+    target.timebegin_epoch = to_epoch(target.timebegin)
+    target.timefinish_epoch = to_epoch(target.timefinish)
+
+
+# The database itself refuses a booking that overlaps another in the same
+# room, whichever code path writes it
+BOOKING_OVERLAP_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS bookings_no_overlap_{action.lower()}
+    BEFORE {action} ON bookings
+    WHEN EXISTS (
+        SELECT 1 FROM bookings
+        WHERE roomid = NEW.roomid
+          AND bookingid IS NOT NEW.bookingid
+          AND timebegin_epoch < NEW.timefinish_epoch
+          AND timefinish_epoch > NEW.timebegin_epoch
+    )
+    BEGIN
+        SELECT RAISE(ABORT, 'booking overlaps another booking in the room');
+    END
+    """
+    for action in ("INSERT", "UPDATE")
+]
+
+for _trigger in BOOKING_OVERLAP_TRIGGERS:
+    event.listen(
+        Booking.__table__, "after_create", DDL(_trigger).execute_if(dialect="sqlite")
+    )
+
+
+# Full-text indexes over the columns admins search (see services/search.py),
+# kept in step with their tables by triggers: name -> (table, key, columns)
+SEARCH_INDEXES = {
+    "supporttickets_fts": ("supporttickets", "ticketid", ("subject", "message")),
+    "employees_fts": ("employees", "employeeid", ("fname", "lname", "email")),
+    "rooms_fts": ("rooms", "roomid", ("roomname",)),
+}
+
+
+def search_index_ddl(name):
+    table, key, columns = SEARCH_INDEXES[name]
+    names = ", ".join(columns)
+    new = ", ".join(f"new.{column}" for column in columns)
+    old = ", ".join(f"old.{column}" for column in columns)
+    remove = (
+        f"INSERT INTO {name}({name}, rowid, {names}) "
+        f"VALUES ('delete', old.{key}, {old});"
+    )
+    add = f"INSERT INTO {name}(rowid, {names}) VALUES (new.{key}, {new});"
+    return [
+        f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {name} USING fts5(
+            {names}, content='{table}', content_rowid='{key}',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {name}_insert AFTER INSERT ON {table}
+        BEGIN {add} END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {name}_delete AFTER DELETE ON {table}
+        BEGIN {remove} END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {name}_update AFTER UPDATE OF {names}
+        ON {table}
+        BEGIN {remove} {add} END
+        """,
+    ]
+
+
+for _name, (_table, _, _) in SEARCH_INDEXES.items():
+    for _statement in search_index_ddl(_name):
+        event.listen(
+            db.metadata.tables[_table],
+            "after_create",
+            DDL(_statement).execute_if(dialect="sqlite"),
+        )
+
+
+@event.listens_for(SupportTicket, "before_insert")
+@event.listens_for(SupportTicket, "before_update")
+def _set_ticket_epoch(mapper, connection, target):
+    if target.created_at is None:
+        target.created_at = datetime.now().isoformat()
+    target.created_at_epoch = to_epoch(target.created_at)
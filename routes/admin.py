@@ -1,16 +1,35 @@
-from flask import Blueprint, request, redirect, url_for, session, flash
-from models import db, Employee
-
-admin_bp = Blueprint("admin", __name__)
+import hmac
+from datetime import date, datetime, timedelta
 
+from flask import (
+    Blueprint,
+    Response,
+    abort,
+    current_app,
+    flash,
+    redirect,
+    render_template,
+    request,
+    url_for,
+)
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
+from models import db, Employee, Room, SupportTicket
+from services.auth import get_current_user, is_admin
+from services import bulk, metrics
+from services.booking_import import import_bookings, read_rows
+from services.pagination import PAGE_SIZE
+from services.passwords import HashPoolBusy, hash_password
+from services.query_budget import query_budget
+from services.room_catalog import room_catalog
+from services.search import match_query, search_page
 
-def is_logged_in():
-    return "employeeid" in session
+admin_bp = Blueprint("admin", __name__)
 
 
 @admin_bp.route("/admin/users/new", methods=["POST"])
 def admin_create_user():
-    if not is_logged_in() or session.get("role") != "admin":
+    if not is_admin():
         flash("Access denied", "error")
         return redirect(url_for("dashboard.dashboard"))
 
@@ -46,20 +65,210 @@ def admin_create_user():
         return redirect(url_for("dashboard.admin_dashboard"))
 
     # Check for existing email
-    existing = Employee.query.filter_by(email=email).first()
+    existing = Employee.query.filter(db.func.lower(Employee.email) == email).first()
     if existing:
         flash("Email already exists", "error")
         return redirect(url_for("dashboard.admin_dashboard"))
 
     try:
         employee = Employee(
-            fname=fname, lname=lname, email=email, password=password, role=role
+            fname=fname,
+            lname=lname,
+            email=email,
+            password=hash_password(password),
+            role=role,
         )
         db.session.add(employee)
         db.session.commit()
         flash("User created successfully", "success")
+    except IntegrityError:
+        # created by someone else since the check above
+        db.session.rollback()
+        flash("Email already exists", "error")
+    except HashPoolBusy:
+        flash("The server is busy, please try again in a moment", "error")
     except Exception as e:
         db.session.rollback()
         flash(f"Error creating user: {str(e)}", "error")
 
     return redirect(url_for("dashboard.admin_dashboard"))
+
+
+@admin_bp.route("/admin/bookings/import", methods=["GET", "POST"])
+def admin_import_bookings():
+    if not is_admin():
+        flash("Access denied", "error")
+        return redirect(url_for("dashboard.dashboard"))
+
+    user = get_current_user()
+    results = None
+
+    if request.method == "POST":
+        upload = request.files.get("file")
+        if not upload or not upload.filename:
+            flash("Choose a file to import", "error")
+            return render_template("bookings/import.html", user=user, results=None)
+
+        try:
+            results = import_bookings(read_rows(upload.stream, upload.filename))
+        except (ValueError, UnicodeDecodeError) as e:
+            db.session.rollback()
+            flash(f"Could not read the file: {str(e)}", "error")
+            return render_template("bookings/import.html", user=user, results=None)
+
+        accepted = sum(1 for result in results if result.status == "accepted")
+        flash(
+            f"Imported {accepted} of {len(results)} bookings",
+            "success" if accepted == len(results) else "info",
+        )
+
+    return render_template("bookings/import.html", user=user, results=results)
+
+
+@admin_bp.route("/admin/bookings/cancel", methods=["POST"])
+def admin_cancel_bookings():
+    if not is_admin():
+        flash("Access denied", "error")
+        return redirect(url_for("dashboard.dashboard"))
+
+    try:
+        first = date.fromisoformat(request.form.get("from", ""))
+        last = date.fromisoformat(request.form.get("to", ""))
+    except ValueError:
+        flash("Choose the dates to cancel bookings between", "error")
+        return redirect(url_for("dashboard.admin_dashboard"))
+    if last < first:
+        flash("The end date must not be before the start date", "error")
+        return redirect(url_for("dashboard.admin_dashboard"))
+
+    roomids = None
+    if request.form.get("room"):
+        room = room_catalog.get().room(request.form.get("room"))
+        if room is None:
+            flash("Room not found", "error")
+            return redirect(url_for("dashboard.admin_dashboard"))
+        roomids = [room.roomid]
+
+    result = bulk.cancel_bookings(
+        datetime.combine(first, datetime.min.time()),
+        datetime.combine(last + timedelta(days=1), datetime.min.time()),
+        roomids,
+    )
+    flash(
+        f"Cancelled {result.bookings} bookings and "
+        f"{result.occurrences} recurring booking occurrences",
+        "success",
+    )
+    return redirect(url_for("dashboard.admin_dashboard"))
+
+
+@admin_bp.route("/admin/employees/<int:employee_id>/offboard", methods=["POST"])
+def admin_offboard_employee(employee_id):
+    if not is_admin():
+        flash("Access denied", "error")
+        return redirect(url_for("dashboard.dashboard"))
+
+    user = get_current_user()
+    if employee_id == user.employeeid:
+        flash("You cannot offboard yourself", "error")
+        return redirect(url_for("dashboard.admin_dashboard"))
+    employee = Employee.query.get_or_404(employee_id)
+    name = f"{employee.fname} {employee.lname}"
+
+    try:
+        result = bulk.offboard_employee(
+            employee, bulk.successor_admin(employee.employeeid)
+        )
+    except ValueError as e:
+        flash(f"Could not offboard {name}: {str(e)}", "error")
+        return redirect(url_for("dashboard.admin_dashboard"))
+
+    flash(
+        f"Offboarded {name}: removed {result.bookings} bookings, "
+        f"{result.archived} archived bookings, {result.series} recurring "
+        f"bookings and {result.tickets} support tickets, and reassigned "
+        f"{result.reassigned} tickets they were handling",
+        "success",
+    )
+    return redirect(url_for("dashboard.admin_dashboard"))
+
+
+@admin_bp.route("/admin/search")
+@query_budget(4)
+def admin_search():
+    if not is_admin():
+        flash("Access denied", "error")
+        return redirect(url_for("dashboard.dashboard"))
+
+    user = get_current_user()
+    search = request.args.get("q", "").strip()
+    match = match_query(search)
+    if not match:
+        return render_template("dashboard/search.html", user=user, search=search)
+
+    per_page = current_app.config.get("ADMIN_PAGE_SIZE", PAGE_SIZE)
+    # subjects and names count for more than message bodies and emails
+    tickets = search_page(
+        SupportTicket.query.options(joinedload(SupportTicket.employee)),
+        SupportTicket.ticketid,
+        "supporttickets_fts",
+        match,
+        (3.0, 1.0),
+        request.args.get("tickets_after"),
+        per_page,
+    )
+    employees = search_page(
+        Employee.query,
+        Employee.employeeid,
+        "employees_fts",
+        match,
+        (2.0, 2.0, 1.0),
+        request.args.get("employees_after"),
+        per_page,
+    )
+    rooms = search_page(
+        Room.query,
+        Room.roomid,
+        "rooms_fts",
+        match,
+        (1.0,),
+        request.args.get("rooms_after"),
+        per_page,
+    )
+    return render_template(
+        "dashboard/search.html",
+        user=user,
+        search=search,
+        tickets=tickets,
+        employees=employees,
+        rooms=rooms,
+    )
+
+
+def can_read_metrics():
+    # scrapers cannot sign in, they present METRICS_TOKEN instead
+    token = current_app.config.get("METRICS_TOKEN")
+    offered = request.headers.get("Authorization", "")
+    if token and hmac.compare_digest(offered.encode(), f"Bearer {token}".encode()):
+        return True
+    return is_admin()
+
+
+@admin_bp.route("/admin/metrics")
+def admin_metrics():
+    if not can_read_metrics():
+        abort(403)
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@admin_bp.route("/admin/metrics/slowest")
+def admin_slowest_requests():
+    if not can_read_metrics():
+        abort(403)
+    if metrics.sampler is None:
+        return Response(
+            "Profiling is off, set PROFILER_INTERVAL to turn it on.\n",
+            404,
+            mimetype="text/plain",
+        )
+    return Response(metrics.sampler.dump(), mimetype="text/plain")
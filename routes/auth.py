@@ -1,29 +1,40 @@
 from flask import Blueprint, render_template, request, redirect, url_for, session, flash
+from flask_login import logout_user
 from models import db, Employee
+from services.auth import sign_in
+from services.passwords import HashPoolBusy, burn_hash, hash_password, verify_password
 
 auth_bp = Blueprint("auth", __name__)
 
 
-def is_logged_in():
-    return "employeeid" in session
-
-
-def get_current_user():
-    if is_logged_in():
-        return db.session.get(Employee, session["employeeid"])
-    return None
-
-
 @auth_bp.route("/login", methods=["GET", "POST"])
 def login():
     if request.method == "POST":
-        email = request.form.get("email")
-        password = request.form.get("password")
+        email = request.form.get("email", "").strip().lower()
+        password = request.form.get("password", "")
 
-        employee = Employee.query.filter_by(email=email).first()
-        if employee and employee.password == password:
-            session["employeeid"] = employee.employeeid
-            session["role"] = employee.role
+        employee = Employee.query.filter(db.func.lower(Employee.email) == email).first()
+        try:
+            if employee:
+                matches, needs_rehash = verify_password(employee.password, password)
+            else:
+                burn_hash(password)
+                matches = needs_rehash = False
+        except HashPoolBusy:
+            flash("The server is busy, please try again in a moment", "error")
+            return render_template("auth/login.html"), 503
+
+        if matches and needs_rehash:
+            # the password is right, so a busy pool only puts the rehash
+            # off until the next login
+            try:
+                employee.password = hash_password(password)
+                db.session.commit()
+            except HashPoolBusy:
+                pass
+
+        if matches:
+            sign_in(employee)
             flash("Login successful", "success")
             if employee.role == "admin":
                 return redirect(url_for("dashboard.admin_dashboard"))
@@ -38,6 +49,7 @@ def login():
 
 @auth_bp.route("/logout")
 def logout():
+    logout_user()
     session.clear()
     flash("You have been logged out", "info")
     return redirect(url_for("auth.login"))
@@ -1,37 +1,262 @@
-from flask import Blueprint, render_template, request, redirect, url_for, session, flash
-from models import db, Employee, Room, Booking
-from routes.rooms import sorter
-from datetime import datetime
+from collections import namedtuple
+
+from flask import (
+    Blueprint,
+    Response,
+    abort,
+    flash,
+    redirect,
+    render_template,
+    request,
+    stream_with_context,
+    url_for,
+)
+from sqlalchemy import or_, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import contains_eager, joinedload, selectinload
+from models import db, Room, Booking, BookingSeries, SeriesException, to_epoch
+from services import archive, export, versions
+from services.auth import get_current_user, is_admin, is_logged_in
+from services.booking_index import booking_index, find_conflict
+from services.booking_rules import booking_time_error, parse_local
+from services.conditional import Validator
+from services.database import begin_immediate
+from services.occupancy import occupancy
+from services.room_catalog import room_catalog
+from services.query_budget import query_budget
+from services.recurrence import (
+    FREQUENCIES,
+    MAX_MONTHLY_DAY,
+    MAX_OCCURRENCES,
+    MAX_SERIES_DAYS,
+    Recurrence,
+    find_recurrence_conflict,
+    find_series_conflict,
+)
+from datetime import date, datetime, timedelta
+
+# how far back the booking history goes unless asked otherwise
+HISTORY_DAYS = 90
+# how far ahead an export reaches unless asked otherwise
+EXPORT_DAYS = 90
+# what a clashing request is offered instead
+SUGGESTED_TIMES = 3
+SUGGESTED_ROOMS = 5
 
 bookings_bp = Blueprint("bookings", __name__)
 
+Suggestions = namedtuple(
+    "Suggestions", ["room", "begin", "finish", "attendees", "times", "rooms"]
+)
+
+
+def suggest(room, begin_dt, finish_dt, attendees=None, times=True):
+    """Other times in `room` and other rooms at the requested time.
+
+    Times are free windows of the same length on the same day, nearest
+    first. Rooms are free for the whole window and seat `attendees`, or as
+    many as `room` does when that is not given. Rooms on the same floor
+    come first, then the smallest that is big enough.
+    """
+    free_times = []
+    if times:
+        free_times = occupancy.free_windows(
+            room.roomid, begin_dt, finish_dt, SUGGESTED_TIMES, earliest=datetime.now()
+        )
+    needed = attendees or room.capacity
+    candidates = [
+        other
+        for other in room_catalog.get().by_floor
+        if other.roomid != room.roomid and other.capacity >= needed
+    ]
+    free_rooms = sorted(
+        occupancy.free_rooms(candidates, begin_dt, finish_dt),
+        key=lambda other: (other.floor != room.floor, other.capacity, other.roomname),
+    )
+
+    # the index can trail a booking another worker made a moment ago, so
+    # the offers are checked against the table before they are made
+    booked = _booked(room, free_times, free_rooms, begin_dt, finish_dt)
+    still_free = [
+        (start, end)
+        for start, end in free_times
+        if not any(
+            roomid == room.roomid
+            and timebegin < to_epoch(end)
+            and timefinish > to_epoch(start)
+            for roomid, timebegin, timefinish in booked
+        )
+    ]
+    taken = {roomid for roomid, _, _ in booked if roomid != room.roomid}
+    stale = sorted(taken)
+    if len(still_free) < len(free_times):
+        stale.append(room.roomid)
+    booking_index.reload_rooms(stale)
+    free_times = still_free
+    free_rooms = [other for other in free_rooms if other.roomid not in taken]
+    return Suggestions(
+        room,
+        begin_dt,
+        finish_dt,
+        attendees,
+        free_times,
+        free_rooms[:SUGGESTED_ROOMS],
+    )
+
+
+def _booked(room, free_times, free_rooms, begin_dt, finish_dt):
+    """(roomid, begin, finish) of stored bookings that may clash with the offers.
+
+    That is bookings in the offered rooms at the requested time, and in
+    `room` anywhere between the first and last offered time.
+    """
+    conditions = []
+    if free_rooms:
+        conditions.append(
+            Booking.roomid.in_([other.roomid for other in free_rooms])
+            & (Booking.timebegin_epoch < to_epoch(finish_dt))
+            & (Booking.timefinish_epoch > to_epoch(begin_dt))
+        )
+    if free_times:
+        first = min(start for start, _ in free_times)
+        last = max(end for _, end in free_times)
+        conditions.append(
+            (Booking.roomid == room.roomid)
+            & (Booking.timebegin_epoch < to_epoch(last))
+            & (Booking.timefinish_epoch > to_epoch(first))
+        )
+    if not conditions:
+        return []
+    return db.session.execute(
+        select(Booking.roomid, Booking.timebegin_epoch, Booking.timefinish_epoch)
+        .where(or_(*conditions))
+    ).all()
+
+
+def render_booking_form(user, suggestions=None):
+    rooms = room_catalog.get().by_name
+    return render_template(
+        "bookings/new.html", user=user, rooms=rooms, suggestions=suggestions
+    )
 
-def is_logged_in():
-    return "employeeid" in session
 
+def create_series(user, room, timebegin, timefinish, begin_dt, finish_dt):
+    frequency = request.form.get("repeat", "").strip()
+    interval = request.form.get("interval", "").strip() or "1"
+    until = request.form.get("until", "").strip()
+    count = request.form.get("count", "").strip()
 
-def get_current_user():
-    if is_logged_in():
-        return db.session.get(Employee, session["employeeid"])
-    return None
+    if frequency not in FREQUENCIES:
+        flash("Invalid repeat option", "error")
+        return render_booking_form(user)
+
+    try:
+        interval_num = int(interval)
+        until_date = date.fromisoformat(until) if until else None
+        count_num = int(count) if count else None
+    except ValueError:
+        flash("Repeat every, end date and occurrences must be valid", "error")
+        return render_booking_form(user)
+
+    if until_date is None and count_num is None:
+        flash("Give an end date or a number of occurrences to repeat", "error")
+        return render_booking_form(user)
+
+    if not 1 <= interval_num <= 52:
+        flash("Repeat every must be between 1 and 52", "error")
+        return render_booking_form(user)
+
+    if count_num is not None and not 1 <= count_num <= MAX_OCCURRENCES:
+        flash(f"Occurrences must be between 1 and {MAX_OCCURRENCES}", "error")
+        return render_booking_form(user)
+
+    if frequency == "monthly" and begin_dt.day > MAX_MONTHLY_DAY:
+        flash(
+            f"Monthly bookings must start on or before day {MAX_MONTHLY_DAY}",
+            "error",
+        )
+        return render_booking_form(user)
+
+    if until_date is not None and until_date < begin_dt.date():
+        flash("End date cannot be before the first booking", "error")
+        return render_booking_form(user)
+
+    recurrence = Recurrence(
+        begin_dt,
+        finish_dt,
+        frequency,
+        interval_num,
+        until_date,
+        count_num,
+        frozenset(),
+    )
+    last_finish = recurrence.last()[1]
+    if last_finish - begin_dt > timedelta(days=MAX_SERIES_DAYS):
+        flash("Recurring bookings cannot run for more than two years", "error")
+        return render_booking_form(user)
+
+    # hold the write lock from the conflict checks until the insert commits
+    begin_immediate()
+
+    # every occurrence against stored bookings and other series, expanded lazily
+    if find_recurrence_conflict(recurrence, room.roomid):
+        db.session.rollback()
+        flash("This room is already booked for one or more of the repeats", "error")
+        return render_booking_form(user)
+
+    try:
+        series = BookingSeries(
+            employeeid=user.employeeid,
+            roomid=room.roomid,
+            timebegin=timebegin,
+            timefinish=timefinish,
+            frequency=frequency,
+            interval=interval_num,
+            until=until_date.isoformat() if until_date else None,
+            count=count_num,
+            timebegin_epoch=to_epoch(begin_dt),
+            lastfinish_epoch=to_epoch(last_finish),
+        )
+        db.session.add(series)
+        db.session.commit()
+        flash("Recurring booking created successfully", "success")
+        return redirect(url_for("bookings.bookings"))
+    except Exception as e:
+        db.session.rollback()
+        flash(f"Error creating booking: {str(e)}", "error")
+        return render_booking_form(user)
 
 
 @bookings_bp.route("/bookings")
+@query_budget(4)
 def bookings():
     if not is_logged_in():
         return redirect(url_for("auth.login"))
 
     user = get_current_user()
-    user_bookings = Booking.query.filter_by(employeeid=user.employeeid).all()
-    sorted_bookings = sorter(
-        user_bookings,
-        key_func=lambda booking: (
-            booking.room.roomname if booking.room is not None else "",
-            booking.timebegin,
-        ),
+    sorted_bookings = (
+        Booking.query.filter_by(employeeid=user.employeeid)
+        .join(Booking.room)
+        .options(contains_eager(Booking.room))
+        .order_by(Room.roomname, Booking.timebegin_epoch, Booking.bookingid)
+        .all()
     )
 
-    return render_template("bookings/list.html", user=user, bookings=sorted_bookings)
+    now = datetime.now()
+    series = []
+    for item in (
+        BookingSeries.query.filter_by(employeeid=user.employeeid)
+        .options(
+            joinedload(BookingSeries.room), selectinload(BookingSeries.exceptions)
+        )
+        .order_by(BookingSeries.timebegin_epoch, BookingSeries.seriesid)
+    ):
+        upcoming = next(Recurrence.from_series(item).occurrences(now), None)
+        series.append((item, upcoming[0] if upcoming else None))
+
+    return render_template(
+        "bookings/list.html", user=user, bookings=sorted_bookings, series=series
+    )
 
 
 @bookings_bp.route("/bookings/new", methods=["GET", "POST"])
@@ -45,93 +270,70 @@ def new_booking():
         roomid = request.form.get("roomid")
         timebegin = request.form.get("timebegin")
         timefinish = request.form.get("timefinish")
+        attendees = request.form.get("attendees", "").strip()
 
         # Validate all fields are provided
         if not all([roomid, timebegin, timefinish]):
             flash("All fields are required", "error")
-            rooms = Room.query.all()
-            rooms_sorted = sorter(
-                rooms,
-                key_func=lambda room: (room.roomname,),
-            )
-            return render_template("bookings/new.html", user=user, rooms=rooms_sorted)
-
-        # Validate room exists
-        room = Room.query.get(roomid)
-        if not room:
-            flash("Invalid room selected", "error")
-            rooms = Room.query.all()
-            rooms_sorted = sorter(
-                rooms,
-                key_func=lambda room: (room.roomname,),
-            )
-            return render_template("bookings/new.html", user=user, rooms=rooms_sorted)
+            return render_booking_form(user)
 
         # Validate datetime format and parse
         try:
-            begin_dt = datetime.fromisoformat(timebegin)
-            finish_dt = datetime.fromisoformat(timefinish)
+            begin_dt = parse_local(timebegin)
+            finish_dt = parse_local(timefinish)
         except ValueError:
             flash("Invalid date/time format", "error")
-            rooms = Room.query.all()
-            rooms_sorted = sorter(
-                rooms,
-                key_func=lambda room: (room.roomname,),
-            )
-            return render_template("bookings/new.html", user=user, rooms=rooms_sorted)
-
-        # Validate finish time is after begin time
-        if finish_dt <= begin_dt:
-            flash("End time must be after start time", "error")
-            rooms = Room.query.all()
-            rooms_sorted = sorter(
-                rooms,
-                key_func=lambda room: (room.roomname,),
-            )
-            return render_template("bookings/new.html", user=user, rooms=rooms_sorted)
-
-        # Validate booking is not in the past
-        if begin_dt < datetime.now():
-            flash("Cannot create bookings in the past", "error")
-            rooms = Room.query.all()
-            rooms_sorted = sorter(
-                rooms,
-                key_func=lambda room: (room.roomname,),
+            return render_booking_form(user)
+
+        if attendees and not (attendees.isdecimal() and int(attendees) >= 1):
+            flash("Number of attendees must be a positive whole number", "error")
+            return render_booking_form(user)
+        attendees_num = int(attendees) if attendees else None
+
+        # Validate order, not in the past and at most 8 hours long
+        error = booking_time_error(begin_dt, finish_dt)
+        if error:
+            flash(error, "error")
+            return render_booking_form(user)
+
+        # Validate room exists
+        room = room_catalog.get().room(roomid)
+        if not room:
+            flash("Invalid room selected", "error")
+            return render_booking_form(user)
+
+        if attendees_num is not None and attendees_num > room.capacity:
+            flash(f"{room.roomname} only seats {room.capacity}", "error")
+            return render_booking_form(
+                user,
+                suggest(room, begin_dt, finish_dt, attendees_num, times=False),
             )
-            return render_template("bookings/new.html", user=user, rooms=rooms_sorted)
-
-        # Validate booking duration (going with with 8 hrs since nobody doing a )
-        duration = finish_dt - begin_dt
-        duration_hours = duration.total_seconds() / 3600
-        if duration_hours > 8:
-            flash("Booking duration cannot exceed 8 hours", "error")
-            rooms = Room.query.all()
-            rooms_sorted = sorter(
-                rooms,
-                key_func=lambda room: (room.roomname,),
+
+        if request.form.get("repeat", "").strip():
+            return create_series(
+                user, room, timebegin, timefinish, begin_dt, finish_dt
             )
-            return render_template("bookings/new.html", user=user, rooms=rooms_sorted)
 
-        # Check for conflicts
-        conflicts = Booking.query.filter(
-            Booking.roomid == roomid,
-            Booking.timebegin < timefinish,
-            Booking.timefinish > timebegin,
-        ).first()
+        # hold the write lock from the conflict checks until the insert commits
+        begin_immediate()
+
+        # Check for conflicts with bookings and with recurring bookings
+        conflicts = find_conflict(
+            room.roomid, timebegin, timefinish
+        ) or find_series_conflict(room.roomid, begin_dt, finish_dt)
 
         if conflicts:
+            # let go of the write lock before looking for somewhere else
+            db.session.rollback()
             flash("This room is already booked for the selected time", "error")
-            rooms = Room.query.all()
-            rooms_sorted = sorter(
-                rooms,
-                key_func=lambda room: (room.roomname,),
+            return render_booking_form(
+                user, suggest(room, begin_dt, finish_dt, attendees_num)
             )
-            return render_template("bookings/new.html", user=user, rooms=rooms_sorted)
 
         try:
             booking = Booking(
                 employeeid=user.employeeid,
-                roomid=roomid,
+                roomid=room.roomid,
                 timebegin=timebegin,
                 timefinish=timefinish,
             )
@@ -139,18 +341,19 @@ def new_booking():
             db.session.commit()
             flash("Booking created successfully", "success")
             return redirect(url_for("bookings.bookings"))
+        except IntegrityError:
+            # the overlap trigger caught a booking written outside this app
+            db.session.rollback()
+            flash("This room is already booked for the selected time", "error")
+            return render_booking_form(
+                user, suggest(room, begin_dt, finish_dt, attendees_num)
+            )
         except Exception as e:
             db.session.rollback()
             flash(f"Error creating booking: {str(e)}", "error")
-            rooms = Room.query.all()
-            return render_template("bookings/new.html", user=user, rooms=rooms)
+            return render_booking_form(user)
 
-    rooms = Room.query.all()
-    rooms_sorted = sorter(
-        rooms,
-        key_func=lambda room: (room.roomname,),
-    )
-    return render_template("bookings/new.html", user=user, rooms=rooms_sorted)
+    return render_booking_form(user)
 
 
 @bookings_bp.route("/bookings/<int:booking_id>/cancel", methods=["POST"])
@@ -170,3 +373,163 @@ def cancel_booking(booking_id):
     flash("Booking cancelled successfully", "success")
 
     return redirect(url_for("bookings.bookings"))
+
+
+@bookings_bp.route("/bookings/series/<int:series_id>/cancel", methods=["POST"])
+def cancel_series(series_id):
+    if not is_logged_in():
+        return redirect(url_for("auth.login"))
+
+    user = get_current_user()
+    series = BookingSeries.query.get_or_404(series_id)
+
+    if series.employeeid != user.employeeid and user.role != "admin":
+        flash("You can only cancel your own bookings", "error")
+        return redirect(url_for("bookings.bookings"))
+
+    db.session.delete(series)
+    db.session.commit()
+    flash("Recurring booking cancelled successfully", "success")
+
+    return redirect(url_for("bookings.bookings"))
+
+
+@bookings_bp.route("/bookings/series/<int:series_id>/skip", methods=["POST"])
+def skip_occurrence(series_id):
+    if not is_logged_in():
+        return redirect(url_for("auth.login"))
+
+    user = get_current_user()
+    series = BookingSeries.query.get_or_404(series_id)
+
+    if series.employeeid != user.employeeid and user.role != "admin":
+        flash("You can only cancel your own bookings", "error")
+        return redirect(url_for("bookings.bookings"))
+
+    try:
+        day = date.fromisoformat(request.form.get("date", ""))
+    except ValueError:
+        flash("Invalid date", "error")
+        return redirect(url_for("bookings.bookings"))
+
+    day_start = datetime.combine(day, datetime.min.time())
+    occurrence = next(
+        Recurrence.from_series(series).occurrences(
+            day_start, day_start + timedelta(days=1)
+        ),
+        None,
+    )
+    if occurrence is None or occurrence[0].date() != day:
+        flash("This recurring booking does not happen on that date", "error")
+        return redirect(url_for("bookings.bookings"))
+
+    db.session.add(SeriesException(seriesid=series.seriesid, date=day.isoformat()))
+    db.session.commit()
+    flash(f"Booking on {day.strftime('%d-%m-%Y')} cancelled successfully", "success")
+
+    return redirect(url_for("bookings.bookings"))
+
+
+def _date_arg(name):
+    try:
+        return date.fromisoformat(request.args.get(name, ""))
+    except ValueError:
+        return None
+
+
+@bookings_bp.route("/bookings/history")
+@query_budget(5)
+def booking_history():
+    if not is_logged_in():
+        return redirect(url_for("auth.login"))
+
+    user = get_current_user()
+    last = _date_arg("to") or date.today()
+    first = _date_arg("from") or last - timedelta(days=HISTORY_DAYS)
+    if first > last:
+        first, last = last, first
+    catalog = room_catalog.get()
+    room = catalog.room(request.args.get("room", ""))
+
+    # admins see everybody's bookings, everyone else their own
+    rows, more = archive.history(
+        datetime.combine(first, datetime.min.time()),
+        datetime.combine(last + timedelta(days=1), datetime.min.time()),
+        employeeid=None if is_admin() else user.employeeid,
+        roomids=[room.roomid] if room else None,
+    )
+    return render_template(
+        "bookings/history.html",
+        user=user,
+        rows=rows,
+        more=more,
+        limit=archive.HISTORY_LIMIT,
+        first=first,
+        last=last,
+        room=room,
+        rooms=catalog.by_name,
+    )
+
+
+@bookings_bp.route("/bookings/export.<fmt>")
+def export_bookings(fmt):
+    if not is_logged_in():
+        return redirect(url_for("auth.login"))
+    if fmt not in ("csv", "ics"):
+        abort(404)
+
+    user = get_current_user()
+    first = _date_arg("from") or date.today()
+    last = _date_arg("to") or first + timedelta(days=EXPORT_DAYS)
+    if first > last:
+        first, last = last, first
+    catalog = room_catalog.get()
+
+    roomids = None
+    if request.args.getlist("room"):
+        roomids = [
+            room.roomid
+            for room in map(catalog.room, request.args.getlist("room"))
+            if room is not None
+        ]
+    if request.args.get("floor", "").strip():
+        floor = request.args.get("floor", type=int)
+        on_floor = [room.roomid for room in catalog.by_floor if room.floor == floor]
+        roomids = on_floor if roomids is None else sorted(set(roomids) & set(on_floor))
+
+    # anyone may export a room's calendar, only admins someone else's bookings
+    employeeid = request.args.get("employee", type=int)
+    if employeeid is not None and employeeid != user.employeeid and not is_admin():
+        abort(403)
+    if employeeid is None and roomids is None and not is_admin():
+        employeeid = user.employeeid
+
+    # a room's calendar only changes with its bookings, so clients polling
+    # it are answered from their copy while it stands
+    validator = None
+    if roomids is not None:
+        validator = Validator(
+            ["rooms", "employees", *map(versions.room_bookings, roomids)],
+            employeeid,
+        )
+        if validator.fresh():
+            return validator.not_modified()
+
+    rows = export.export_rows(
+        catalog,
+        datetime.combine(first, datetime.min.time()),
+        datetime.combine(last + timedelta(days=1), datetime.min.time()),
+        employeeid=employeeid,
+        roomids=roomids,
+    )
+    filename = f"bookings-{first.isoformat()}-{last.isoformat()}.{fmt}"
+    if fmt == "csv":
+        body, mimetype = export.stream_csv(rows), "text/csv"
+    else:
+        body, mimetype = export.stream_ics(rows, request.host), "text/calendar"
+    response = Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+    return validator.apply(response) if validator else response
@@ -1,19 +1,22 @@
-from flask import Blueprint, render_template, redirect, url_for, session, flash
-from models import db, Employee, Booking, Room, SupportTicket
-from routes.rooms import sorter
+from flask import (
+    Blueprint,
+    current_app,
+    render_template,
+    stream_template,
+    request,
+    redirect,
+    url_for,
+    flash,
+)
+from sqlalchemy.orm import contains_eager, joinedload
+from models import Employee, Booking, Room, SupportTicket
+from services.auth import get_current_user, is_admin, is_logged_in
+from services.pagination import KeysetPage, SequencePage, PAGE_SIZE
+from services.query_budget import query_budget
+from services.room_catalog import room_catalog
 
 dashboard_bp = Blueprint('dashboard', __name__)
 
-def is_logged_in():
-    return "employeeid" in session
-
-
-def get_current_user():
-    if is_logged_in():
-        return db.session.get(Employee, session["employeeid"])
-    return None
-
-
 @dashboard_bp.route("/")
 def index():
     if is_logged_in():
@@ -22,63 +25,80 @@ def index():
 
 
 @dashboard_bp.route("/dashboard")
+@query_budget(2)
 def dashboard():
     if not is_logged_in():
         return redirect(url_for("auth.login"))
 
     user = get_current_user()
-    bookings = Booking.query.filter_by(employeeid=user.employeeid).all()
-    bookings_sorted = sorter(
-        bookings,
-        key_func=lambda booking: (
-            booking.room.roomname if booking.room is not None else "",
-            booking.timebegin,
-        ),
+    bookings_sorted = (
+        Booking.query.filter_by(employeeid=user.employeeid)
+        .join(Booking.room)
+        .options(contains_eager(Booking.room))
+        .order_by(Room.roomname, Booking.timebegin_epoch, Booking.bookingid)
+        .all()
     )
 
     return render_template("dashboard/main.html", user=user, bookings=bookings_sorted)
 
 
 @dashboard_bp.route("/admin/dashboard")
+@query_budget(7)
 def admin_dashboard():
-    if not is_logged_in() or session.get("role") != "admin":
+    if not is_admin():
         flash("Access denied", "error")
         return redirect(url_for("dashboard.dashboard"))
 
     user = get_current_user()
-    all_bookings = Booking.query.all()
-    all_employees = Employee.query.all()
-    all_rooms = Room.query.all()
-    tickets = SupportTicket.query.all()
+    per_page = current_app.config.get("ADMIN_PAGE_SIZE", PAGE_SIZE)
 
-    bookings_sorted = sorter(
-        all_bookings,
-        key_func=lambda booking: (
-            booking.room.roomname if booking.room is not None else "",
-            booking.timebegin,
+    # each section pages independently, keyed on its own sort order
+    bookings = KeysetPage(
+        Booking.query.join(Booking.room).options(
+            contains_eager(Booking.room), joinedload(Booking.employee)
         ),
+        (Room.roomname, Booking.timebegin_epoch, Booking.bookingid),
+        key=lambda booking: (
+            booking.room.roomname,
+            booking.timebegin_epoch,
+            booking.bookingid,
+        ),
+        cursor=request.args.get("bookings_after"),
+        per_page=per_page,
     )
-
-    employees_sorted = sorter(
-        all_employees,
-        key_func=lambda employee: (employee.fname, employee.lname),
+    employees = KeysetPage(
+        Employee.query,
+        (Employee.fname, Employee.lname, Employee.employeeid),
+        key=lambda employee: (employee.fname, employee.lname, employee.employeeid),
+        cursor=request.args.get("employees_after"),
+        per_page=per_page,
     )
-
-    rooms_sorted = sorter(
-        all_rooms,
-        key_func=lambda room: (room.floor, room.roomname),
+    rooms = SequencePage(
+        room_catalog.get().by_floor,
+        key=lambda room: (room.floor, room.roomname, room.roomid),
+        cursor=request.args.get("rooms_after"),
+        per_page=per_page,
     )
-
-    tickets_sorted = sorter(
-        tickets,
-        key_func=lambda ticket: ticket.created_at,
+    tickets = KeysetPage(
+        SupportTicket.query.options(joinedload(SupportTicket.employee)),
+        (SupportTicket.created_at_epoch, SupportTicket.ticketid),
+        key=lambda ticket: (ticket.created_at_epoch, ticket.ticketid),
+        cursor=request.args.get("tickets_after"),
+        per_page=per_page,
     )
 
-    return render_template(
+    # streaming sends the page as each section renders, and the lazy pages
+    # only query once the template reaches them
+    stream = request.args.get(
+        "stream", current_app.config.get("ADMIN_DASHBOARD_STREAM", False)
+    )
+    render = stream_template if stream in (True, "1") else render_template
+    return render(
         "dashboard/admin.html",
         user=user,
-        bookings=bookings_sorted,
-        employees=employees_sorted,
-        rooms=rooms_sorted,
-        tickets=tickets_sorted,
+        bookings=bookings,
+        employees=employees,
+        rooms=rooms,
+        room_options=room_catalog.get().by_floor,
+        tickets=tickets,
     )
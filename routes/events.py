@@ -0,0 +1,77 @@
+import json
+import os
+
+from flask import Blueprint, Response, current_app, redirect, request, url_for
+from services import events
+from services.auth import is_logged_in
+from services.room_catalog import room_catalog
+
+events_bp = Blueprint("events", __name__)
+
+HEARTBEAT_SECONDS = 15
+# every open stream holds one of the worker's threads (WEB_THREADS, see
+# gunicorn.conf.py) for as long as it is open, and this many are always
+# left for ordinary pages
+SPARE_THREADS = 2
+
+
+def max_subscribers(environ=os.environ):
+    """Streams one worker process may hold open, unless EVENTS_MAX_SUBSCRIBERS."""
+    return max(int(environ.get("WEB_THREADS", 8)) - SPARE_THREADS, 0)
+
+
+def event_stream(subscription, heartbeat):
+    # how long a browser waits before reconnecting after a drop
+    yield "retry: 5000\n\n"
+    while True:
+        event = subscription.get(timeout=heartbeat)
+        if event is None:
+            # keeps proxies from closing an idle connection and finds
+            # clients that have gone away
+            yield ": heartbeat\n\n"
+            continue
+        lines = [f"event: {event['type']}", f"data: {json.dumps(event)}"]
+        if "id" in event:
+            lines.insert(0, f"id: {event['id']}")
+        yield "\n".join(lines) + "\n\n"
+
+
+@events_bp.route("/events")
+def room_events():
+    """Server-Sent Events for bookings in the given rooms and floors.
+
+    `?room=<id>` and `?floor=<n>` may each be repeated; with neither the
+    stream covers every room.
+    """
+    if not is_logged_in():
+        return redirect(url_for("auth.login"))
+
+    try:
+        roomids = {int(value) for value in request.args.getlist("room")}
+        floors = {int(value) for value in request.args.getlist("floor")}
+    except ValueError:
+        return Response("room and floor must be numbers\n", status=400)
+    if floors:
+        roomids.update(
+            room.roomid for room in room_catalog.get().by_floor if room.floor in floors
+        )
+
+    limit = current_app.config.get("EVENTS_MAX_SUBSCRIBERS")
+    if limit is None:
+        limit = max_subscribers()
+    if len(events.broker) >= limit:
+        return Response("Too many listeners, try again later\n", status=503)
+
+    subscription = events.broker.subscribe(
+        roomids if roomids or floors else None
+    )
+    heartbeat = current_app.config.get("EVENTS_HEARTBEAT_SECONDS", HEARTBEAT_SECONDS)
+    response = Response(
+        event_stream(subscription, heartbeat),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    # the server closes every response, even one whose body is never read
+    # (a HEAD request, or a client gone before the first event)
+    response.call_on_close(subscription.close)
+    return response
@@ -1,57 +1,136 @@
-from flask import Blueprint, render_template, request, redirect, url_for, session, flash
-from models import db, Employee, Room, Booking
+import csv
+import io
+
+from flask import (
+    Blueprint,
+    Response,
+    abort,
+    flash,
+    redirect,
+    render_template,
+    request,
+    stream_with_context,
+    url_for,
+)
+from sqlalchemy.orm import joinedload
+from models import db, Room, Booking
+from services.auth import get_current_user, is_admin, is_logged_in
+from services.booking_rules import MAX_BOOKING_HOURS, parse_local
+from services.occupancy import occupancy
+from services.recurrence import upcoming_occurrences
+from services.room_catalog import room_catalog
+from services.query_budget import query_budget
+from services.conditional import conditional
+from services import utilisation, versions
+from datetime import date, datetime, timedelta
+
+# how far ahead room pages list the occurrences of recurring bookings
+UPCOMING_DAYS = 14
+# how many days the utilisation report covers unless asked otherwise
+REPORT_DAYS = 28
 
 rooms_bp = Blueprint("rooms", __name__)
 
 
-def sorter(items, key_func):
-    if len(items) <= 1:
-        return items
+@rooms_bp.route("/rooms")
+@query_budget(3)
+@conditional(lambda: ["rooms"])
+def rooms():
+    if not is_logged_in():
+        return redirect(url_for("auth.login"))
 
-    pivot = items[len(items) // 2]
-    left = [item for item in items if key_func(item) < key_func(pivot)]
-    middle = [item for item in items if key_func(item) == key_func(pivot)]
-    right = [item for item in items if key_func(item) > key_func(pivot)]
+    user = get_current_user()
+    sorted_rooms = room_catalog.get().by_floor
+    return render_template("rooms/list.html", user=user, rooms=sorted_rooms)
 
-    return sorter(left, key_func) + middle + sorter(right, key_func)
 
+@rooms_bp.route("/rooms/available")
+@query_budget(5)
+def available_rooms():
+    if not is_logged_in():
+        return redirect(url_for("auth.login"))
 
-def is_logged_in():
-    return "employeeid" in session
+    user = get_current_user()
+    timebegin = request.args.get("timebegin", "")
+    timefinish = request.args.get("timefinish", "")
+    capacity = request.args.get("capacity", "").strip()
+    floor = request.args.get("floor", "").strip()
 
+    # show the empty search form until a window is given
+    if not timebegin and not timefinish:
+        return render_template("rooms/available.html", user=user, rooms=None)
 
-def get_current_user():
-    if is_logged_in():
-        return db.session.get(Employee, session["employeeid"])
-    return None
+    try:
+        begin_dt = parse_local(timebegin)
+        finish_dt = parse_local(timefinish)
+        capacity_num = int(capacity) if capacity else 1
+        floor_num = int(floor) if floor else None
+    except ValueError:
+        flash("Invalid search, check the times, capacity and floor", "error")
+        return render_template("rooms/available.html", user=user, rooms=None)
 
+    if finish_dt <= begin_dt:
+        flash("End time must be after start time", "error")
+        return render_template("rooms/available.html", user=user, rooms=None)
 
-@rooms_bp.route("/rooms")
-def rooms():
-    if not is_logged_in():
-        return redirect(url_for("auth.login"))
+    if begin_dt < datetime.now():
+        flash("Cannot search for rooms in the past", "error")
+        return render_template("rooms/available.html", user=user, rooms=None)
 
-    user = get_current_user()
-    all_rooms = Room.query.all()
-    sorted_rooms = sorter(all_rooms, key_func=lambda room: (room.floor, room.roomname))
-    return render_template("rooms/list.html", user=user, rooms=sorted_rooms)
+    if (finish_dt - begin_dt).total_seconds() / 3600 > MAX_BOOKING_HOURS:
+        flash(f"Booking duration cannot exceed {MAX_BOOKING_HOURS} hours", "error")
+        return render_template("rooms/available.html", user=user, rooms=None)
+
+    candidates = [
+        room
+        for room in room_catalog.get().by_floor
+        if room.capacity >= capacity_num
+        and (floor_num is None or room.floor == floor_num)
+    ]
+
+    free = occupancy.free_rooms(candidates, begin_dt, finish_dt)
+    return render_template("rooms/available.html", user=user, rooms=free)
 
 
 @rooms_bp.route("/rooms/<int:room_id>")
+@query_budget(6)
+@conditional(
+    lambda room_id: ["rooms", "employees", versions.room_bookings(room_id)]
+)
 def room_detail(room_id):
     if not is_logged_in():
         return redirect(url_for("auth.login"))
 
     user = get_current_user()
-    room = Room.query.get_or_404(room_id)
-    bookings = Booking.query.filter_by(roomid=room_id).all()
+    room = room_catalog.get().room(room_id)
+    if room is None:
+        abort(404)
+    bookings = (
+        Booking.query.filter_by(roomid=room_id)
+        .options(joinedload(Booking.employee))
+        .order_by(Booking.timebegin_epoch, Booking.bookingid)
+        .all()
+    )
 
-    return render_template("rooms/detail.html", user=user, room=room, bookings=bookings)
+    # from the start of today, so the page only changes with the date
+    today = datetime.combine(date.today(), datetime.min.time())
+    occurrences = upcoming_occurrences(
+        [room_id], today, today + timedelta(days=UPCOMING_DAYS)
+    )
+
+    return render_template(
+        "rooms/detail.html",
+        user=user,
+        room=room,
+        bookings=bookings,
+        occurrences=occurrences,
+        upcoming_days=UPCOMING_DAYS,
+    )
 
 
 @rooms_bp.route("/admin/rooms/new", methods=["POST"])
 def admin_create_room():
-    if not is_logged_in() or session.get("role") != "admin":
+    if not is_admin():
         flash("Access denied", "error")
         return redirect(url_for("dashboard.dashboard"))
 
@@ -114,3 +193,93 @@ def admin_create_room():
         flash(f"Error creating room: {str(e)}", "error")
 
     return redirect(url_for("dashboard.admin_dashboard"))
+
+
+def report_range():
+    """The (first, last) dates asked for, the last REPORT_DAYS by default."""
+    last = _date_arg("to") or date.today()
+    first = _date_arg("from") or last - timedelta(days=REPORT_DAYS - 1)
+    if first > last:
+        first, last = last, first
+    return first, last
+
+
+def _date_arg(name):
+    try:
+        return date.fromisoformat(request.args.get(name, ""))
+    except ValueError:
+        return None
+
+
+@rooms_bp.route("/admin/utilisation")
+@query_budget(4)
+def admin_utilisation():
+    if not is_admin():
+        flash("Access denied", "error")
+        return redirect(url_for("dashboard.dashboard"))
+
+    user = get_current_user()
+    first, last = report_range()
+    view = request.args.get("view", "room")
+    catalog = room_catalog.get()
+    if view == "floor":
+        rows = utilisation.by_floor(catalog, first, last)
+    elif view == "week":
+        rows = utilisation.by_hour_of_week(catalog, first, last)
+    else:
+        view = "room"
+        rows = utilisation.by_room(catalog, first, last)
+
+    return render_template(
+        "rooms/utilisation.html",
+        user=user,
+        view=view,
+        rows=rows,
+        first=first,
+        last=last,
+        weekdays=utilisation.WEEKDAYS,
+        working_hours=utilisation.WORKING_HOURS,
+    )
+
+
+@rooms_bp.route("/admin/utilisation.csv")
+def admin_utilisation_csv():
+    if not is_admin():
+        flash("Access denied", "error")
+        return redirect(url_for("dashboard.dashboard"))
+
+    first, last = report_range()
+    rooms = room_catalog.get().by_id
+
+    def generate():
+        out = io.StringIO()
+        writer = csv.writer(out)
+        writer.writerow(
+            ["date", "weekday", "hour", "roomid", "roomname", "floor", "minutes"]
+        )
+        for day, hour, roomid, seconds in utilisation.rows_between(first, last):
+            when = utilisation.date_of(day)
+            room = rooms.get(roomid)
+            writer.writerow(
+                [
+                    when.isoformat(),
+                    utilisation.WEEKDAYS[when.weekday()],
+                    hour,
+                    roomid,
+                    room.roomname if room else "",
+                    room.floor if room else "",
+                    f"{seconds / 60:g}",
+                ]
+            )
+            if out.tell() > 64 * 1024:
+                yield out.getvalue()
+                out.seek(0)
+                out.truncate()
+        yield out.getvalue()
+
+    filename = f"utilisation-{first.isoformat()}-{last.isoformat()}.csv"
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
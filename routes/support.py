@@ -1,20 +1,13 @@
-from flask import Blueprint, render_template, request, redirect, url_for, session, flash
-from models import db, Employee, Admin, SupportTicket
+from flask import Blueprint, render_template, request, redirect, url_for, flash
+from models import db, Admin, SupportTicket
+from services.auth import get_current_user, is_admin, is_logged_in
+from services.query_budget import query_budget
 
 support_bp = Blueprint("support", __name__)
 
 
-def is_logged_in():
-    return "employeeid" in session
-
-
-def get_current_user():
-    if is_logged_in():
-        return db.session.get(Employee, session["employeeid"])
-    return None
-
-
 @support_bp.route("/support", methods=["GET", "POST"])
+@query_budget(4)
 def support():
     if not is_logged_in():
         return redirect(url_for("auth.login"))
@@ -40,13 +33,17 @@ def support():
         else:
             flash("No admin available. Please try again later.", "error")
 
-    tickets = SupportTicket.query.filter_by(employeeid=user.employeeid).all()
+    tickets = (
+        SupportTicket.query.filter_by(employeeid=user.employeeid)
+        .order_by(SupportTicket.created_at_epoch, SupportTicket.ticketid)
+        .all()
+    )
     return render_template("support/form.html", user=user, tickets=tickets)
 
 
 @support_bp.route("/support/<int:ticket_id>/delete", methods=["POST"])
 def delete_ticket(ticket_id):
-    if not is_logged_in() or session.get("role") != "admin":
+    if not is_admin():
         flash("Access denied", "error")
         return redirect(url_for("dashboard.dashboard"))
     user = get_current_user()
@@ -0,0 +1,146 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import (
+    delete,
+    func,
+    insert,
+    literal,
+    literal_column,
+    select,
+    union_all,
+)
+
+from models import db, Booking, BookingArchive, Employee, Room, to_epoch
+from services import versions
+from services.booking_index import booking_index
+from services.database import begin_immediate
+
+# Bookings that finished long ago are moved to bookings_archive, so the live
+# table, and every conflict check, dashboard and room page reading it, stays
+# the size of current business rather than of all history.
+
+ARCHIVE_AFTER_DAYS = 365
+CHUNK_SIZE = 1000
+# the most rows one history page lists
+HISTORY_LIMIT = 1000
+
+_COLUMNS = (
+    "bookingid",
+    "employeeid",
+    "roomid",
+    "timebegin",
+    "timefinish",
+    "timebegin_epoch",
+    "timefinish_epoch",
+)
+
+
+def archive_bookings(older_than_days=ARCHIVE_AFTER_DAYS, chunk_size=CHUNK_SIZE):
+    """Move bookings that finished over `older_than_days` ago to the archive.
+
+    Each chunk is copied and deleted in its own short write transaction, so
+    bookings can still be made while a large backlog is archived. Returns
+    the number of bookings moved.
+    """
+    cutoff = to_epoch(datetime.now() - timedelta(days=older_than_days))
+    archived_at = datetime.now().isoformat(timespec="seconds")
+    moved = 0
+    last_id = 0
+    while True:
+        begin_immediate()
+        ids = db.session.scalars(
+            select(Booking.bookingid)
+            .where(
+                Booking.bookingid > last_id,
+                Booking.timefinish_epoch < cutoff,
+            )
+            .order_by(Booking.bookingid)
+            .limit(chunk_size)
+        ).all()
+        if not ids:
+            db.session.commit()
+            break
+        columns = [getattr(Booking, name) for name in _COLUMNS]
+        db.session.execute(
+            insert(BookingArchive).from_select(
+                [*_COLUMNS, "archived_at"],
+                select(*columns, literal(archived_at)).where(
+                    Booking.bookingid.in_(ids)
+                ),
+            )
+        )
+        roomids = db.session.scalars(
+            select(Booking.roomid).where(Booking.bookingid.in_(ids)).distinct()
+        ).all()
+        db.session.execute(
+            delete(Booking).where(Booking.bookingid.in_(ids)),
+            execution_options={"synchronize_session": False},
+        )
+        # room pages list every live booking, so they change too
+        versions.bump(
+            db.session.connection(), *map(versions.room_bookings, sorted(roomids))
+        )
+        db.session.commit()
+
+        # the bulk delete skipped the session hooks, so the index is told
+        # here. The utilisation summary is left alone, it covers history
+        if booking_index.loaded:
+            for bookingid in ids:
+                booking_index.discard(bookingid)
+        moved += len(ids)
+        last_id = ids[-1]
+    return moved
+
+
+def archived_until():
+    """Finish time (epoch) of the latest archived booking, or None."""
+    return db.session.scalar(select(func.max(BookingArchive.timefinish_epoch)))
+
+
+def history_query(begin, finish, employeeid=None, roomids=None):
+    """Bookings overlapping [begin, finish), oldest first, as a select.
+
+    The archive is only read when the range reaches back before the end of
+    the latest archived booking. `roomids` limits the rooms, None means all.
+    """
+    begin, finish = to_epoch(begin), to_epoch(finish)
+
+    def part(model, archived):
+        query = (
+            select(
+                model.bookingid,
+                model.roomid,
+                Room.roomname,
+                Room.floor,
+                Employee.fname,
+                Employee.lname,
+                model.timebegin,
+                model.timefinish,
+                model.timebegin_epoch,
+                literal(archived).label("archived"),
+            )
+            .join(Room, Room.roomid == model.roomid)
+            .join(Employee, Employee.employeeid == model.employeeid)
+            .where(model.timebegin_epoch < finish, model.timefinish_epoch > begin)
+        )
+        if employeeid is not None:
+            query = query.where(model.employeeid == employeeid)
+        if roomids is not None:
+            query = query.where(model.roomid.in_(roomids))
+        return query
+
+    parts = [part(Booking, False)]
+    until = archived_until()
+    if until is not None and begin < until:
+        parts.append(part(BookingArchive, True))
+    statement = union_all(*parts) if len(parts) > 1 else parts[0]
+    return statement.order_by(
+        literal_column("timebegin_epoch"), literal_column("bookingid")
+    )
+
+
+def history(begin, finish, employeeid=None, roomids=None, limit=HISTORY_LIMIT):
+    """The first `limit` rows of history_query, and whether there were more."""
+    statement = history_query(begin, finish, employeeid, roomids)
+    rows = db.session.execute(statement.limit(limit + 1)).all()
+    return rows[:limit], len(rows) > limit
@@ -0,0 +1,104 @@
+from flask_login import LoginManager, UserMixin, current_user, login_user
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import db, Employee
+from services.cache import LRUCache
+
+login_manager = LoginManager()
+
+# identities of recently seen users, shared by every request in this process.
+# the TTL bounds how long another process's change can go unnoticed
+user_cache = LRUCache(maxsize=2048, ttl=60)
+
+
+class CurrentUser(UserMixin):
+    """The signed-in employee's identity and role.
+
+    A plain copy of the Employee columns pages need, so it can be cached
+    across requests without holding on to a database session.
+    """
+
+    def __init__(self, employeeid, fname, lname, email, role):
+        self.employeeid = employeeid
+        self.fname = fname
+        self.lname = lname
+        self.email = email
+        self.role = role
+
+    @classmethod
+    def from_employee(cls, employee):
+        return cls(
+            employee.employeeid,
+            employee.fname,
+            employee.lname,
+            employee.email,
+            employee.role,
+        )
+
+    def get_id(self):
+        return str(self.employeeid)
+
+    def __repr__(self):
+        return f"<CurrentUser {self.fname} {self.lname}>"
+
+
+@login_manager.user_loader
+def load_user(user_id):
+    # flask-login keeps the result on g, so this runs at most once a request
+    try:
+        employeeid = int(user_id)
+    except ValueError:
+        return None
+
+    user = user_cache.get(employeeid)
+    if user is None:
+        employee = db.session.get(Employee, employeeid)
+        if employee is None:
+            return None
+        user = CurrentUser.from_employee(employee)
+        user_cache.set(employeeid, user)
+    return user
+
+
+def sign_in(employee):
+    user = CurrentUser.from_employee(employee)
+    user_cache.set(employee.employeeid, user)
+    login_user(user)
+    return user
+
+
+def is_logged_in():
+    return current_user.is_authenticated
+
+
+def is_admin():
+    return current_user.is_authenticated and current_user.role == "admin"
+
+
+def get_current_user():
+    if is_logged_in():
+        return current_user._get_current_object()
+    return None
+
+
+# drop cached identities once a change to their employee row is committed
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_employee_changes(session, flush_context):
+    changed = session.info.setdefault("changed_employees", set())
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, Employee):
+            changed.add(obj.employeeid)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_employees(session):
+    for employeeid in session.info.pop("changed_employees", ()):
+        user_cache.pop(employeeid)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_employee_changes(session):
+    session.info.pop("changed_employees", None)
@@ -0,0 +1,265 @@
+import csv
+import io
+import json
+from collections import Counter, namedtuple
+from datetime import datetime
+from itertools import islice
+
+from sqlalchemy import insert
+
+from models import db, Employee, Room, Booking, to_epoch
+from services.booking_index import RoomIntervalIndex, Span, booking_index
+from services.booking_rules import booking_time_error, parse_local
+from services import events, utilisation, versions
+from services.database import begin_immediate
+from services.recurrence import series_spans_between
+
+CHUNK_SIZE = 500
+
+# one line of the import report
+ImportResult = namedtuple("ImportResult", ["line", "status", "reason", "bookingid"])
+
+
+def read_rows(stream, filename):
+    """Yield (line number, row dict) from an uploaded CSV, JSON or JSON Lines file.
+
+    CSV and JSON Lines are read a line at a time. A JSON file must hold a
+    list of objects and is parsed in one go.
+    """
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    name = (filename or "").lower()
+
+    if name.endswith(".csv"):
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, row
+    elif name.endswith(".jsonl"):
+        for line_no, line in enumerate(text, start=1):
+            if line.strip():
+                yield line_no, _json_row(line)
+    elif name.endswith(".json"):
+        rows = json.load(text)
+        if not isinstance(rows, list):
+            raise ValueError("A JSON import must be a list of bookings")
+        for line_no, row in enumerate(rows, start=1):
+            yield line_no, row if isinstance(row, dict) else {}
+    else:
+        raise ValueError("Upload a .csv, .json or .jsonl file")
+
+
+def _json_row(line):
+    try:
+        row = json.loads(line)
+    except ValueError:
+        return {}
+    return row if isinstance(row, dict) else {}
+
+
+def _field(row, name):
+    value = row.get(name)
+    return str(value).strip() if value is not None else ""
+
+
+def _parse_chunk(chunk, rooms, now):
+    """Validate a chunk of rows, returning (rejected results, parsed rows)."""
+    rejected = []
+    parsed = []
+
+    ids = set()
+    emails = set()
+    for _, row in chunk:
+        if _field(row, "employeeid").isdigit():
+            ids.add(int(_field(row, "employeeid")))
+        elif _field(row, "email"):
+            emails.add(_field(row, "email").lower())
+
+    # one lookup per chunk for the employees it mentions
+    known_ids = set()
+    by_email = {}
+    if ids:
+        known_ids = {
+            employeeid
+            for (employeeid,) in db.session.query(Employee.employeeid).filter(
+                Employee.employeeid.in_(ids)
+            )
+        }
+    if emails:
+        by_email = dict(
+            db.session.query(db.func.lower(Employee.email), Employee.employeeid).filter(
+                db.func.lower(Employee.email).in_(emails)
+            )
+        )
+
+    for line, row in chunk:
+        timebegin = _field(row, "timebegin")
+        timefinish = _field(row, "timefinish")
+        roomid = _field(row, "roomid")
+
+        if not all([timebegin, timefinish, roomid]) or not (
+            _field(row, "employeeid") or _field(row, "email")
+        ):
+            rejected.append(ImportResult(line, "rejected", "Missing fields", None))
+            continue
+
+        if _field(row, "employeeid"):
+            employeeid = _field(row, "employeeid")
+            employeeid = int(employeeid) if employeeid.isdigit() else None
+            if employeeid not in known_ids:
+                employeeid = None
+        else:
+            employeeid = by_email.get(_field(row, "email").lower())
+        if employeeid is None:
+            rejected.append(ImportResult(line, "rejected", "Unknown employee", None))
+            continue
+
+        if not roomid.isdigit() or int(roomid) not in rooms:
+            rejected.append(ImportResult(line, "rejected", "Unknown room", None))
+            continue
+
+        try:
+            begin_dt = parse_local(timebegin)
+            finish_dt = parse_local(timefinish)
+        except ValueError:
+            rejected.append(
+                ImportResult(line, "rejected", "Invalid date/time format", None)
+            )
+            continue
+
+        error = booking_time_error(begin_dt, finish_dt, now=now)
+        if error:
+            rejected.append(ImportResult(line, "rejected", error, None))
+            continue
+
+        parsed.append(
+            (
+                line,
+                {
+                    "employeeid": employeeid,
+                    "roomid": int(roomid),
+                    "timebegin": timebegin,
+                    "timefinish": timefinish,
+                    "timebegin_epoch": to_epoch(begin_dt),
+                    "timefinish_epoch": to_epoch(finish_dt),
+                },
+            )
+        )
+    return rejected, parsed
+
+
+def _existing_spans(parsed):
+    """Index the stored bookings and series occurrences in the chunk's range."""
+    spans = RoomIntervalIndex()
+    if not parsed:
+        return spans
+    roomids = {values["roomid"] for _, values in parsed}
+    begin = min(values["timebegin_epoch"] for _, values in parsed)
+    finish = max(values["timefinish_epoch"] for _, values in parsed)
+    rows = db.session.query(
+        Booking.bookingid,
+        Booking.roomid,
+        Booking.timebegin_epoch,
+        Booking.timefinish_epoch,
+    ).filter(
+        Booking.roomid.in_(roomids),
+        Booking.timebegin_epoch < finish,
+        Booking.timefinish_epoch > begin,
+    )
+    for bookingid, roomid, timebegin, timefinish in rows:
+        spans.add(Span(timebegin, timefinish, bookingid, roomid))
+    for span in series_spans_between(roomids, begin, finish):
+        spans.add(span)
+    return spans
+
+
+def import_bookings(rows, chunk_size=CHUNK_SIZE):
+    """Check and insert (line, row) pairs, returning one ImportResult per row.
+
+    Rows are taken a chunk at a time. Each chunk costs one query for its
+    employees, one each for the stored bookings and recurring series in
+    its time range and one multi-row INSERT, and runs in its own write
+    transaction so other writers are never held up for long. A row is
+    rejected if it clashes with a stored booking, a series occurrence or a
+    row accepted earlier in the import.
+    """
+    rooms = {roomid for (roomid,) in db.session.query(Room.roomid)}
+    now = datetime.now()
+    results = []
+    # rows accepted so far, to catch clashes within the import itself
+    accepted = RoomIntervalIndex()
+
+    rows = iter(rows)
+    while chunk := list(islice(rows, chunk_size)):
+        # no other booking can be written between the checks and the insert
+        begin_immediate()
+        rejected, parsed = _parse_chunk(chunk, rooms, now)
+        results.extend(rejected)
+        existing = _existing_spans(parsed)
+
+        to_insert = []
+        for line, values in parsed:
+            roomid = values["roomid"]
+            begin, finish = values["timebegin_epoch"], values["timefinish_epoch"]
+            if existing.overlaps(roomid, begin, finish):
+                reason = "Room is already booked for that time"
+            elif accepted.overlaps(roomid, begin, finish):
+                reason = "Overlaps another booking in this import"
+            else:
+                accepted.add(Span(begin, finish, -line, roomid))
+                to_insert.append((line, values))
+                continue
+            results.append(ImportResult(line, "rejected", reason, None))
+
+        if to_insert:
+            statement = insert(Booking).returning(
+                Booking.bookingid, sort_by_parameter_order=True
+            )
+            ids = db.session.scalars(
+                statement, [values for _, values in to_insert]
+            ).all()
+            # the session hooks don't see a bulk insert, so the utilisation
+            # summary and room versions are brought up to date by hand in
+            # the same transaction
+            deltas = Counter()
+            for _, values in to_insert:
+                utilisation.add_span(
+                    deltas,
+                    1,
+                    values["roomid"],
+                    values["timebegin_epoch"],
+                    values["timefinish_epoch"],
+                )
+            utilisation.apply(db.session.connection(), deltas)
+            roomids = sorted({values["roomid"] for _, values in to_insert})
+            versions.bump(
+                db.session.connection(), *map(versions.room_bookings, roomids)
+            )
+            db.session.commit()
+
+            # a bulk insert skips the session hooks, so update the index
+            # and tell listeners here
+            for (line, values), bookingid in zip(to_insert, ids):
+                events.publish(
+                    events.booking_event(
+                        "booking.created",
+                        bookingid,
+                        values["roomid"],
+                        values["timebegin"],
+                        values["timefinish"],
+                    )
+                )
+                if booking_index.loaded:
+                    booking_index.add(
+                        Span(
+                            values["timebegin_epoch"],
+                            values["timefinish_epoch"],
+                            bookingid,
+                            values["roomid"],
+                        )
+                    )
+                results.append(ImportResult(line, "accepted", None, bookingid))
+        else:
+            # nothing to write, so let go of the write lock straight away
+            db.session.rollback()
+
+    results.sort(key=lambda result: result.line)
+    return results
@@ -0,0 +1,299 @@
+import threading
+from bisect import bisect_left, bisect_right, insort
+from collections import namedtuple
+from datetime import datetime
+from operator import attrgetter
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import db, Booking, to_epoch
+from services import versions
+
+# one booking as the index sees it, ordered by start time (epoch seconds)
+Span = namedtuple("Span", ["begin", "finish", "bookingid", "roomid"])
+
+_begin_key = attrgetter("begin")
+
+_COLUMNS = (
+    Booking.bookingid,
+    Booking.roomid,
+    Booking.timebegin_epoch,
+    Booking.timefinish_epoch,
+)
+
+
+class RoomIntervalIndex:
+    """Sorted interval index of bookings, one list per room.
+
+    Bookings are half-open [begin, finish) intervals kept sorted by start
+    time. Each room also remembers its longest booking, so an overlap
+    lookup bisects to the window that could reach the requested range and
+    only scans those entries.
+
+    The index only covers bookings that had not finished when it was
+    loaded (plus anything committed since). It is a per-process cache,
+    the database stays the authority: ensure_loaded checks the "bookings"
+    data version and reloads the rooms other processes have changed.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._refresh_lock = threading.Lock()
+        self._rooms = {}
+        self._longest = {}
+        self._by_id = {}
+        self._listeners = []
+        self._seen = None
+        self._room_versions = {}
+        self.horizon = None
+
+    def subscribe(self, callback):
+        """Call `callback(span)` after a booking is added or removed.
+
+        The span is None when the whole index or a room was reloaded.
+        """
+        self._listeners.append(callback)
+
+    def _notify(self, span):
+        for callback in self._listeners:
+            callback(span)
+
+    @property
+    def loaded(self):
+        return self.horizon is not None
+
+    def load(self, session=None):
+        session = session or db.session
+        # versions before the rows, so a change landing in between leaves
+        # the index looking stale rather than up to date
+        seen = versions.current(versions.BOOKINGS)
+        room_versions = versions.room_versions()
+        horizon = to_epoch(
+            datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        )
+        rows = session.query(*_COLUMNS).filter(Booking.timefinish_epoch >= horizon)
+
+        with self._lock:
+            self._rooms = {}
+            self._longest = {}
+            self._by_id = {}
+            for bookingid, roomid, timebegin, timefinish in rows:
+                self._insert(_make_span(bookingid, roomid, timebegin, timefinish))
+            for entries in self._rooms.values():
+                entries.sort()
+            self.horizon = horizon
+            self._seen = seen
+            self._room_versions = room_versions
+        self._notify(None)
+
+    def ensure_loaded(self, session=None):
+        """Load the index, or catch up with bookings made by other processes."""
+        if not self.loaded:
+            with self._lock:
+                if not self.loaded:
+                    self.load(session)
+                    return
+        self.refresh(session)
+
+    def refresh(self, session=None):
+        # one primary key lookup while nothing has changed anywhere
+        seen = versions.current(versions.BOOKINGS)
+        if seen == self._seen:
+            return
+        with self._refresh_lock:
+            if seen == self._seen:
+                return
+            room_versions = versions.room_versions()
+            stale = [
+                roomid
+                for roomid, version in room_versions.items()
+                if self._room_versions.get(roomid) != version
+            ]
+            self.reload_rooms(stale, session)
+            self._room_versions = room_versions
+            self._seen = seen
+
+    def committed(self, bumped):
+        """Catch up with versions this process bumped, see versions.on_commit."""
+        with self._lock:
+            if self._seen is None:
+                return
+            for name, (first, last) in bumped.items():
+                roomid = versions.booked_room(name)
+                if name == versions.BOOKINGS and self._seen == first - 1:
+                    self._seen = last
+                elif roomid is not None:
+                    if self._room_versions.get(roomid, 0) == first - 1:
+                        self._room_versions[roomid] = last
+
+    def reload_room(self, roomid, session=None):
+        self.reload_rooms([roomid], session)
+
+    def reload_rooms(self, roomids, session=None):
+        if not roomids:
+            return
+        session = session or db.session
+        rows = session.query(*_COLUMNS).filter(
+            Booking.roomid.in_(roomids),
+            Booking.timefinish_epoch >= self.horizon,
+        )
+        with self._lock:
+            for roomid in roomids:
+                for span in self._rooms.pop(roomid, []):
+                    self._by_id.pop(span.bookingid, None)
+                self._longest.pop(roomid, None)
+            for bookingid, roomid, timebegin, timefinish in rows:
+                self._insert(_make_span(bookingid, roomid, timebegin, timefinish))
+            for roomid in roomids:
+                self._rooms.get(roomid, []).sort()
+        self._notify(None)
+
+    def covers(self, begin):
+        return self.loaded and to_epoch(begin) >= self.horizon
+
+    def add(self, span):
+        if span is None:
+            return
+        with self._lock:
+            self.discard(span.bookingid)
+            self._insert(span, keep_sorted=True)
+        self._notify(span)
+
+    def discard(self, bookingid):
+        with self._lock:
+            span = self._by_id.pop(bookingid, None)
+            if span is None:
+                return
+            entries = self._rooms.get(span.roomid, [])
+            i = bisect_left(entries, span)
+            if i < len(entries) and entries[i] == span:
+                del entries[i]
+        self._notify(span)
+
+    def overlaps(self, roomid, begin, finish):
+        """Return every indexed booking in the room overlapping [begin, finish)."""
+        begin, finish = to_epoch(begin), to_epoch(finish)
+        with self._lock:
+            entries = self._rooms.get(roomid)
+            if not entries:
+                return []
+            # nothing starting at or before this point can reach `begin`
+            lo = bisect_right(entries, begin - self._longest[roomid], key=_begin_key)
+            hi = bisect_left(entries, finish, key=_begin_key, lo=lo)
+            return [span for span in entries[lo:hi] if span.finish > begin]
+
+    def spans_between(self, begin, finish):
+        """Every indexed booking, in any room, overlapping [begin, finish)."""
+        with self._lock:
+            roomids = list(self._rooms)
+        spans = []
+        for roomid in roomids:
+            spans.extend(self.overlaps(roomid, begin, finish))
+        return spans
+
+    def is_free(self, roomid, begin, finish):
+        return not self.overlaps(roomid, begin, finish)
+
+    def _insert(self, span, keep_sorted=False):
+        entries = self._rooms.setdefault(span.roomid, [])
+        if keep_sorted:
+            insort(entries, span)
+        else:
+            entries.append(span)
+        duration = span.finish - span.begin
+        if duration > self._longest.get(span.roomid, 0):
+            self._longest[span.roomid] = duration
+        self._by_id[span.bookingid] = span
+
+
+def _make_span(bookingid, roomid, begin, finish):
+    if begin is None or finish is None or finish <= begin:
+        return None
+    return Span(begin, finish, bookingid, int(roomid))
+
+
+def _span_of(booking):
+    # the epoch columns are filled in by the before_insert/update hooks
+    return _make_span(
+        booking.bookingid,
+        booking.roomid,
+        booking.timebegin_epoch,
+        booking.timefinish_epoch,
+    )
+
+
+booking_index = RoomIntervalIndex()
+versions.on_commit(booking_index.committed)
+
+
+def find_conflict(roomid, begin, finish):
+    """Return a booking clashing with [begin, finish) in the room, or None.
+
+    The index answers first so a clash can be rejected with a primary key
+    lookup. When the index reports the slot free, the overlap query runs
+    inside the current transaction and has the final say. Any disagreement
+    means another process changed the room, so its entries are reloaded.
+    """
+    begin, finish = to_epoch(begin), to_epoch(finish)
+    booking_index.ensure_loaded()
+
+    if booking_index.covers(begin):
+        clashes = booking_index.overlaps(roomid, begin, finish)
+        if clashes:
+            # the entries may be stale, so the row has to still overlap
+            existing = Booking.query.filter(
+                Booking.bookingid.in_([span.bookingid for span in clashes]),
+                Booking.roomid == roomid,
+                Booking.timebegin_epoch < finish,
+                Booking.timefinish_epoch > begin,
+            ).first()
+            if existing:
+                return existing
+            booking_index.reload_room(roomid)
+
+    conflict = Booking.query.filter(
+        Booking.roomid == roomid,
+        Booking.timebegin_epoch < finish,
+        Booking.timefinish_epoch > begin,
+    ).first()
+
+    if conflict and booking_index.covers(begin):
+        booking_index.reload_room(roomid)
+    return conflict
+
+
+# keep the index in step with committed bookings: changes are collected at
+# flush time and only applied once the transaction commits
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_booking_changes(session, flush_context):
+    pending = session.info.setdefault("booking_index_changes", [])
+    # attributes are read now, they are expired once the commit finishes
+    for obj in session.new:
+        if isinstance(obj, Booking):
+            pending.append(("add", _span_of(obj)))
+    for obj in session.dirty:
+        if isinstance(obj, Booking) and session.is_modified(obj):
+            pending.append(("add", _span_of(obj)))
+    for obj in session.deleted:
+        if isinstance(obj, Booking):
+            pending.append(("discard", obj.bookingid))
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_booking_changes(session):
+    pending = session.info.pop("booking_index_changes", None)
+    if not pending or not booking_index.loaded:
+        return
+    for action, value in pending:
+        if action == "discard":
+            booking_index.discard(value)
+        else:
+            booking_index.add(value)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_booking_changes(session):
+    session.info.pop("booking_index_changes", None)
@@ -0,0 +1,32 @@
+from datetime import datetime
+
+# nobody needs a room for longer than a working day
+MAX_BOOKING_HOURS = 8
+
+
+def parse_local(value):
+    """Parse an ISO 8601 date and time as local wall-clock time.
+
+    Booking times carry no timezone, so a value with an offset raises
+    ValueError like any other malformed time instead of failing later when
+    it is compared with a naive one.
+    """
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        raise ValueError(f"{value!r} has a timezone, times are local")
+    return parsed
+
+
+def booking_time_error(begin_dt, finish_dt, now=None):
+    """Return why a booking from begin_dt to finish_dt is not allowed, or None."""
+    if finish_dt <= begin_dt:
+        return "End time must be after start time"
+
+    if begin_dt < (now or datetime.now()):
+        return "Cannot create bookings in the past"
+
+    duration_hours = (finish_dt - begin_dt).total_seconds() / 3600
+    if duration_hours > MAX_BOOKING_HOURS:
+        return f"Booking duration cannot exceed {MAX_BOOKING_HOURS} hours"
+
+    return None
@@ -0,0 +1,158 @@
+from collections import Counter, namedtuple
+from datetime import datetime
+
+from sqlalchemy import delete, or_, select, update
+
+from models import (
+    db,
+    Admin,
+    Booking,
+    BookingArchive,
+    BookingSeries,
+    SeriesException,
+    SupportTicket,
+    to_epoch,
+)
+from services import events, utilisation, versions
+from services.booking_index import booking_index
+from services.database import begin_immediate
+from services.recurrence import Recurrence, active_series
+
+# Admin operations on many bookings at once. Bookings, which are most of the
+# rows, go in one DELETE ... RETURNING per table and are never loaded into
+# the session. The returned rows are used to do what the session hooks
+# would have done. Series are few, so they still go through the session.
+
+CancelResult = namedtuple("CancelResult", ["bookings", "occurrences"])
+OffboardResult = namedtuple(
+    "OffboardResult", ["bookings", "archived", "series", "tickets", "reassigned"]
+)
+
+
+def _delete_spans(model, condition):
+    """Delete rows of `model` matching `condition`, returning what they were.
+
+    The utilisation summary and room versions are updated in the same
+    transaction.
+    """
+    rows = db.session.execute(
+        delete(model)
+        .where(condition)
+        .returning(
+            model.bookingid,
+            model.roomid,
+            model.timebegin,
+            model.timefinish,
+            model.timebegin_epoch,
+            model.timefinish_epoch,
+        ),
+        execution_options={"synchronize_session": False},
+    ).all()
+    deltas = Counter()
+    for row in rows:
+        utilisation.add_span(
+            deltas, -1, row.roomid, row.timebegin_epoch, row.timefinish_epoch
+        )
+    utilisation.apply(db.session.connection(), deltas)
+    roomids = sorted({row.roomid for row in rows})
+    versions.bump(db.session.connection(), *map(versions.room_bookings, roomids))
+    return rows
+
+
+def _cancelled(rows):
+    # once committed, so nobody hears of a cancellation that was rolled back
+    for row in rows:
+        if booking_index.loaded:
+            booking_index.discard(row.bookingid)
+        events.publish(
+            events.booking_event(
+                "booking.cancelled",
+                row.bookingid,
+                row.roomid,
+                row.timebegin,
+                row.timefinish,
+            )
+        )
+
+
+def cancel_bookings(begin, finish, roomids=None):
+    """Cancel everything starting in [begin, finish), returning a CancelResult.
+
+    `roomids` limits the rooms, None means every room. Bookings are deleted
+    and occurrences of recurring bookings skipped. Nothing that has already
+    started is touched.
+    """
+    begin = max(begin, datetime.now())
+    if finish <= begin:
+        return CancelResult(0, 0)
+
+    begin_immediate()
+    condition = (Booking.timebegin_epoch >= to_epoch(begin)) & (
+        Booking.timebegin_epoch < to_epoch(finish)
+    )
+    if roomids is not None:
+        condition &= Booking.roomid.in_(roomids)
+    rows = _delete_spans(Booking, condition)
+
+    occurrences = 0
+    for series in active_series(roomids, begin, finish):
+        for start, _ in Recurrence.from_series(series).occurrences(begin, finish):
+            if start >= begin:
+                db.session.add(
+                    SeriesException(
+                        seriesid=series.seriesid, date=start.date().isoformat()
+                    )
+                )
+                occurrences += 1
+    db.session.commit()
+    _cancelled(rows)
+    return CancelResult(len(rows), occurrences)
+
+
+def successor_admin(employeeid):
+    """The admin profile that takes over tickets from `employeeid`, or None."""
+    return db.session.scalar(
+        select(Admin.adminid)
+        .where(or_(Admin.employeeid != employeeid, Admin.employeeid.is_(None)))
+        .order_by(Admin.adminid)
+        .limit(1)
+    )
+
+
+def offboard_employee(employee, reassign_to=None):
+    """Delete `employee` and everything of theirs, returning an OffboardResult.
+
+    Tickets other people raised that are assigned to the employee's admin
+    profile move to the admin profile `reassign_to` first. A ValueError is
+    raised if there are some and nobody to give them to.
+    """
+    begin_immediate()
+    employeeid = employee.employeeid
+    profiles = select(Admin.adminid).where(Admin.employeeid == employeeid)
+    handled = SupportTicket.adminid.in_(profiles) & (
+        SupportTicket.employeeid != employeeid
+    )
+    reassigned = 0
+    if reassign_to is not None:
+        reassigned = db.session.execute(
+            update(SupportTicket).where(handled).values(adminid=reassign_to),
+            execution_options={"synchronize_session": False},
+        ).rowcount
+    elif db.session.scalar(select(SupportTicket.ticketid).where(handled).limit(1)):
+        db.session.rollback()
+        raise ValueError("No other admin to take over their support tickets")
+
+    tickets = db.session.execute(
+        delete(SupportTicket).where(SupportTicket.employeeid == employeeid),
+        execution_options={"synchronize_session": False},
+    ).rowcount
+    rows = _delete_spans(Booking, Booking.employeeid == employeeid)
+    archived = _delete_spans(BookingArchive, BookingArchive.employeeid == employeeid)
+    series = BookingSeries.query.filter_by(employeeid=employeeid).all()
+    for item in series:
+        db.session.delete(item)
+    # the admin profile goes with the employee, by ON DELETE CASCADE
+    db.session.delete(employee)
+    db.session.commit()
+    _cancelled(rows)
+    return OffboardResult(len(rows), len(archived), len(series), tickets, reassigned)
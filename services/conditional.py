@@ -0,0 +1,83 @@
+import hashlib
+from datetime import date, datetime
+from functools import wraps
+
+from flask import make_response, request, session
+from flask_login import current_user
+
+from services import versions
+
+# Conditional GET for pages built from versioned data (see services.versions).
+# The ETag is worked out from the data versions alone, so a client that
+# already has the page gets a 304 without the view running at all.
+
+
+class Validator:
+    """The ETag and Last-Modified of a response depending on `names`.
+
+    Anything else the page varies by is passed as `vary`. Pages are also
+    taken to vary by the signed-in user and the date.
+    """
+
+    def __init__(self, names, *vary):
+        stamps = versions.stamps(names)
+        today = date.today()
+        parts = (
+            request.full_path,
+            current_user.get_id(),
+            getattr(current_user, "role", None),
+            today.isoformat(),
+            *vary,
+            *(stamps[name][0] for name in names),
+        )
+        self.etag = hashlib.blake2b(repr(parts).encode(), digest_size=12).hexdigest()
+        changed = [
+            datetime.fromisoformat(updated_at)
+            for _, updated_at in stamps.values()
+            if updated_at
+        ]
+        midnight = datetime.combine(today, datetime.min.time())
+        self.last_modified = max([midnight, *changed])
+
+    def fresh(self):
+        # a page with messages waiting is rendered, or they are never shown
+        if "_flashes" in session:
+            return False
+        return request.if_none_match.contains_weak(self.etag)
+
+    def not_modified(self):
+        return self.apply(make_response("", 304))
+
+    def apply(self, response):
+        if response.status_code not in (200, 304):
+            return response
+        response.set_etag(self.etag, weak=True)
+        response.last_modified = self.last_modified.astimezone()
+        # browsers keep the page but check with us every time
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        response.vary.add("Cookie")
+        return response
+
+
+def conditional(depends):
+    """Answer a view's GETs with 304 while the versions it depends on stand.
+
+    `depends` is called with the view's arguments and returns the names of
+    the data versions the page is built from.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            # signed out visitors are only ever redirected
+            if not current_user.is_authenticated:
+                return view(**kwargs)
+            validator = Validator(depends(**kwargs))
+            if validator.fresh():
+                return validator.not_modified()
+            return validator.apply(make_response(view(**kwargs)))
+
+        return wrapper
+
+    return decorator
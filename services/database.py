@@ -0,0 +1,92 @@
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+from models import db
+
+# Connection settings for the SQLite database. "production" runs the
+# database in WAL mode so readers never wait for the writer, and keeps a
+# pool of connections open instead of reconnecting for every request.
+
+PROFILES = {
+    "development": {
+        "SQLITE_PRAGMAS": {"busy_timeout": 5000},
+    },
+    "production": {
+        "SQLITE_PRAGMAS": {
+            "journal_mode": "WAL",
+            # how long (ms) a writer waits for the lock before giving up
+            "busy_timeout": 5000,
+            # with WAL, NORMAL only risks the last commits on power loss
+            "synchronous": "NORMAL",
+            # negative sizes are KiB, so 64 MiB of page cache per connection
+            "cache_size": -64000,
+            "temp_store": "MEMORY",
+            "mmap_size": 256 * 1024 * 1024,
+        },
+        "SQLALCHEMY_ENGINE_OPTIONS": {
+            "pool_size": 10,
+            "max_overflow": 10,
+            "pool_timeout": 10,
+        },
+    },
+}
+
+
+def use_profile(app, name):
+    in_memory = is_in_memory(app.config.get("SQLALCHEMY_DATABASE_URI", ""))
+    for key, value in PROFILES[name].items():
+        # an in-memory database is one shared connection, there is no pool
+        # to size
+        if key == "SQLALCHEMY_ENGINE_OPTIONS" and in_memory:
+            continue
+        app.config.setdefault(key, value)
+
+
+def is_in_memory(uri):
+    url = make_url(uri)
+    return url.get_backend_name() == "sqlite" and (
+        url.database in (None, "", ":memory:") or url.query.get("mode") == "memory"
+    )
+
+
+def init_app(app):
+    """Enforce foreign keys, apply the pragmas and take over transaction handling.
+
+    The sqlite3 module opens transactions on its own and only ever with a
+    plain BEGIN. SQLAlchemy's "begin" event issues it instead, which lets a
+    write transaction ask for BEGIN IMMEDIATE (see `begin_immediate`).
+    """
+    with app.app_context():
+        engine = db.engine
+    if engine.dialect.name != "sqlite":
+        return
+    pragmas = app.config.get("SQLITE_PRAGMAS", {})
+
+    @event.listens_for(engine, "connect")
+    def _configure_connection(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        # off by default in SQLite, without it ON DELETE CASCADE does nothing
+        cursor.execute("PRAGMA foreign_keys = ON")
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+
+    @event.listens_for(engine, "begin")
+    def _begin(conn):
+        mode = conn.get_execution_options().get("sqlite_begin", "")
+        # straight to the driver, so it isn't counted as a query
+        conn.connection.dbapi_connection.execute(f"BEGIN {mode}".strip())
+
+
+def begin_immediate(session=None):
+    """Start the session's next transaction holding the database write lock.
+
+    Use before a check-then-write such as looking for a clashing booking and
+    then inserting one: no other writer can get in between, and the busy
+    timeout queues writers up instead of failing them part way through.
+    """
+    session = session or db.session()
+    if session.in_transaction():
+        session.commit()
+    session.connection(execution_options={"sqlite_begin": "IMMEDIATE"})
@@ -0,0 +1,259 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from itertools import count
+
+from sqlalchemy import event as sa_event
+from sqlalchemy.orm import Session
+
+from models import Booking, BookingSeries, SeriesException
+
+try:
+    import fcntl
+except ImportError:  # Windows, publishers then rely on O_APPEND alone
+    fcntl = None
+
+# Room occupancy changes, published once the transaction making them has
+# committed and fanned out to Server-Sent Events subscribers.
+
+QUEUE_SIZE = 100
+# sent in place of whatever a subscriber missed, it should fetch afresh
+RESYNC = {"type": "resync"}
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """One client's bounded queue of events for the rooms it follows.
+
+    A client that stops reading does not hold up the publisher: once its
+    queue is full the backlog is thrown away and replaced by a single
+    resync event.
+    """
+
+    def __init__(self, broker, roomids, maxsize):
+        self.broker = broker
+        self.roomids = roomids
+        self._queue = queue.Queue(maxsize)
+
+    def wants(self, event):
+        return (
+            self.roomids is None
+            or "roomid" not in event
+            or event["roomid"] in self.roomids
+        )
+
+    def put(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            while True:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            self._queue.put_nowait(RESYNC)
+
+    def get(self, timeout=None):
+        """The next event, or None if nothing arrived within `timeout`."""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class LocalBroker:
+    """Publish/subscribe between the threads of one process."""
+
+    def __init__(self, queue_size=QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+        self._ids = count(1)
+
+    def subscribe(self, roomids=None):
+        """Follow the given rooms, or every room when `roomids` is None."""
+        subscription = Subscription(
+            self, frozenset(roomids) if roomids is not None else None, self.queue_size
+        )
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, event):
+        self._dispatch(dict(event, id=f"{os.getpid()}-{next(self._ids)}"))
+
+    def _dispatch(self, event):
+        with self._lock:
+            for subscription in self._subscriptions:
+                if subscription.wants(event):
+                    subscription.put(event)
+
+    def __len__(self):
+        return len(self._subscriptions)
+
+
+class FileBroker(LocalBroker):
+    """Share events between worker processes through an append-only file.
+
+    Publishers append one JSON line per event, and every process tails the
+    file and hands new lines to its own subscribers, so an event reaches
+    clients whichever worker they are connected to. The file is swapped for
+    a fresh one once it passes `max_bytes`.
+    """
+
+    def __init__(
+        self, path, queue_size=QUEUE_SIZE, poll_interval=0.25, max_bytes=1 << 20
+    ):
+        super().__init__(queue_size)
+        self.path = path
+        self.poll_interval = poll_interval
+        self.max_bytes = max_bytes
+        self._tailer = None
+        self._tailer_lock = threading.Lock()
+
+    def subscribe(self, roomids=None):
+        with self._tailer_lock:
+            if self._tailer is None:
+                self._tailer = threading.Thread(
+                    target=self._tail, name="event-tailer", daemon=True
+                )
+                self._tailer.start()
+        return super().subscribe(roomids)
+
+    def publish(self, event):
+        line = json.dumps(dict(event, id=f"{os.getpid()}-{next(self._ids)}")) + "\n"
+        with open(self.path + ".lock", "a") as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            if (
+                os.path.exists(self.path)
+                and os.path.getsize(self.path) > self.max_bytes
+            ):
+                os.replace(self.path, self.path + ".old")
+            if not os.path.exists(self.path):
+                # readers tell a replaced file apart by its first line
+                line = json.dumps({"file": uuid.uuid4().hex}) + "\n" + line
+            with open(self.path, "a", encoding="utf-8") as log:
+                log.write(line)
+
+    def _tail(self):
+        name, offset = self._identify()
+        buffer = b""
+        while True:
+            time.sleep(self.poll_interval)
+            current, size = self._identify()
+            if current != name or size < offset:
+                if name is not None:
+                    # replaced since the last look, anything unread is gone
+                    self._dispatch(RESYNC)
+                name, offset, buffer = current, 0, b""
+            if size == offset:
+                continue
+            with open(self.path, "rb") as log:
+                log.seek(offset)
+                data = log.read(size - offset)
+            offset += len(data)
+            *lines, buffer = (buffer + data).split(b"\n")
+            for line in lines:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    logger.warning("Skipping unreadable event %r", line[:80])
+                    continue
+                if "type" in event:
+                    self._dispatch(event)
+
+    def _identify(self):
+        # (the file's name line, its size), read from one open file
+        try:
+            with open(self.path, "rb") as log:
+                return log.readline(), os.fstat(log.fileno()).st_size
+        except FileNotFoundError:
+            return None, 0
+
+
+broker = LocalBroker()
+
+
+def init_app(app):
+    """Pick the broker from EVENT_BROKER: "local" or "file:<path>"."""
+    global broker
+    setting = app.config.get("EVENT_BROKER", "local")
+    queue_size = app.config.get("EVENT_QUEUE_SIZE", QUEUE_SIZE)
+    if setting.startswith("file:"):
+        broker = FileBroker(setting[len("file:") :], queue_size)
+    else:
+        broker = LocalBroker(queue_size)
+
+
+def publish(event):
+    try:
+        broker.publish(event)
+    except OSError:
+        # the change itself is committed, a missed event only delays screens
+        logger.exception("Could not publish %s", event.get("type"))
+
+
+def booking_event(kind, bookingid, roomid, timebegin, timefinish):
+    return {
+        "type": kind,
+        "roomid": roomid,
+        "bookingid": bookingid,
+        "timebegin": timebegin,
+        "timefinish": timefinish,
+    }
+
+
+def _booking_event(kind, booking):
+    return booking_event(
+        kind, booking.bookingid, booking.roomid, booking.timebegin, booking.timefinish
+    )
+
+
+def _series_event(kind, series):
+    return {"type": kind, "roomid": series.roomid, "seriesid": series.seriesid}
+
+
+@sa_event.listens_for(Session, "after_flush")
+def _collect_events(session, flush_context):
+    pending = session.info.setdefault("room_events", [])
+    # attributes are read now, they are expired once the commit finishes
+    for obj in session.new:
+        if isinstance(obj, Booking):
+            pending.append(_booking_event("booking.created", obj))
+        elif isinstance(obj, BookingSeries):
+            pending.append(_series_event("series.created", obj))
+        elif isinstance(obj, SeriesException) and obj.series is not None:
+            skipped = _series_event("series.skipped", obj.series)
+            pending.append(dict(skipped, date=obj.date))
+    for obj in session.dirty:
+        if isinstance(obj, Booking) and session.is_modified(obj):
+            pending.append(_booking_event("booking.changed", obj))
+    for obj in session.deleted:
+        if isinstance(obj, Booking):
+            pending.append(_booking_event("booking.cancelled", obj))
+        elif isinstance(obj, BookingSeries):
+            pending.append(_series_event("series.cancelled", obj))
+
+
+@sa_event.listens_for(Session, "after_commit")
+def _publish_events(session):
+    for event in session.info.pop("room_events", ()):
+        publish(event)
+
+
+@sa_event.listens_for(Session, "after_rollback")
+def _drop_events(session):
+    session.info.pop("room_events", None)
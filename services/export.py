@@ -0,0 +1,158 @@
+import csv
+import io
+from datetime import datetime, timezone
+
+from models import db
+from services.archive import history_query
+from services.recurrence import upcoming_occurrences
+
+# Bookings in a date range as CSV or iCalendar, produced a row at a time so
+# a quarter of a whole floor costs no more memory than a single day.
+
+FETCH_SIZE = 500
+# send the response in pieces of about this many bytes
+CHUNK_BYTES = 64 * 1024
+
+CSV_HEADER = [
+    "bookingid",
+    "kind",
+    "roomid",
+    "roomname",
+    "floor",
+    "booked_by",
+    "timebegin",
+    "timefinish",
+]
+
+
+def export_rows(catalog, begin, finish, employeeid=None, roomids=None):
+    """Yield (uid, kind, room, booked_by, timebegin, timefinish) in the range.
+
+    Bookings come from a server-side cursor over the live table (and the
+    archive when the range needs it), followed by the occurrences of
+    recurring bookings, which are few enough to expand in memory.
+    """
+    result = db.session.execute(
+        history_query(begin, finish, employeeid, roomids),
+        execution_options={"yield_per": FETCH_SIZE},
+    )
+    for row in result:
+        yield (
+            row.bookingid,
+            "archived" if row.archived else "booking",
+            catalog.room(row.roomid),
+            f"{row.fname} {row.lname}",
+            row.timebegin,
+            row.timefinish,
+        )
+    for start, end, series in upcoming_occurrences(roomids, begin, finish):
+        if employeeid is not None and series.employeeid != employeeid:
+            continue
+        yield (
+            f"series-{series.seriesid}-{start.date().isoformat()}",
+            "recurring",
+            catalog.room(series.roomid),
+            f"{series.employee.fname} {series.employee.lname}",
+            start.isoformat(timespec="minutes"),
+            end.isoformat(timespec="minutes"),
+        )
+
+
+def _chunked(pieces):
+    buffer = io.StringIO()
+    for piece in pieces:
+        buffer.write(piece)
+        if buffer.tell() >= CHUNK_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def csv_lines(rows):
+    out = io.StringIO()
+    writer = csv.writer(out)
+
+    def line(values):
+        writer.writerow(values)
+        text = out.getvalue()
+        out.seek(0)
+        out.truncate()
+        return text
+
+    yield line(CSV_HEADER)
+    for uid, kind, room, booked_by, timebegin, timefinish in rows:
+        yield line(
+            [
+                uid,
+                kind,
+                room.roomid if room else "",
+                room.roomname if room else "",
+                room.floor if room else "",
+                booked_by,
+                timebegin,
+                timefinish,
+            ]
+        )
+
+
+def stream_csv(rows):
+    return _chunked(csv_lines(rows))
+
+
+def _ics_text(value):
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace(";", "\\;")
+        .replace(",", "\\,")
+        .replace("\n", "\\n")
+    )
+
+
+def _ics_time(value):
+    # times are wall-clock without a zone, so they stay floating local times
+    return datetime.fromisoformat(value).strftime("%Y%m%dT%H%M%S")
+
+
+def _fold(line):
+    # content lines are at most 75 octets, continued with a leading space
+    data = line.encode()
+    if len(data) <= 75:
+        return line + "\r\n"
+    parts = []
+    while data:
+        cut = 75 if not parts else 74
+        while cut < len(data) and (data[cut] & 0xC0) == 0x80:
+            cut -= 1  # don't split a UTF-8 character
+        parts.append(data[:cut].decode())
+        data = data[cut:]
+    return "\r\n ".join(parts) + "\r\n"
+
+
+def ics_lines(rows, host="meeting-rooms"):
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    yield "BEGIN:VCALENDAR\r\n"
+    yield "VERSION:2.0\r\n"
+    yield "PRODID:-//Meeting Room Booking System//EN\r\n"
+    yield "CALSCALE:GREGORIAN\r\n"
+    for uid, kind, room, booked_by, timebegin, timefinish in rows:
+        if not timebegin or not timefinish:
+            continue
+        roomname = room.roomname if room else "Unknown room"
+        location = f"{roomname}, floor {room.floor}" if room else roomname
+        yield "BEGIN:VEVENT\r\n"
+        if kind != "recurring":
+            uid = f"booking-{uid}"
+        yield _fold(f"UID:{uid}@{host}")
+        yield f"DTSTAMP:{stamp}\r\n"
+        yield f"DTSTART:{_ics_time(timebegin)}\r\n"
+        yield f"DTEND:{_ics_time(timefinish)}\r\n"
+        yield _fold(f"SUMMARY:{_ics_text(f'{roomname} - {booked_by}')}")
+        yield _fold(f"LOCATION:{_ics_text(location)}")
+        yield "END:VEVENT\r\n"
+    yield "END:VCALENDAR\r\n"
+
+
+def stream_ics(rows, host="meeting-rooms"):
+    return _chunked(ics_lines(rows, host))
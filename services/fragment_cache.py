@@ -0,0 +1,59 @@
+from jinja2 import nodes
+from jinja2.ext import Extension
+
+from services import versions
+from services.cache import LRUCache
+
+FRAGMENT_CACHE_SIZE = 512
+
+
+class FragmentCacheExtension(Extension):
+    """A `{% cache %}` tag that keeps rendered template fragments.
+
+        {% cache "room-list", ["rooms"], request.query_string %}
+          ...
+        {% endcache %}
+
+    The first argument names the fragment and the second lists the data
+    versions (see services.versions) its content depends on. Anything else
+    the output varies by follows. A change to the data bumps its version,
+    so the next render misses and the old entry ages out of the LRU.
+    Nothing inside a cached block runs on a hit, including lazy queries.
+    """
+
+    tags = {"cache"}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=LRUCache(maxsize=FRAGMENT_CACHE_SIZE))
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if("comma"):
+            args.append(parser.parse_expression())
+        body = parser.parse_statements(("name:endcache",), drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method("_render", [nodes.List(args)]), [], [], body
+        ).set_lineno(lineno)
+
+    def _render(self, args, caller):
+        name, depends, *vary = args
+        key = (
+            name,
+            tuple(versions.current(dependency) for dependency in depends),
+            *vary,
+        )
+        cache = self.environment.fragment_cache
+        fragment = cache.get(key)
+        if fragment is None:
+            fragment = caller()
+            cache.set(key, fragment)
+        return fragment
+
+
+def init_app(app):
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    app.jinja_env.fragment_cache.maxsize = app.config.get(
+        "FRAGMENT_CACHE_SIZE", FRAGMENT_CACHE_SIZE
+    )
@@ -0,0 +1,282 @@
+import heapq
+import sys
+import threading
+import time
+from itertools import count
+
+from flask import (
+    before_render_template,
+    g,
+    has_request_context,
+    request,
+    request_finished,
+    request_started,
+    request_tearing_down,
+    template_rendered,
+)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from services.query_budget import statement_count
+
+# Per-endpoint request counts and timings, kept in this process and served
+# in the Prometheus text format. Every worker process reports its own
+# numbers; Prometheus adds them up across the instances it scrapes.
+
+PREFIX = "meeting_rooms"
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+class Counter:
+    """A counter per combination of label values."""
+
+    kind = "counter"
+
+    def __init__(self, name, help):
+        self.name = f"{PREFIX}_{name}"
+        self.help = help
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield f"{self.name}{_labels(key)} {_number(value)}"
+
+
+class Histogram(Counter):
+    """Observations per label values, counted into cumulative buckets."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets=BUCKETS):
+        super().__init__(name, help)
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            # one count per bucket, then the sum and the number observed
+            entry = self._values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            values = sorted((key, list(entry)) for key, entry in self._values.items())
+        for key, entry in values:
+            for bound, cumulative in zip(self.buckets, entry):
+                le = key + (("le", _number(bound)),)
+                yield f"{self.name}_bucket{_labels(le)} {cumulative}"
+            le = key + (("le", "+Inf"),)
+            yield f"{self.name}_bucket{_labels(le)} {entry[-1]}"
+            yield f"{self.name}_sum{_labels(key)} {_number(entry[-2])}"
+            yield f"{self.name}_count{_labels(key)} {entry[-1]}"
+
+
+requests_total = Counter("requests_total", "Requests handled.")
+request_seconds = Histogram(
+    "request_duration_seconds", "Time to produce a response, in seconds."
+)
+sql_statements = Counter("sql_statements_total", "SQL statements run by requests.")
+sql_seconds = Counter("sql_seconds_total", "Time requests spent running SQL.")
+template_seconds = Counter(
+    "template_render_seconds_total", "Time requests spent rendering templates."
+)
+METRICS = (
+    requests_total,
+    request_seconds,
+    sql_statements,
+    sql_seconds,
+    template_seconds,
+)
+
+
+def render():
+    """Every metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in METRICS:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+
+class Sampler:
+    """Samples the stacks of requests in flight and keeps the slowest.
+
+    A background thread looks at every thread serving a request each
+    `interval` seconds and counts where it is. When a request finishes,
+    its stack counts are kept if it is among the `keep` slowest seen, so a
+    slow page shows what it was doing rather than only how long it took.
+    """
+
+    def __init__(self, interval=0.005, keep=20):
+        self.interval = interval
+        self.keep = keep
+        self._lock = threading.Lock()
+        self._active = {}
+        self._slowest = []
+        self._order = count()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            self._active[threading.get_ident()] = {}
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="request-sampler", daemon=True
+                )
+                self._thread.start()
+
+    def finish(self, duration, description):
+        with self._lock:
+            stacks = self._active.pop(threading.get_ident(), None)
+            if stacks is None:
+                return
+            entry = (duration, next(self._order), description, stacks)
+            if len(self._slowest) < self.keep:
+                heapq.heappush(self._slowest, entry)
+            elif duration > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, entry)
+
+    def discard(self):
+        """Stop sampling this thread's request without keeping it."""
+        with self._lock:
+            self._active.pop(threading.get_ident(), None)
+
+    def slowest(self):
+        """(duration, description, {stack: samples}), slowest first."""
+        with self._lock:
+            entries = sorted(self._slowest, reverse=True)
+        return [(duration, text, stacks) for duration, _, text, stacks in entries]
+
+    def dump(self, limit=10):
+        """The slowest requests' stacks, collapsed one per line.
+
+        Each line is the frames from the outermost in, separated by `;`,
+        then the number of samples, the format flame graph tools read.
+        """
+        lines = []
+        for duration, text, stacks in self.slowest():
+            lines.append(f"# {duration * 1000:.1f} ms {text}")
+            ranked = sorted(stacks.items(), key=lambda item: item[1], reverse=True)
+            lines.extend(f"{stack} {samples}" for stack, samples in ranked[:limit])
+            lines.append("")
+        return "\n".join(lines)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, stacks in self._active.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        stack = _collapse(frame)
+                        stacks[stack] = stacks.get(stack, 0) + 1
+
+
+def _collapse(frame, depth=64):
+    names = []
+    while frame is not None and len(names) < depth:
+        code = frame.f_code
+        names.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+sampler = None
+
+
+def _request_started(sender, **extra):
+    g.metrics_started = time.perf_counter()
+    g.sql_seconds = 0.0
+    g.template_seconds = 0.0
+    if sampler is not None:
+        sampler.start()
+
+
+def _request_finished(sender, response, **extra):
+    started = g.get("metrics_started")
+    if started is None:
+        return
+    duration = time.perf_counter() - started
+    # unmatched paths share one label so scanners cannot grow the series
+    endpoint = request.endpoint or "unmatched"
+    requests_total.inc(
+        endpoint=endpoint, method=request.method, status=response.status_code
+    )
+    request_seconds.observe(duration, endpoint=endpoint)
+    sql_statements.inc(statement_count(), endpoint=endpoint)
+    sql_seconds.inc(g.sql_seconds, endpoint=endpoint)
+    template_seconds.inc(g.template_seconds, endpoint=endpoint)
+    if sampler is not None:
+        sampler.finish(duration, f"{request.method} {request.full_path.rstrip('?')}")
+
+
+def _request_tearing_down(sender, exc=None, **extra):
+    # request_finished is not sent when a view's exception propagates, so
+    # the thread is dropped here or it would be sampled for ever
+    if sampler is not None:
+        sampler.discard()
+
+
+def _before_render(sender, template, context, **extra):
+    g.setdefault("template_started", []).append(time.perf_counter())
+
+
+def _rendered(sender, template, context, **extra):
+    stack = g.get("template_started")
+    if stack:
+        g.template_seconds = (
+            g.get("template_seconds", 0.0) + time.perf_counter() - stack.pop()
+        )
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _statement_started(conn, cursor, statement, parameters, context, executemany):
+    conn.info["metrics_started"] = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _statement_finished(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop("metrics_started", None)
+    if started is not None and has_request_context():
+        g.sql_seconds = g.get("sql_seconds", 0.0) + time.perf_counter() - started
+
+
+def init_app(app):
+    """Collect metrics for `app`, sampling stacks if PROFILER_INTERVAL is set."""
+    global sampler
+    request_started.connect(_request_started, app)
+    request_finished.connect(_request_finished, app)
+    request_tearing_down.connect(_request_tearing_down, app)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_rendered, app)
+    interval = app.config.get("PROFILER_INTERVAL")
+    if interval:
+        sampler = Sampler(interval, app.config.get("PROFILER_KEEP", 20))
@@ -0,0 +1,172 @@
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+from models import EPOCH, to_epoch
+from services.booking_index import booking_index
+from services.recurrence import on_series_change, series_spans_between
+
+SLOT_MINUTES = 15
+SLOT_SECONDS = SLOT_MINUTES * 60
+DAY_SECONDS = 24 * 60 * 60
+SLOTS_PER_DAY = DAY_SECONDS // SLOT_SECONDS
+
+# how many days of bitmaps to keep around
+MAX_CACHED_DAYS = 62
+
+
+def slot_mask(first, last):
+    """Bits first..last-1 set, one bit per slot of the day."""
+    if last <= first:
+        return 0
+    return ((1 << (last - first)) - 1) << first
+
+
+class OccupancyEngine:
+    """Per-room, per-day occupancy bitmaps built from the booking index.
+
+    Each room's day is a 96-bit integer, one bit per 15 minute slot, set
+    when any booking touches that slot. Python ints are packed bit arrays,
+    so testing a window against a room is a single AND, and a day's worth
+    of bitmaps for every room is built once and reused until a booking on
+    that day changes.
+
+    Occurrences of recurring bookings are expanded for the day being built
+    and go into the same bitmaps.
+
+    Slots are rounded outwards, so a clear bitmap means the room is free.
+    A collision confined to the partly covered first or last slot is
+    confirmed against the exact times before the room is ruled out.
+    """
+
+    def __init__(self, index):
+        self._index = index
+        self._lock = threading.Lock()
+        self._days = OrderedDict()
+        self._generation = 0
+        index.subscribe(self._invalidate)
+        on_series_change(lambda: self._invalidate(None))
+
+    def _invalidate(self, span):
+        with self._lock:
+            self._generation += 1
+            if span is None:
+                self._days.clear()
+                return
+            for day in range(span.begin // DAY_SECONDS, _last_day(span.finish) + 1):
+                self._days.pop(day, None)
+
+    def day(self, day):
+        """(bitmap by room, series occurrences by room) for a day number."""
+        with self._lock:
+            cached = self._days.get(day)
+            if cached is not None:
+                self._days.move_to_end(day)
+                return cached
+            generation = self._generation
+
+        day_start = day * DAY_SECONDS
+        day_end = day_start + DAY_SECONDS
+        masks = {}
+        occurrences = {}
+        for span in series_spans_between(None, day_start, day_end):
+            occurrences.setdefault(span.roomid, []).append(span)
+        spans = self._index.spans_between(day_start, day_end)
+        for span in spans + [s for found in occurrences.values() for s in found]:
+            first = max(0, (span.begin - day_start) // SLOT_SECONDS)
+            last = min(SLOTS_PER_DAY, -(-(span.finish - day_start) // SLOT_SECONDS))
+            masks[span.roomid] = masks.get(span.roomid, 0) | slot_mask(first, last)
+
+        with self._lock:
+            # don't cache a bitmap that a booking change raced with
+            if generation != self._generation:
+                return masks, occurrences
+            self._days[day] = (masks, occurrences)
+            while len(self._days) > MAX_CACHED_DAYS:
+                self._days.popitem(last=False)
+        return masks, occurrences
+
+    def free_rooms(self, rooms, begin, finish):
+        """Return the rooms, in the given order, with nothing booked in [begin, finish)."""
+        begin, finish = to_epoch(begin), to_epoch(finish)
+        self._index.ensure_loaded()
+
+        busy = set()
+        maybe_busy = set()
+        series = {}
+        for day in range(begin // DAY_SECONDS, _last_day(finish) + 1):
+            day_start = day * DAY_SECONDS
+            start = max(begin, day_start) - day_start
+            end = min(finish, day_start + DAY_SECONDS) - day_start
+            # every slot the window touches, and the ones it covers completely
+            touched = slot_mask(start // SLOT_SECONDS, -(-end // SLOT_SECONDS))
+            covered = slot_mask(-(-start // SLOT_SECONDS), end // SLOT_SECONDS)
+
+            masks, occurrences = self.day(day)
+            for roomid, found in occurrences.items():
+                series.setdefault(roomid, []).extend(found)
+            for roomid, mask in masks.items():
+                if mask & covered:
+                    busy.add(roomid)
+                elif mask & touched:
+                    maybe_busy.add(roomid)
+
+        for roomid in maybe_busy - busy:
+            if not self._index.is_free(roomid, begin, finish) or any(
+                span.begin < finish and span.finish > begin
+                for span in series.get(roomid, ())
+            ):
+                busy.add(roomid)
+        return [room for room in rooms if room.roomid not in busy]
+
+    def free_windows(self, roomid, begin, finish, limit=3, earliest=None):
+        """Free windows as long as [begin, finish) on the same day, nearest first.
+
+        Returns up to `limit` (start, end) datetime pairs in the room, none
+        starting before `earliest`. The day's bookings and occurrences are
+        walked once in start order, and each gap that is long enough gives
+        the window in it closest to the requested start.
+        """
+        begin, finish = to_epoch(begin), to_epoch(finish)
+        length = finish - begin
+        self._index.ensure_loaded()
+
+        day_start = begin // DAY_SECONDS * DAY_SECONDS
+        day_end = day_start + DAY_SECONDS
+        _, occurrences = self.day(day_start // DAY_SECONDS)
+        busy = sorted(
+            self._index.overlaps(roomid, day_start, day_end)
+            + occurrences.get(roomid, []),
+            key=lambda span: span.begin,
+        )
+        free_from = day_start
+        if earliest is not None:
+            # from the next slot boundary, so nothing is offered at 10:07
+            next_slot = -(-to_epoch(earliest) // SLOT_SECONDS) * SLOT_SECONDS
+            free_from = max(free_from, next_slot)
+
+        starts = []
+        taken = [(span.begin, span.finish) for span in busy]
+        for taken_from, taken_until in taken + [(day_end, day_end)]:
+            # whole minutes, so the window can be booked as offered
+            lo = -(-free_from // 60) * 60
+            hi = (taken_from - length) // 60 * 60
+            if hi >= lo:
+                starts.append(min(max(begin, lo), hi))
+            free_from = max(free_from, taken_until)
+        starts.sort(key=lambda start: (abs(start - begin), start))
+        return [
+            (
+                EPOCH + timedelta(seconds=start),
+                EPOCH + timedelta(seconds=start + length),
+            )
+            for start in starts[:limit]
+        ]
+
+
+def _last_day(finish):
+    # a booking ending exactly at midnight does not touch the next day
+    return (finish - 1) // DAY_SECONDS
+
+
+occupancy = OccupancyEngine(booking_index)
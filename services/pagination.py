@@ -0,0 +1,105 @@
+import base64
+import binascii
+import json
+from bisect import bisect_right
+
+from sqlalchemy import tuple_
+
+PAGE_SIZE = 50
+
+
+def encode_cursor(values):
+    raw = json.dumps(list(values), separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        values = json.loads(raw)
+    except (binascii.Error, ValueError):
+        return None
+    return values if isinstance(values, list) else None
+
+
+class KeysetPage:
+    """One page of `query` ordered by `columns`, starting after a cursor.
+
+    The cursor holds the sort key of the last row of the previous page, so
+    the next page is an index seek rather than an OFFSET scan. `key` turns
+    a row into its sort key and must match `columns`, which should end with
+    the primary key so every row has a distinct position.
+
+    Rows are fetched on first use, which lets a streamed template run each
+    section's query only once rendering reaches it.
+    """
+
+    def __init__(self, query, columns, key, cursor=None, per_page=PAGE_SIZE):
+        self.query = query
+        self.columns = columns
+        self.key = key
+        self.cursor = cursor
+        self.per_page = per_page
+        self._items = None
+        self._has_next = False
+
+    def _load(self):
+        if self._items is not None:
+            return
+        query = self.query
+        after = decode_cursor(self.cursor)
+        if after is not None and len(after) == len(self.columns):
+            query = query.filter(tuple_(*self.columns) > tuple_(*after))
+        rows = query.order_by(*self.columns).limit(self.per_page + 1).all()
+        self._has_next = len(rows) > self.per_page
+        self._items = rows[: self.per_page]
+
+    @property
+    def items(self):
+        self._load()
+        return self._items
+
+    @property
+    def is_first(self):
+        return not self.cursor
+
+    @property
+    def next_cursor(self):
+        self._load()
+        if not self._has_next:
+            return None
+        return encode_cursor(self.key(self._items[-1]))
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __bool__(self):
+        return bool(self.items)
+
+
+class SequencePage(KeysetPage):
+    """A KeysetPage over a list already held in memory, sorted by `key`."""
+
+    def __init__(self, rows, key, cursor=None, per_page=PAGE_SIZE):
+        super().__init__(None, None, key, cursor, per_page)
+        self.rows = rows
+
+    def _load(self):
+        if self._items is not None:
+            return
+        start = 0
+        after = decode_cursor(self.cursor)
+        if after is not None:
+            try:
+                start = bisect_right(self.rows, tuple(after), key=self.key)
+            except TypeError:
+                # a cursor with the wrong types, start from the top
+                start = 0
+        rows = self.rows[start : start + self.per_page + 1]
+        self._has_next = len(rows) > self.per_page
+        self._items = list(rows[: self.per_page])
@@ -0,0 +1,89 @@
+import hmac
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# scrypt with werkzeug's default cost, PASSWORD_HASH_METHOD can tune it
+# (e.g. "scrypt:16384:8:1" or "pbkdf2:sha256:600000")
+DEFAULT_METHOD = "scrypt:32768:8:1"
+
+_HASH_PREFIXES = ("scrypt:", "pbkdf2:")
+
+_pool = None
+_slots = None
+_pool_lock = threading.Lock()
+
+
+class HashPoolBusy(Exception):
+    pass
+
+
+def _method():
+    return current_app.config.get("PASSWORD_HASH_METHOD", DEFAULT_METHOD)
+
+
+def _run(func, *args):
+    """Run a hash in the bounded worker pool and wait for the result.
+
+    hashlib releases the GIL while hashing, so the pool threads use spare
+    cores while the request thread waits. At most PASSWORD_HASH_WORKERS
+    hashes run at once and a few more may queue; past that the caller gets
+    HashPoolBusy straight away instead of tying up another web worker.
+    """
+    global _pool, _slots
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                workers = current_app.config.get(
+                    "PASSWORD_HASH_WORKERS", min(4, os.cpu_count() or 1)
+                )
+                queue = current_app.config.get("PASSWORD_HASH_QUEUE", workers * 4)
+                _slots = threading.BoundedSemaphore(workers + queue)
+                _pool = ThreadPoolExecutor(
+                    max_workers=workers, thread_name_prefix="password-hash"
+                )
+
+    if not _slots.acquire(timeout=current_app.config.get("PASSWORD_HASH_WAIT", 2)):
+        raise HashPoolBusy()
+    try:
+        return _pool.submit(func, *args).result()
+    finally:
+        _slots.release()
+
+
+def is_hashed(stored):
+    return stored.startswith(_HASH_PREFIXES) and "$" in stored
+
+
+def hash_password(password, method=None):
+    return _run(generate_password_hash, password, method or _method())
+
+
+def verify_password(stored, password):
+    """Return (matches, needs_rehash) for a stored password.
+
+    Passwords saved before hashing was introduced are compared in constant
+    time and flagged for rehashing, as are hashes made with an older cost.
+    """
+    if not is_hashed(stored):
+        return hmac.compare_digest(stored.encode(), password.encode()), True
+    matches = _run(check_password_hash, stored, password)
+    return matches, matches and not stored.startswith(_method() + "$")
+
+
+def burn_hash(password):
+    # spend the same time on an unknown email as on a wrong password
+    _run(check_password_hash, _dummy_hash(), password)
+
+
+_dummy = {}
+
+
+def _dummy_hash():
+    method = _method()
+    if method not in _dummy:
+        _dummy[method] = generate_password_hash(os.urandom(16).hex(), method)
+    return _dummy[method]
@@ -0,0 +1,50 @@
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Counts SQL statements per request so views can declare how many they are
+# allowed. A view that starts issuing one query per row (an N+1) blows
+# through its budget as soon as there is more than a handful of rows.
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def query_budget(limit):
+    """Declare the most SQL statements one request to this view may run."""
+
+    def decorator(view):
+        view.query_budget = limit
+        return view
+
+    return decorator
+
+
+def statement_count():
+    return g.get("sql_statements", 0)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.sql_statements = g.get("sql_statements", 0) + 1
+
+
+def _check_budget(response):
+    view = current_app.view_functions.get(request.endpoint)
+    limit = getattr(view, "query_budget", None)
+    count = statement_count()
+    if limit is None or count <= limit:
+        return response
+
+    message = f"{request.endpoint} ran {count} SQL statements, budget is {limit}"
+    # streamed responses are only counted up to the point the body starts
+    if current_app.config.get("QUERY_BUDGET_ENFORCE", current_app.testing):
+        raise QueryBudgetExceeded(message)
+    current_app.logger.warning(message)
+    return response
+
+
+def init_app(app):
+    app.after_request(_check_budget)
@@ -0,0 +1,282 @@
+import math
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from itertools import count as counter
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, joinedload, selectinload
+
+from models import db, Booking, BookingSeries, SeriesException, EPOCH, to_epoch
+from services.booking_index import Span
+
+FREQUENCIES = ("daily", "weekly", "monthly")
+MAX_OCCURRENCES = 520
+# how far ahead a series may run from its first occurrence
+MAX_SERIES_DAYS = 2 * 366
+# a monthly series must start on a day every month has, otherwise the
+# months without it would be skipped but still count towards `count`
+MAX_MONTHLY_DAY = 28
+
+_STEPS = {"daily": timedelta(days=1), "weekly": timedelta(weeks=1)}
+
+
+class Recurrence(
+    namedtuple(
+        "Recurrence",
+        ["begin", "finish", "frequency", "interval", "until", "count", "exceptions"],
+    )
+):
+    """A repeating booking, expanded into occurrences only on demand.
+
+    `begin` and `finish` are the first occurrence, `until` is the last date
+    an occurrence may start on and `exceptions` is a set of skipped dates.
+    Occurrences are generated for a window at a time, jumping straight to
+    the first one that can reach the window, so looking at next week of a
+    two year series does not walk through the two years.
+    """
+
+    @classmethod
+    def from_series(cls, series, with_exceptions=True):
+        # without them the exceptions are not loaded, as inside a flush
+        return cls(
+            datetime.fromisoformat(series.timebegin),
+            datetime.fromisoformat(series.timefinish),
+            series.frequency,
+            series.interval or 1,
+            date.fromisoformat(series.until) if series.until else None,
+            series.count,
+            frozenset(
+                date.fromisoformat(e.date)
+                for e in (series.exceptions if with_exceptions else ())
+            ),
+        )
+
+    @property
+    def duration(self):
+        return self.finish - self.begin
+
+    @property
+    def step(self):
+        # fixed length between occurrences, None for monthly
+        step = _STEPS.get(self.frequency)
+        return step * self.interval if step else None
+
+    def start_of(self, k):
+        """Start of the k-th occurrence, None if that month has no such day."""
+        if self.step:
+            return self.begin + k * self.step
+        month = self.begin.month - 1 + k * self.interval
+        try:
+            return self.begin.replace(
+                year=self.begin.year + month // 12, month=month % 12 + 1
+            )
+        except ValueError:
+            return None
+
+    def _index_before(self, moment):
+        # an occurrence index at or before the first one starting after moment
+        if moment <= self.begin:
+            return 0
+        if self.step:
+            return (moment - self.begin) // self.step
+        months = (moment.year - self.begin.year) * 12 + moment.month - self.begin.month
+        return max(0, months // self.interval - 1)
+
+    def _last_index(self):
+        last = self.count - 1 if self.count is not None else None
+        if self.until is not None:
+            stop = datetime.combine(self.until + timedelta(days=1), datetime.min.time())
+            # start past the end and step back to the last one before it
+            k = self._index_before(stop) + 2
+            while k > 0 and (self.start_of(k) is None or self.start_of(k) >= stop):
+                k -= 1
+            last = k if last is None else min(last, k)
+        return last
+
+    def last(self):
+        """The (begin, finish) of the final occurrence, ignoring exceptions."""
+        k = self._last_index()
+        while k > 0 and self.start_of(k) is None:
+            k -= 1
+        start = self.start_of(k)
+        return start, start + self.duration
+
+    def occurrences(self, window_begin=None, window_end=None, skip_exceptions=True):
+        """Yield (begin, finish) of occurrences overlapping the window, in order."""
+        last = self._last_index()
+        k = self._index_before(window_begin - self.duration) if window_begin else 0
+        while last is None or k <= last:
+            start = self.start_of(k)
+            k += 1
+            if start is None:
+                continue
+            if window_end is not None and start >= window_end:
+                return
+            end = start + self.duration
+            if window_begin is not None and end <= window_begin:
+                continue
+            if skip_exceptions and start.date() in self.exceptions:
+                continue
+            yield start, end
+
+
+def first_clash(left, right):
+    """First overlapping pair from two streams of sorted, disjoint intervals.
+
+    Walks both streams once, always advancing whichever interval ends first,
+    so neither stream has to be held in memory.
+    """
+    left, right = iter(left), iter(right)
+    a, b = next(left, None), next(right, None)
+    while a is not None and b is not None:
+        if a[0] < b[1] and b[0] < a[1]:
+            return a, b
+        if a[1] <= b[1]:
+            a = next(left, None)
+        else:
+            b = next(right, None)
+    return None
+
+
+def series_clash(first, second):
+    """First overlapping pair of occurrences of two recurrences, or None."""
+    lo = max(first.begin, second.begin) - max(first.duration, second.duration)
+    hi = min(first.last()[1], second.last()[1])
+    if lo >= hi:
+        return None
+
+    if first.step and second.step:
+        # two fixed periods line up the same way every lcm of the periods.
+        # exceptions only remove occurrences, so if one full cycle is clear
+        # without them the whole overlap is clear
+        cycle = timedelta(
+            seconds=math.lcm(
+                int(first.step.total_seconds()), int(second.step.total_seconds())
+            )
+        )
+        probe_hi = min(hi, lo + cycle + 2 * max(first.duration, second.duration))
+        if not first_clash(
+            first.occurrences(lo, probe_hi, skip_exceptions=False),
+            second.occurrences(lo, probe_hi, skip_exceptions=False),
+        ):
+            return None
+
+    return first_clash(first.occurrences(lo, hi), second.occurrences(lo, hi))
+
+
+def active_series(roomids, begin, finish):
+    """Series with occurrences possibly inside [begin, finish).
+
+    `roomids` limits the search to those rooms, None means every room.
+    """
+    query = BookingSeries.query.options(
+        joinedload(BookingSeries.employee), selectinload(BookingSeries.exceptions)
+    ).filter(
+        BookingSeries.timebegin_epoch < to_epoch(finish),
+        BookingSeries.lastfinish_epoch > to_epoch(begin),
+    )
+    if roomids is not None:
+        query = query.filter(BookingSeries.roomid.in_(roomids))
+    return query.order_by(BookingSeries.seriesid).all()
+
+
+def find_series_conflict(roomid, begin, finish):
+    """Return a series with an occurrence in [begin, finish) in the room, or None."""
+    begin, finish = _as_datetime(begin), _as_datetime(finish)
+    for series in active_series([roomid], begin, finish):
+        if next(Recurrence.from_series(series).occurrences(begin, finish), None):
+            return series
+    return None
+
+
+def find_recurrence_conflict(recurrence, roomid):
+    """Return a booking or series clashing with any occurrence, or None."""
+    begin, finish = recurrence.begin, recurrence.last()[1]
+
+    # stored bookings are streamed in start order and merged with the
+    # occurrences, so neither side is ever materialised
+    rows = (
+        db.session.query(Booking.timebegin_epoch, Booking.timefinish_epoch)
+        .filter(
+            Booking.roomid == roomid,
+            Booking.timebegin_epoch < to_epoch(finish),
+            Booking.timefinish_epoch > to_epoch(begin),
+        )
+        .order_by(Booking.timebegin_epoch)
+        .yield_per(500)
+    )
+    occurrences = (
+        (to_epoch(start), to_epoch(end))
+        for start, end in recurrence.occurrences(begin, finish)
+    )
+    clash = first_clash(occurrences, rows)
+    if clash:
+        return Booking.query.filter(
+            Booking.roomid == roomid,
+            Booking.timebegin_epoch == clash[1][0],
+        ).first()
+
+    for series in active_series([roomid], begin, finish):
+        if series_clash(recurrence, Recurrence.from_series(series)):
+            return series
+    return None
+
+
+def upcoming_occurrences(roomids, begin, finish):
+    """(start, end, series) for every occurrence in [begin, finish), by start."""
+    found = []
+    for series in active_series(roomids, begin, finish):
+        for start, end in Recurrence.from_series(series).occurrences(begin, finish):
+            found.append((start, end, series))
+    found.sort(key=lambda occurrence: (occurrence[0], occurrence[2].seriesid))
+    return found
+
+
+def series_spans_between(roomids, begin, finish):
+    """Occurrences of every series in the rooms within [begin, finish) as Spans.
+
+    Occurrences are not bookings, so they get negative placeholder ids.
+    """
+    ids = counter(-1, -1)
+    return [
+        Span(to_epoch(start), to_epoch(end), next(ids), series.roomid)
+        for start, end, series in upcoming_occurrences(
+            roomids, _as_datetime(begin), _as_datetime(finish)
+        )
+    ]
+
+
+def _as_datetime(value):
+    if isinstance(value, int):
+        return EPOCH + timedelta(seconds=value)
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return value
+
+
+# callbacks run after a commit that created, changed or removed a series
+_listeners = []
+
+
+def on_series_change(callback):
+    _listeners.append(callback)
+
+
+@event.listens_for(Session, "after_flush")
+def _note_series_changes(session, flush_context):
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, (BookingSeries, SeriesException)):
+            session.info["series_changed"] = True
+            return
+
+
+@event.listens_for(Session, "after_commit")
+def _notify_series_changes(session):
+    if session.info.pop("series_changed", False):
+        for callback in _listeners:
+            callback()
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_series_changes(session):
+    session.info.pop("series_changed", None)
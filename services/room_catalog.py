@@ -0,0 +1,61 @@
+import threading
+from collections import namedtuple
+
+from models import db, Room
+from services import versions
+
+# a room as the catalog hands it out, safe to share between requests
+RoomInfo = namedtuple("RoomInfo", ["roomid", "floor", "roomname", "capacity"])
+
+
+class Catalog(
+    namedtuple("Catalog", ["generation", "by_name", "by_floor", "by_id"])
+):
+    """Every room, sorted by (name, id) and by (floor, name, id), and by id."""
+
+    def room(self, roomid):
+        try:
+            return self.by_id.get(int(roomid))
+        except (TypeError, ValueError):
+            return None
+
+
+class RoomCatalog:
+    """Process-wide cache of the room list, pre-sorted for the views.
+
+    Checked against the "rooms" data version at most once a request, so a
+    room added through any worker process is picked up on the next request
+    everywhere else.
+    """
+
+    def __init__(self):
+        self._catalog = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        # read the version before the rows, so a change landing in between
+        # leaves the cache looking stale rather than up to date
+        generation = versions.current("rooms")
+        catalog = self._catalog
+        if catalog is None or catalog.generation != generation:
+            with self._lock:
+                catalog = self._catalog
+                if catalog is None or catalog.generation != generation:
+                    catalog = self._catalog = self._load(generation)
+        return catalog
+
+    def _load(self, generation):
+        rows = db.session.query(
+            Room.roomid, Room.floor, Room.roomname, Room.capacity
+        ).order_by(Room.floor, Room.roomname, Room.roomid)
+        by_floor = tuple(RoomInfo(*row) for row in rows)
+        by_name = tuple(sorted(by_floor, key=lambda room: (room.roomname, room.roomid)))
+        return Catalog(
+            generation, by_name, by_floor, {room.roomid: room for room in by_floor}
+        )
+
+    def clear(self):
+        self._catalog = None
+
+
+room_catalog = RoomCatalog()
@@ -0,0 +1,45 @@
+import re
+
+from sqlalchemy import Float, Integer, text
+
+from services.pagination import PAGE_SIZE, KeysetPage
+
+# Ranked admin search over the full-text indexes declared in models.py.
+
+# words beyond this many are ignored, each one narrows the results anyway
+MAX_TERMS = 8
+
+
+def match_query(search):
+    """An FTS5 query for rows containing every word of `search`.
+
+    Each word matches as a prefix, so "sm" finds "Smith". Words are quoted,
+    so nothing typed is read as FTS5 syntax.
+    """
+    terms = re.findall(r"\w+", search.lower())[:MAX_TERMS]
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+def ranked(index, match, weights):
+    """(id, score) of the rows of `index` matching, lower scores rank higher."""
+    return (
+        text(
+            f"SELECT rowid AS id, bm25({index}, {', '.join(map(str, weights))}) "
+            f"AS score FROM {index} WHERE {index} MATCH :match"
+        )
+        .bindparams(match=match)
+        .columns(id=Integer, score=Float)
+        .subquery()
+    )
+
+
+def search_page(query, key_column, index, match, weights, cursor, per_page=PAGE_SIZE):
+    """A KeysetPage of (row, score) pairs from `query`, best match first."""
+    hits = ranked(index, match, weights)
+    return KeysetPage(
+        query.join(hits, hits.c.id == key_column).add_columns(hits.c.score),
+        (hits.c.score, key_column),
+        key=lambda row: (row[1], getattr(row[0], key_column.key)),
+        cursor=cursor,
+        per_page=per_page,
+    )
@@ -0,0 +1,301 @@
+from collections import Counter, namedtuple
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import case, delete, event, func, inspect, select, text
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session, selectinload
+
+from models import (
+    db,
+    Booking,
+    BookingSeries,
+    Room,
+    RoomUtilisation,
+    SeriesException,
+    EPOCH,
+    to_epoch,
+)
+from services.database import begin_immediate
+from services.recurrence import Recurrence
+
+# Occupied time per room, day and hour. Every booking change adjusts the
+# affected hours in the same transaction, so reports read this small
+# table and never the bookings themselves, however much history builds up.
+
+HOUR_SECONDS = 60 * 60
+DAY_SECONDS = 24 * HOUR_SECONDS
+# the hours utilisation percentages are measured against, Monday to Friday
+WORKING_HOURS = (8, 18)
+WEEKDAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+
+# splits a room's bookings, archived ones too, at hour boundaries and adds
+# up each hour
+REBUILD_SQL = """
+WITH RECURSIVE pieces(start, finish) AS (
+    SELECT timebegin_epoch, timefinish_epoch FROM bookings
+    WHERE roomid = :roomid AND timefinish_epoch > timebegin_epoch
+    UNION ALL
+    SELECT timebegin_epoch, timefinish_epoch FROM bookings_archive
+    WHERE roomid = :roomid AND timefinish_epoch > timebegin_epoch
+    UNION ALL
+    SELECT start - start % 3600 + 3600, finish FROM pieces
+    WHERE start - start % 3600 + 3600 < finish
+)
+INSERT INTO roomutilisation (roomid, day, hour, seconds)
+SELECT :roomid, start / 86400, start % 86400 / 3600,
+       SUM(MIN(finish, start - start % 3600 + 3600) - start)
+FROM pieces
+GROUP BY start / 86400, start % 86400 / 3600
+"""
+
+RoomUsage = namedtuple(
+    "RoomUsage", ["roomid", "roomname", "floor", "occupied_hours", "percent"]
+)
+FloorUsage = namedtuple("FloorUsage", ["floor", "rooms", "occupied_hours", "percent"])
+
+
+def hour_buckets(roomid, begin, finish):
+    """Yield ((roomid, day, hour), seconds) covering the epoch span [begin, finish)."""
+    while begin < finish:
+        end = min(finish, begin - begin % HOUR_SECONDS + HOUR_SECONDS)
+        day, hour = begin // DAY_SECONDS, begin % DAY_SECONDS // HOUR_SECONDS
+        yield (roomid, day, hour), end - begin
+        begin = end
+
+
+def add_span(deltas, sign, roomid, begin, finish):
+    if roomid is None or begin is None or finish is None:
+        return
+    for key, seconds in hour_buckets(int(roomid), begin, finish):
+        deltas[key] += sign * seconds
+
+
+def add_series(deltas, sign, series):
+    for start, end in Recurrence.from_series(series).occurrences():
+        add_span(deltas, sign, series.roomid, to_epoch(start), to_epoch(end))
+
+
+def apply(connection, deltas):
+    """Add `deltas`, seconds keyed by (roomid, day, hour), to the summary."""
+    rows = [
+        {"roomid": roomid, "day": day, "hour": hour, "seconds": seconds}
+        for (roomid, day, hour), seconds in deltas.items()
+        if seconds
+    ]
+    if not rows:
+        return
+    statement = insert(RoomUtilisation)
+    connection.execute(
+        statement.on_conflict_do_update(
+            index_elements=[
+                RoomUtilisation.roomid,
+                RoomUtilisation.day,
+                RoomUtilisation.hour,
+            ],
+            set_={"seconds": RoomUtilisation.seconds + statement.excluded.seconds},
+        ),
+        rows,
+    )
+
+
+def rebuild(echo=print):
+    """Recompute the summary from all bookings and series, a room at a time.
+
+    Each room is redone in its own write transaction, so bookings can still
+    be made while a large history is summarised.
+    """
+    roomids = db.session.scalars(select(Room.roomid).order_by(Room.roomid)).all()
+    db.session.execute(
+        delete(RoomUtilisation).where(RoomUtilisation.roomid.not_in(roomids))
+    )
+    db.session.commit()
+    for roomid in roomids:
+        begin_immediate()
+        db.session.execute(
+            delete(RoomUtilisation).where(RoomUtilisation.roomid == roomid)
+        )
+        db.session.execute(text(REBUILD_SQL), {"roomid": roomid})
+        deltas = Counter()
+        series = BookingSeries.query.options(
+            selectinload(BookingSeries.exceptions)
+        ).filter(BookingSeries.roomid == roomid)
+        for one in series:
+            add_series(deltas, 1, one)
+        apply(db.session.connection(), deltas)
+        db.session.commit()
+    echo(f"Summarised utilisation for {len(roomids)} rooms")
+    return len(roomids)
+
+
+def _before(obj, key):
+    # the value an attribute had when it was loaded
+    history = inspect(obj).attrs[key].history
+    if history.deleted:
+        return history.deleted[0]
+    return (history.unchanged or history.added or [None])[0]
+
+
+def _occurrence_on(series, day):
+    start = datetime.combine(date.fromisoformat(day), datetime.min.time())
+    recurrence = Recurrence.from_series(series, with_exceptions=False)
+    for begin, end in recurrence.occurrences(
+        start, start + timedelta(days=1), skip_exceptions=False
+    ):
+        if begin.date() == start.date():
+            return to_epoch(begin), to_epoch(end)
+    return None, None
+
+
+# a moved booking is taken off the hours it had, so the old values are
+# loaded before a change even when the booking had been expired
+@event.listens_for(Booking.roomid, "set", active_history=True)
+@event.listens_for(Booking.timebegin, "set", active_history=True)
+@event.listens_for(Booking.timefinish, "set", active_history=True)
+def _keep_old_value(target, value, oldvalue, initiator):
+    pass
+
+
+@event.listens_for(Session, "after_flush")
+def _update_utilisation(session, flush_context):
+    deltas = Counter()
+    cancelled = {
+        obj.seriesid for obj in session.deleted if isinstance(obj, BookingSeries)
+    }
+    for obj in session.new:
+        if isinstance(obj, Booking):
+            add_span(deltas, 1, obj.roomid, obj.timebegin_epoch, obj.timefinish_epoch)
+        elif isinstance(obj, BookingSeries):
+            add_series(deltas, 1, obj)
+        elif isinstance(obj, SeriesException):
+            series = session.get(BookingSeries, obj.seriesid)
+            if series is not None:
+                add_span(deltas, -1, series.roomid, *_occurrence_on(series, obj.date))
+    for obj in session.dirty:
+        if isinstance(obj, Booking) and session.is_modified(obj):
+            add_span(
+                deltas,
+                -1,
+                _before(obj, "roomid"),
+                to_epoch(_before(obj, "timebegin")),
+                to_epoch(_before(obj, "timefinish")),
+            )
+            add_span(deltas, 1, obj.roomid, obj.timebegin_epoch, obj.timefinish_epoch)
+    for obj in session.deleted:
+        if isinstance(obj, Booking):
+            add_span(deltas, -1, obj.roomid, obj.timebegin_epoch, obj.timefinish_epoch)
+        elif isinstance(obj, BookingSeries):
+            add_series(deltas, -1, obj)
+        elif isinstance(obj, SeriesException) and obj.seriesid not in cancelled:
+            series = session.get(BookingSeries, obj.seriesid)
+            if series is not None:
+                add_span(deltas, 1, series.roomid, *_occurrence_on(series, obj.date))
+    apply(session.connection(), deltas)
+
+
+def day_number(value):
+    return (value - EPOCH.date()).days
+
+
+def _weekday(day):
+    # day 0, 1970-01-01, was a Thursday
+    return (day + 3) % 7
+
+
+def _working():
+    return (
+        (_weekday(RoomUtilisation.day) < 5)
+        & (RoomUtilisation.hour >= WORKING_HOURS[0])
+        & (RoomUtilisation.hour < WORKING_HOURS[1])
+    )
+
+
+def working_seconds(first, last):
+    """Working seconds in one room between two dates, both included."""
+    days = (first + timedelta(days=i) for i in range((last - first).days + 1))
+    weekdays = sum(1 for day in days if day.weekday() < 5)
+    return weekdays * (WORKING_HOURS[1] - WORKING_HOURS[0]) * HOUR_SECONDS
+
+
+def _totals(first, last, group_by):
+    working = func.sum(case((_working(), RoomUtilisation.seconds), else_=0))
+    return db.session.execute(
+        select(group_by, func.sum(RoomUtilisation.seconds), working)
+        .where(RoomUtilisation.day.between(day_number(first), day_number(last)))
+        .group_by(group_by)
+    ).all()
+
+
+def by_room(catalog, first, last):
+    """Occupied hours and working-hours utilisation of every room."""
+    totals = {
+        roomid: (seconds, working)
+        for roomid, seconds, working in _totals(first, last, RoomUtilisation.roomid)
+    }
+    available = working_seconds(first, last)
+    rows = []
+    for room in catalog.by_floor:
+        seconds, working = totals.get(room.roomid, (0, 0))
+        rows.append(
+            RoomUsage(
+                room.roomid,
+                room.roomname,
+                room.floor,
+                seconds / HOUR_SECONDS,
+                100 * working / available if available else 0,
+            )
+        )
+    return rows
+
+
+def by_floor(catalog, first, last):
+    """The room figures added up per floor."""
+    floors = {}
+    for row in by_room(catalog, first, last):
+        rooms, hours, percent = floors.get(row.floor, (0, 0, 0))
+        floors[row.floor] = (rooms + 1, hours + row.occupied_hours, percent + row.percent)
+    return [
+        FloorUsage(floor, rooms, hours, percent / rooms)
+        for floor, (rooms, hours, percent) in sorted(floors.items())
+    ]
+
+
+def by_hour_of_week(catalog, first, last):
+    """{(weekday, hour): percent of rooms in use}, Monday is weekday 0."""
+    weekday = _weekday(RoomUtilisation.day)
+    rows = db.session.execute(
+        select(weekday, RoomUtilisation.hour, func.sum(RoomUtilisation.seconds))
+        .where(RoomUtilisation.day.between(day_number(first), day_number(last)))
+        .group_by(weekday, RoomUtilisation.hour)
+    ).all()
+    # how many times each weekday comes round in the range
+    seen = Counter(
+        (first + timedelta(days=i)).weekday() for i in range((last - first).days + 1)
+    )
+    rooms = len(catalog.by_id)
+    grid = {}
+    for day, hour, seconds in rows:
+        possible = seen[day] * rooms * HOUR_SECONDS
+        grid[(day, hour)] = 100 * seconds / possible if possible else 0
+    return grid
+
+
+def rows_between(first, last):
+    """(day, hour, roomid, seconds) for every summarised hour in the range."""
+    return db.session.execute(
+        select(
+            RoomUtilisation.day,
+            RoomUtilisation.hour,
+            RoomUtilisation.roomid,
+            RoomUtilisation.seconds,
+        )
+        .where(
+            RoomUtilisation.day.between(day_number(first), day_number(last)),
+            RoomUtilisation.seconds > 0,
+        )
+        .order_by(RoomUtilisation.day, RoomUtilisation.hour, RoomUtilisation.roomid)
+        .execution_options(yield_per=1000)
+    )
+
+
+def date_of(day):
+    return EPOCH.date() + timedelta(days=day)
@@ -0,0 +1,166 @@
+from datetime import datetime
+
+from flask import g, has_app_context
+from sqlalchemy import event, inspect, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from models import (
+    db,
+    Booking,
+    BookingSeries,
+    DataVersion,
+    Employee,
+    Room,
+    SeriesException,
+)
+
+# Version counters for data that is cached in memory. A change to a tracked
+# model bumps its counter in the same transaction, so any process can tell
+# its copy is stale with a primary key lookup.
+
+TRACKED = {Room: "rooms", Employee: "employees"}
+# bumped along with any room's bookings, so one lookup tells whether to look
+# at the rooms at all
+BOOKINGS = "bookings"
+_ROOM_PREFIX = "room:"
+
+_listeners = []
+
+
+def room_bookings(roomid):
+    """The name of the version bumped by every booking change in a room."""
+    return f"{_ROOM_PREFIX}{roomid}"
+
+
+def booked_room(name):
+    """The room id a room_bookings() name is for, or None for other names."""
+    if name.startswith(_ROOM_PREFIX):
+        return int(name[len(_ROOM_PREFIX) :])
+    return None
+
+
+def room_versions():
+    """{roomid: version} for every room whose bookings have changed."""
+    rows = db.session.execute(
+        select(DataVersion.name, DataVersion.version).where(
+            DataVersion.name.startswith(_ROOM_PREFIX)
+        )
+    )
+    return {booked_room(name): version for name, version in rows}
+
+
+def current(name):
+    # looked up at most once a request, together with the versions most
+    # requests go on to need anyway
+    seen = g.setdefault("data_versions", {}) if has_app_context() else {}
+    if name not in seen:
+        wanted = {name, *TRACKED.values(), BOOKINGS} - seen.keys()
+        rows = db.session.execute(
+            select(DataVersion.name, DataVersion.version).where(
+                DataVersion.name.in_(wanted)
+            )
+        )
+        seen.update(dict.fromkeys(wanted, 0))
+        seen.update((found, version or 0) for found, version in rows)
+    return seen[name]
+
+
+def stamps(names):
+    """{name: (version, updated_at)} for each of `names`, in one query."""
+    rows = db.session.execute(
+        select(DataVersion.name, DataVersion.version, DataVersion.updated_at).where(
+            DataVersion.name.in_(names)
+        )
+    )
+    found = {name: (version or 0, updated_at) for name, version, updated_at in rows}
+    result = {name: found.get(name, (0, None)) for name in names}
+    if has_app_context():
+        seen = g.setdefault("data_versions", {})
+        seen.update((name, version) for name, (version, _) in result.items())
+    return result
+
+
+def bump(connection, *names):
+    """Bump the versions of `names`, in one statement however many."""
+    if not names:
+        return
+    if BOOKINGS not in names and any(
+        name.startswith(_ROOM_PREFIX) for name in names
+    ):
+        names = (*names, BOOKINGS)
+    now = datetime.now().isoformat(timespec="seconds")
+    statement = insert(DataVersion).on_conflict_do_update(
+        index_elements=[DataVersion.name],
+        set_={"version": DataVersion.version + 1, "updated_at": now},
+    )
+    rows = connection.execute(
+        statement.returning(DataVersion.name, DataVersion.version),
+        [{"name": name, "version": 1, "updated_at": now} for name in names],
+    )
+    # every bump in the transaction is ours, writers being serialised, so
+    # the first and last version tell what it was before and after
+    bumped = db.session.info.setdefault("bumped_versions", {})
+    for name, version in rows:
+        bumped[name] = (bumped.get(name, (version,))[0], version)
+    if has_app_context():
+        g.pop("data_versions", None)
+
+
+def on_commit(callback):
+    """Call `callback({name: (first, last)})` after a commit bumping versions.
+
+    `first` is the version the transaction's first bump of `name` made and
+    `last` the one it committed, so a process whose copy was at `first - 1`
+    knows it only missed its own changes.
+    """
+    _listeners.append(callback)
+
+
+@event.listens_for(Session, "after_commit")
+def _announce_versions(session):
+    bumped = session.info.pop("bumped_versions", None)
+    if bumped:
+        for callback in _listeners:
+            callback(bumped)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_versions(session):
+    session.info.pop("bumped_versions", None)
+
+
+@event.listens_for(Session, "after_flush")
+def _bump_versions(session, flush_context):
+    names = set()
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        name = TRACKED.get(type(obj))
+        if name is None:
+            continue
+        # a room is not changed by a booking being added to it
+        if obj in session.dirty and not session.is_modified(
+            obj, include_collections=False
+        ):
+            continue
+        names.add(name)
+    names.update(room_bookings(roomid) for roomid in _booked_rooms(session))
+    bump(session.connection(), *sorted(names))
+
+
+def _booked_rooms(session):
+    roomids = set()
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, (Booking, BookingSeries)):
+            if obj in session.dirty and not session.is_modified(
+                obj, include_collections=False
+            ):
+                continue
+            roomids.add(obj.roomid)
+            # a booking moved to another room changes both
+            roomids.update(inspect(obj).attrs.roomid.history.deleted)
+        elif isinstance(obj, SeriesException):
+            series = session.get(BookingSeries, obj.seriesid)
+            if series is not None:
+                roomids.add(series.roomid)
+    roomids.discard(None)
+    return roomids
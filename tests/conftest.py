@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import create_app, init_db
+from models import db, Booking, Employee, Room
+from services.booking_index import booking_index
+
+PASSWORD = "admin123"
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app(
+        {
+            "TESTING": True,
+            "SECRET_KEY": "test",
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'test.db'}",
+        }
+    )
+    with app.app_context():
+        init_db(PASSWORD, echo=lambda message: None)
+    # the index is a per-process cache of whichever database came before
+    booking_index.horizon = None
+    yield app
+    with app.app_context():
+        db.engine.dispose()
+
+
+@pytest.fixture
+def ctx(app):
+    with app.app_context():
+        yield
+
+
+@pytest.fixture
+def client(app):
+    client = app.test_client()
+    client.post("/login", data={"email": "admin@caa.co.uk", "password": PASSWORD})
+    return client
+
+
+# Each request the test client makes must get an app context of its own,
+# as it does in production, or it would share `g` (statement counts, data
+# versions) with the test. So fixtures make their rows in a context they
+# close again, and only tests calling services directly use `ctx`.
+
+
+@pytest.fixture
+def admin(app):
+    with app.app_context():
+        return Employee.query.filter_by(email="admin@caa.co.uk").one()
+
+
+@pytest.fixture
+def room(app):
+    with app.app_context():
+        room = Room(floor=1, roomname="Room 1", capacity=6)
+        db.session.add(room)
+        db.session.commit()
+        db.session.refresh(room)
+        return room
+
+
+@pytest.fixture
+def tomorrow():
+    return (datetime.now() + timedelta(days=1)).replace(
+        hour=9, minute=0, second=0, microsecond=0
+    )
+
+
+def book(employee, room, begin, finish):
+    booking = Booking(
+        employeeid=employee.employeeid,
+        roomid=room.roomid,
+        timebegin=begin.isoformat(),
+        timefinish=finish.isoformat(),
+    )
+    db.session.add(booking)
+    db.session.commit()
+    return booking
@@ -0,0 +1,47 @@
+from datetime import timedelta
+
+import pytest
+
+from models import Booking
+from services.booking_import import import_bookings
+
+pytestmark = pytest.mark.usefixtures("ctx")
+
+HOUR = timedelta(hours=1)
+
+
+def row(admin, room, begin, suffix=""):
+    return {
+        "employeeid": admin.employeeid,
+        "roomid": room.roomid,
+        "timebegin": begin.isoformat() + suffix,
+        "timefinish": (begin + HOUR).isoformat() + suffix,
+    }
+
+
+def test_offset_row_rejected_alongside_valid_rows(admin, room, tomorrow):
+    rows = [
+        row(admin, room, tomorrow),
+        row(admin, room, tomorrow + 2 * HOUR, suffix="Z"),
+        row(admin, room, tomorrow + 4 * HOUR),
+    ]
+    results = import_bookings(enumerate(rows, start=1))
+
+    by_line = {result.line: result for result in results}
+    assert [by_line[line].status for line in (1, 2, 3)] == [
+        "accepted",
+        "rejected",
+        "accepted",
+    ]
+    assert by_line[2].reason == "Invalid date/time format"
+    assert Booking.query.count() == 2
+
+
+def test_clashes_rejected(admin, room, tomorrow):
+    rows = [row(admin, room, tomorrow), row(admin, room, tomorrow + HOUR / 2)]
+    first, second = sorted(import_bookings(enumerate(rows, start=1)))
+    assert first.status == "accepted"
+    assert second.reason == "Overlaps another booking in this import"
+
+    [again] = import_bookings(enumerate(rows[:1], start=1))
+    assert again.reason == "Room is already booked for that time"
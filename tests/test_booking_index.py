@@ -0,0 +1,61 @@
+from datetime import timedelta
+
+import pytest
+
+from models import db, to_epoch
+from services.booking_index import Span, booking_index, find_conflict
+from tests.conftest import book
+
+pytestmark = pytest.mark.usefixtures("ctx")
+
+HOUR = timedelta(hours=1)
+
+
+def test_overlaps_half_open(admin, room, tomorrow):
+    booking = book(admin, room, tomorrow, tomorrow + HOUR)
+    booking_index.ensure_loaded()
+
+    assert booking_index.overlaps(room.roomid, tomorrow, tomorrow + HOUR)
+    assert not booking_index.overlaps(
+        room.roomid, tomorrow + HOUR, tomorrow + 2 * HOUR
+    )
+    assert not booking_index.overlaps(room.roomid, tomorrow - HOUR, tomorrow)
+    assert find_conflict(room.roomid, tomorrow - HOUR, tomorrow + 2 * HOUR) == booking
+
+
+def test_long_booking_found_from_the_middle(admin, room, tomorrow):
+    long = book(admin, room, tomorrow, tomorrow + 8 * HOUR)
+    book(admin, room, tomorrow + 9 * HOUR, tomorrow + 10 * HOUR)
+    booking_index.ensure_loaded()
+
+    clashes = booking_index.overlaps(
+        room.roomid, tomorrow + 4 * HOUR, tomorrow + 5 * HOUR
+    )
+    assert [span.bookingid for span in clashes] == [long.bookingid]
+
+
+def test_commit_and_delete_update_the_index(admin, room, tomorrow):
+    booking_index.ensure_loaded()
+    booking = book(admin, room, tomorrow, tomorrow + HOUR)
+    assert booking_index.overlaps(room.roomid, tomorrow, tomorrow + HOUR)
+
+    db.session.delete(booking)
+    db.session.commit()
+    assert not booking_index.overlaps(room.roomid, tomorrow, tomorrow + HOUR)
+    assert find_conflict(room.roomid, tomorrow, tomorrow + HOUR) is None
+
+
+def test_stale_entry_does_not_block(admin, room, tomorrow):
+    booking = book(admin, room, tomorrow, tomorrow + HOUR)
+    booking_index.ensure_loaded()
+    # an entry for a booking that has since moved, as another process
+    # might leave behind
+    later = tomorrow + 3 * HOUR
+    booking_index.add(
+        Span(to_epoch(later), to_epoch(later + HOUR), booking.bookingid, room.roomid)
+    )
+
+    assert find_conflict(room.roomid, later, later + HOUR) is None
+    assert find_conflict(room.roomid, tomorrow, tomorrow + HOUR) == booking
+    # the room was reloaded from the database
+    assert not booking_index.overlaps(room.roomid, later, later + HOUR)
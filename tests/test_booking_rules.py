@@ -0,0 +1,43 @@
+from datetime import timedelta
+
+import pytest
+
+from models import Booking
+from services.booking_rules import parse_local
+
+HOUR = timedelta(hours=1)
+
+
+def test_parse_local_refuses_offsets():
+    assert parse_local("2030-01-01T09:00").tzinfo is None
+    for value in ["2030-01-01T09:00Z", "2030-01-01T09:00+01:00", "9am"]:
+        with pytest.raises(ValueError):
+            parse_local(value)
+
+
+@pytest.mark.parametrize("suffix", ["Z", "+01:00"])
+def test_available_rooms_with_offset(client, room, tomorrow, suffix):
+    response = client.get(
+        "/rooms/available",
+        query_string={
+            "timebegin": tomorrow.isoformat() + suffix,
+            "timefinish": (tomorrow + HOUR).isoformat() + suffix,
+        },
+    )
+    assert response.status_code == 200
+    assert b"Invalid search" in response.data
+
+
+def test_new_booking_with_offset(app, client, room, tomorrow):
+    response = client.post(
+        "/bookings/new",
+        data={
+            "roomid": room.roomid,
+            "timebegin": tomorrow.isoformat() + "Z",
+            "timefinish": (tomorrow + HOUR).isoformat() + "Z",
+        },
+    )
+    assert response.status_code == 200
+    assert b"Invalid date/time format" in response.data
+    with app.app_context():
+        assert Booking.query.count() == 0
@@ -0,0 +1,75 @@
+from datetime import timedelta
+
+from models import db, Booking, Room
+from tests.conftest import book
+
+HOUR = timedelta(hours=1)
+
+
+def revalidate(client, url, etag):
+    return client.get(url, headers={"If-None-Match": etag})
+
+
+def test_unchanged_page_is_not_modified(client, room):
+    url = f"/rooms/{room.roomid}"
+    first = client.get(url)
+    assert first.status_code == 200
+    etag = first.headers["ETag"]
+    assert etag.startswith("W/")
+    assert "no-cache" in first.headers["Cache-Control"]
+
+    again = revalidate(client, url, etag)
+    assert again.status_code == 304
+    assert again.headers["ETag"] == etag
+    assert again.data == b""
+
+
+def test_booking_change_invalidates(app, client, admin, room, tomorrow):
+    url = f"/rooms/{room.roomid}"
+    etag = client.get(url).headers["ETag"]
+
+    with app.app_context():
+        bookingid = book(admin, room, tomorrow, tomorrow + HOUR).bookingid
+    changed = revalidate(client, url, etag)
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+    etag = changed.headers["ETag"]
+
+    with app.app_context():
+        db.session.delete(db.session.get(Booking, bookingid))
+        db.session.commit()
+    assert revalidate(client, url, etag).status_code == 200
+
+
+def test_room_list_ignores_bookings(app, client, admin, room, tomorrow):
+    etag = client.get("/rooms").headers["ETag"]
+    with app.app_context():
+        book(admin, room, tomorrow, tomorrow + HOUR)
+    assert revalidate(client, "/rooms", etag).status_code == 304
+
+
+def test_waiting_messages_are_rendered(client, room):
+    url = f"/rooms/{room.roomid}"
+    etag = client.get(url).headers["ETag"]
+    with client.session_transaction() as session:
+        session["_flashes"] = [("success", "Booking cancelled successfully")]
+
+    response = revalidate(client, url, etag)
+    assert response.status_code == 200
+    assert b"Booking cancelled successfully" in response.data
+
+
+def test_signed_out_visitors_are_redirected(app, room):
+    response = app.test_client().get(f"/rooms/{room.roomid}")
+    assert response.status_code == 302
+    assert "ETag" not in response.headers
+
+
+def test_room_change_invalidates_the_list(app, client, room):
+    etag = client.get("/rooms").headers["ETag"]
+    with app.app_context():
+        db.session.get(Room, room.roomid).capacity = 10
+        db.session.commit()
+    response = revalidate(client, "/rooms", etag)
+    assert response.status_code == 200
+    assert b"10" in response.data
@@ -0,0 +1,26 @@
+from routes.events import max_subscribers
+from services import events
+
+
+def test_streams_leave_threads_for_pages():
+    assert max_subscribers({"WEB_THREADS": "8"}) == 6
+    assert max_subscribers({"WEB_THREADS": "1"}) == 0
+
+
+def test_subscriber_cap(app, client, room):
+    app.config["EVENTS_MAX_SUBSCRIBERS"] = 1
+    url = f"/events?room={room.roomid}"
+
+    first = client.get(url)
+    assert first.status_code == 200
+    assert len(events.broker) == 1
+    assert client.get(url).status_code == 503
+
+    first.close()
+    assert len(events.broker) == 0
+    client.get(url).close()
+
+
+def test_room_page_listens(client, room):
+    response = client.get(f"/rooms/{room.roomid}")
+    assert f"/events?room={room.roomid}".encode() in response.data
@@ -0,0 +1,24 @@
+import pytest
+
+from app import create_app
+from services import metrics
+
+
+def test_failed_request_is_not_sampled_for_ever(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "sampler", None)
+    app = create_app(
+        {
+            "TESTING": True,
+            "SECRET_KEY": "test",
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'test.db'}",
+            "PROFILER_INTERVAL": 0.001,
+        }
+    )
+
+    @app.route("/boom")
+    def boom():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        app.test_client().get("/boom")
+    assert metrics.sampler._active == {}
@@ -0,0 +1,107 @@
+from datetime import date, datetime, timedelta
+
+from models import BookingSeries
+from services.recurrence import Recurrence, first_clash, series_clash
+
+HOUR = timedelta(hours=1)
+
+
+def recurrence(begin, frequency, interval=1, until=None, count=None, skip=()):
+    return Recurrence(
+        begin, begin + HOUR, frequency, interval, until, count, frozenset(skip)
+    )
+
+
+def starts(rec, *window):
+    return [start for start, _ in rec.occurrences(*window)]
+
+
+def test_weekly_count_and_exceptions():
+    begin = datetime(2030, 1, 7, 9)
+    rec = recurrence(begin, "weekly", count=4, skip=[date(2030, 1, 14)])
+
+    assert starts(rec) == [
+        begin,
+        begin + timedelta(weeks=2),
+        begin + timedelta(weeks=3),
+    ]
+    # exceptions do not move the end of the series
+    last = begin + timedelta(weeks=3)
+    assert rec.last() == (last, last + HOUR)
+
+
+def test_until_is_the_last_start_date():
+    begin = datetime(2030, 1, 1, 9)
+    rec = recurrence(begin, "daily", interval=2, until=date(2030, 1, 7))
+    assert [start.day for start in starts(rec)] == [1, 3, 5, 7]
+
+
+def test_window_matches_full_expansion():
+    begin = datetime(2030, 1, 1, 9)
+    rec = recurrence(begin, "daily", count=500)
+    window = (datetime(2030, 6, 1, 9, 30), datetime(2030, 6, 4))
+    expected = [
+        start
+        for start in starts(rec)
+        if start < window[1] and start + HOUR > window[0]
+    ]
+    assert starts(rec, *window) == expected
+    assert len(expected) == 3
+
+
+def test_monthly_from_the_31st_skips_short_months():
+    rec = recurrence(datetime(2030, 1, 31, 9), "monthly", until=date(2030, 7, 31))
+    assert [start.month for start in starts(rec)] == [1, 3, 5, 7]
+    assert rec.last()[0] == datetime(2030, 7, 31, 9)
+
+
+def test_monthly_series_from_the_31st_refused(app, client, room):
+    begin = datetime(date.today().year + 1, 1, 31, 9)
+    response = client.post(
+        "/bookings/new",
+        data={
+            "roomid": room.roomid,
+            "timebegin": begin.isoformat(),
+            "timefinish": (begin + HOUR).isoformat(),
+            "repeat": "monthly",
+            "count": "6",
+        },
+    )
+    assert b"Monthly bookings must start on or before day 28" in response.data
+    with app.app_context():
+        assert BookingSeries.query.count() == 0
+
+
+def test_monthly_series_from_the_28th(app, client, room):
+    begin = datetime(date.today().year + 1, 1, 28, 9)
+    response = client.post(
+        "/bookings/new",
+        data={
+            "roomid": room.roomid,
+            "timebegin": begin.isoformat(),
+            "timefinish": (begin + HOUR).isoformat(),
+            "repeat": "monthly",
+            "count": "6",
+        },
+    )
+    assert response.status_code == 302
+    with app.app_context():
+        rec = Recurrence.from_series(BookingSeries.query.one())
+    assert len(starts(rec)) == 6
+    assert rec.last()[0] == begin.replace(month=6)
+
+
+def test_series_clash():
+    weekly = recurrence(datetime(2030, 1, 7, 9), "weekly", count=10)
+    daily_later = recurrence(datetime(2030, 1, 1, 11), "daily", count=100)
+    assert series_clash(weekly, daily_later) is None
+
+    fortnightly = recurrence(datetime(2030, 1, 21, 9, 30), "weekly", 2, count=3)
+    (a, b) = series_clash(weekly, fortnightly)
+    assert a[0] == datetime(2030, 1, 21, 9)
+    assert b[0] == datetime(2030, 1, 21, 9, 30)
+
+
+def test_first_clash_touching_intervals():
+    assert first_clash([(0, 10), (20, 30)], [(10, 20), (30, 40)]) is None
+    assert first_clash([(0, 10)], [(5, 15)]) == ((0, 10), (5, 15))
@@ -0,0 +1,121 @@
+from datetime import timedelta
+
+import pytest
+
+from models import db, BookingSeries, Employee, RoomUtilisation, SeriesException
+from models import to_epoch
+from services import bulk, utilisation
+from services.booking_import import import_bookings
+from services.recurrence import Recurrence
+from tests.conftest import book
+
+pytestmark = pytest.mark.usefixtures("ctx")
+
+HOUR = timedelta(hours=1)
+
+
+def summary():
+    return {
+        (row.roomid, row.day, row.hour): row.seconds
+        for row in RoomUtilisation.query
+        if row.seconds
+    }
+
+
+def assert_matches_rebuild():
+    kept = summary()
+    utilisation.rebuild(echo=lambda message: None)
+    assert kept == summary()
+
+
+def add_series(employee, room, begin, frequency, count):
+    finish = begin + HOUR
+    recurrence = Recurrence(begin, finish, frequency, 1, None, count, frozenset())
+    series = BookingSeries(
+        employeeid=employee.employeeid,
+        roomid=room.roomid,
+        timebegin=begin.isoformat(),
+        timefinish=finish.isoformat(),
+        frequency=frequency,
+        interval=1,
+        count=count,
+        timebegin_epoch=to_epoch(begin),
+        lastfinish_epoch=to_epoch(recurrence.last()[1]),
+    )
+    db.session.add(series)
+    db.session.commit()
+    return series
+
+
+def test_bookings_split_at_hour_boundaries(admin, room, tomorrow):
+    book(admin, room, tomorrow + HOUR / 2, tomorrow + 2 * HOUR)
+
+    day = utilisation.day_number(tomorrow.date())
+    assert summary() == {
+        (room.roomid, day, tomorrow.hour): 1800,
+        (room.roomid, day, tomorrow.hour + 1): 3600,
+    }
+    assert_matches_rebuild()
+
+
+def test_create_move_and_cancel(admin, room, tomorrow):
+    first = book(admin, room, tomorrow, tomorrow + HOUR)
+    second = book(admin, room, tomorrow + 2 * HOUR, tomorrow + 3 * HOUR)
+    assert_matches_rebuild()
+
+    second.timebegin = (tomorrow + 4 * HOUR + HOUR / 4).isoformat()
+    second.timefinish = (tomorrow + 6 * HOUR).isoformat()
+    db.session.commit()
+    assert_matches_rebuild()
+
+    db.session.delete(first)
+    db.session.commit()
+    assert_matches_rebuild()
+
+
+def test_series_and_skipped_occurrences(admin, room, tomorrow):
+    series = add_series(admin, room, tomorrow, "daily", 5)
+    assert sum(summary().values()) == 5 * 3600
+
+    db.session.add(
+        SeriesException(
+            seriesid=series.seriesid,
+            date=(tomorrow + timedelta(days=2)).date().isoformat(),
+        )
+    )
+    db.session.commit()
+    assert sum(summary().values()) == 4 * 3600
+    assert_matches_rebuild()
+
+    db.session.delete(series)
+    db.session.commit()
+    assert summary() == {}
+    assert_matches_rebuild()
+
+
+def test_bulk_changes(admin, room, tomorrow):
+    rows = [
+        {
+            "employeeid": admin.employeeid,
+            "roomid": room.roomid,
+            "timebegin": (tomorrow + i * 2 * HOUR).isoformat(),
+            "timefinish": (tomorrow + (i * 2 + 1) * HOUR).isoformat(),
+        }
+        for i in range(4)
+    ]
+    import_bookings(enumerate(rows, start=1), chunk_size=3)
+    add_series(admin, room, tomorrow + timedelta(days=1), "weekly", 3)
+    assert_matches_rebuild()
+
+    result = bulk.cancel_bookings(tomorrow, tomorrow + timedelta(days=2))
+    assert result == (4, 1)
+    assert sum(summary().values()) == 2 * 3600
+    assert_matches_rebuild()
+
+    other = Employee(fname="A", lname="B", email="a@b", password="x")
+    db.session.add(other)
+    db.session.commit()
+    book(other, room, tomorrow + 8 * HOUR, tomorrow + 9 * HOUR)
+    bulk.offboard_employee(other)
+    assert sum(summary().values()) == 2 * 3600
+    assert_matches_rebuild()
@@ -0,0 +1,18 @@
+"""Entry point for running the app under a pre-forking WSGI server.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Run `flask --app app init-db` once first: workers never create or migrate
+the database themselves.
+"""
+
+import os
+
+from app import create_app
+
+# every worker has to sign sessions with the same key, or a user signed in
+# by one worker is signed out by the next
+if not (os.environ.get("SECRET_KEY") or os.environ.get("SECRET_KEY_FILE")):
+    raise RuntimeError("Set SECRET_KEY or SECRET_KEY_FILE before starting workers")
+
+app = create_app()